@@ -7,6 +7,7 @@
 
 import os
 import subprocess
+import tempfile
 
 from sgtk.platform import Application
 
@@ -24,6 +25,24 @@ class BackgroundPublisher(Application):
 
         tk_multi_bgpublish = self.import_module("tk_multi_bgpublish")
         self._constants = tk_multi_bgpublish.constants
+        self._monitor_io = tk_multi_bgpublish.monitor_io
+        self._worker_spool = tk_multi_bgpublish.worker_spool
+        self._shards = tk_multi_bgpublish.shards
+        self._resource_sampler = tk_multi_bgpublish.resource_sampler
+
+        # warm worker processes started by this session, indexed by spool folder. The process is None until the job
+        # queue has started it
+        self._warm_workers = {}
+
+        # the publish processes are queued to avoid running too many of them at the same time
+        self._job_queue = tk_multi_bgpublish.JobQueue(
+            self.get_setting("max_concurrent_jobs"),
+            logger=self.logger,
+            on_start_failed=lambda payload: self._monitor_io.fail_pending_job(
+                payload[1]
+            ),
+            run_in_main_thread=self.engine.async_execute_in_main_thread,
+        )
 
         if not self.engine.has_ui:
             return
@@ -36,10 +55,29 @@ class BackgroundPublisher(Application):
             {"short_name": "bg_publish_monitor"},
         )
 
+    def destroy_app(self):
+        """
+        Called as the application is being destroyed
+        """
+
+        # the job queue only lives in this session: start the jobs still waiting for a slot, otherwise they would never
+        # run and would be displayed as waiting to start forever
+        if self._job_queue.pending_count:
+            self.logger.info(
+                "Starting the {} queued background publish job(s)".format(
+                    self._job_queue.pending_count
+                )
+            )
+        self._job_queue.flush()
+
     @property
     def constants(self):
         return self._constants
 
+    @property
+    def monitor_io(self):
+        return self._monitor_io
+
     def create_dialog(self):
         """
         Shows the panel as a dialog.
@@ -101,11 +139,36 @@ class BackgroundPublisher(Application):
 
         return widget
 
-    def launch_publish_process(self, publish_tree_file_path):
+    @property
+    def worker_spool(self):
+        return self._worker_spool
+
+    @property
+    def shards(self):
+        return self._shards
+
+    @property
+    def resource_sampler(self):
+        return self._resource_sampler
+
+    @property
+    def job_queue(self):
+        return self._job_queue
+
+    def launch_publish_process(
+        self, publish_tree_file_path, priority=0, session_path=None
+    ):
         """
-        Launch the background publishing process
+        Queue the background publishing process. It will be started as soon as less than max_concurrent_jobs
+        processes are running.
+
+        The queued jobs which publish the same session file are run by a single process, which only opens the session
+        once. The jobs are only queued, and thus batched, if the max_concurrent_jobs setting is greater than 0.
 
         :param publish_tree_file_path: Path to the publish tree file where all the publish information are stored
+        :param priority: Priority of the job in the queue. Jobs with a higher priority are started first.
+        :param session_path: Path to the session file published by the job. If None, the job is never batched with
+            other jobs.
         """
 
         publish_app = self.engine.apps.get("tk-multi-publish2")
@@ -122,7 +185,7 @@ class BackgroundPublisher(Application):
             return
 
         monitor_file_path = os.path.join(
-            os.path.dirname(publish_tree_file_path), "monitor.yml"
+            os.path.dirname(publish_tree_file_path), self.constants.MONITOR_FILE_NAME
         )
         if not os.path.exists(monitor_file_path):
             self.logger.error(
@@ -160,6 +223,164 @@ class BackgroundPublisher(Application):
         elif self.context.project:
             entity_dict = self.context.project
 
+        pc_id = self.sgtk.pipeline_configuration.get_shotgun_id()
+
+        # the context is serialized once the process starts, which may be after the current context has changed
+        context = self.context
+
+        # in warm worker mode, the job is sent to the worker of the engine and pipeline configuration, which is only
+        # started if it isn't running yet
+        options = {}
+        snapshot_folder = os.path.dirname(publish_tree_file_path)
+
+        # let the publish process profile itself, the profiles being saved in the job folder
+        if self.get_setting("profile_worker"):
+            options["profile"] = True
+
+        if self.get_setting("use_warm_worker"):
+            spool_folder = self._worker_spool.get_spool_folder(
+                self.cache_location, self.engine.name, pc_id
+            )
+            request_file_path = self._worker_spool.submit_request(
+                spool_folder,
+                {
+                    "publish_tree": publish_tree_file_path,
+                    "monitor_file": monitor_file_path,
+                    "entity": entity_dict,
+                    "profile": options.get("profile", False),
+                },
+                priority=priority,
+            )
+            if self.__is_warm_worker_running(spool_folder):
+                return
+            options["worker_spool"] = spool_folder
+            options["idle_timeout"] = self.get_setting("worker_idle_timeout")
+            snapshot_folder = spool_folder
+
+        # in shard mode, the items are published by several processes at once, the job taking a single slot of the
+        # job queue. A warm worker always runs a job alone
+        shard_count = 1
+        if "worker_spool" not in options:
+            shard_count = max(1, self.get_setting("publish_shards"))
+
+        # modify the STARTUPINFO to run the subprocess in silent mode
+        startup_info = subprocess.STARTUPINFO()
+        startup_info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startup_info.wShowWindow |= subprocess.SW_HIDE
+
+        env = self.execute_hook_method("exec_info_hook", "get_subprocess_environment")
+
+        if "worker_spool" in options:
+            self._warm_workers[options["worker_spool"]] = None
+
+        def start_processes(batch=None):
+            """
+            Start the processes of the job.
+
+            :param batch: List of the (publish tree, monitor file) pairs of the jobs run by the same process, if the
+                job has been batched
+            :return: The list of the started processes
+            """
+
+            snapshots = []
+            processes = []
+            try:
+                # the shards only read the publish tree file: it is written once before they are started
+                if shard_count > 1:
+                    self._shards.prepare_publish_tree(publish_tree_file_path)
+
+                for shard in range(shard_count):
+                    process_options = dict(options)
+                    if shard_count > 1:
+                        process_options["shard"] = shard
+                        process_options["shard_count"] = shard_count
+                    if batch and len(batch) > 1:
+                        process_options["batch"] = batch
+                    # let the publish process start from the environment already resolved by this session instead of
+                    # bootstrapping the engine from scratch. Each process deletes its snapshot once read
+                    snapshot_file_path = self.__write_bootstrap_snapshot(
+                        context, snapshot_folder
+                    )
+                    snapshots.append(snapshot_file_path)
+                    process_options["bootstrap_snapshot"] = snapshot_file_path
+                    command = self.__get_command(
+                        executable_path,
+                        script_path,
+                        pc_id,
+                        entity_dict,
+                        publish_tree_file_path,
+                        monitor_file_path,
+                        process_options,
+                    )
+                    processes.append(
+                        subprocess.Popen(command, startupinfo=startup_info, env=env)
+                    )
+            except Exception:
+                # a job is either fully started or not at all: the snapshots hold the user credentials and a warm
+                # worker flagged as starting would prevent any other worker from being started for its spool folder
+                for process in processes:
+                    process.kill()
+                for snapshot_file_path in snapshots:
+                    if snapshot_file_path and os.path.exists(snapshot_file_path):
+                        os.remove(snapshot_file_path)
+                if "worker_spool" in options:
+                    self._warm_workers.pop(options["worker_spool"], None)
+                    # the job is reported as failed: it must not be run by the next worker. A worker which has already
+                    # claimed it is running it
+                    if not self._worker_spool.withdraw_request(request_file_path):
+                        self.logger.warning(
+                            "Couldn't start a warm worker: {} is run by another one".format(
+                                publish_tree_file_path
+                            )
+                        )
+                        return []
+                raise
+
+            if "worker_spool" in options:
+                self._warm_workers[options["worker_spool"]] = processes[0]
+            return processes
+
+        # the jobs opening the same session file in the same context can be run by the same process
+        batch_key = None
+        if session_path and shard_count == 1 and "worker_spool" not in options:
+            batch_key = (
+                self.engine.name,
+                pc_id,
+                str(entity_dict),
+                os.path.normcase(session_path),
+            )
+
+        self._job_queue.submit(
+            start_processes,
+            priority=priority,
+            name=publish_tree_file_path,
+            batch_key=batch_key,
+            payload=(publish_tree_file_path, monitor_file_path),
+        )
+
+    def __get_command(
+        self,
+        executable_path,
+        script_path,
+        pc_id,
+        entity_dict,
+        publish_tree_file_path,
+        monitor_file_path,
+        options,
+    ):
+        """
+        Build the command line of a background publishing process.
+
+        :param executable_path: Path to the executable running the publish process
+        :param script_path: Path to the script run by the publish process
+        :param pc_id: ID of the pipeline configuration to use when bootstrapping the engine
+        :param entity_dict: Flow Production Tracking dictionary of the entity to use when bootstrapping the engine
+        :param publish_tree_file_path: Path to the publish tree file
+        :param monitor_file_path: Path to the monitor file
+        :param options: Dictionary of extra options passed to the publish process
+        :return: The command line as a list of arguments
+        """
+
         # in case of VRED, the command line is slightly different
         if self.engine.name == "tk-vred":
 
@@ -171,12 +392,13 @@ class BackgroundPublisher(Application):
             python_cmd += "import run_publish_process;"
             python_cmd += (
                 "run_publish_process.main('{engine_name}', {pc_id}, {entity_dict}, r'{publish_tree_path}', "
-                "r'{monitor_file_path}');".format(
+                "r'{monitor_file_path}', {options});".format(
                     engine_name=self.engine.name,
-                    pc_id=self.sgtk.pipeline_configuration.get_shotgun_id(),
+                    pc_id=pc_id,
                     entity_dict=entity_dict,
                     publish_tree_path=publish_tree_file_path,
                     monitor_file_path=monitor_file_path,
+                    options=options,
                 )
             )
 
@@ -185,7 +407,7 @@ class BackgroundPublisher(Application):
             # -hide_gui. So, we will need to add the '-insecure_python' flag to allow running
             # our script. The alternative not using this flag, would be that the user must
             # turn of Python Sandbox from Preferences>Scripts, or specify our module as allowed
-            cmd = [
+            return [
                 executable_path,
                 "-hide_gui",
                 "-insecure_python",
@@ -193,22 +415,65 @@ class BackgroundPublisher(Application):
                 python_cmd,
             ]
 
-        else:
-            cmd = [
-                executable_path,
-                script_path,
-                self.engine.name,
-                str(self.sgtk.pipeline_configuration.get_shotgun_id()),
-                str(entity_dict),
-                publish_tree_file_path,
-                monitor_file_path,
-            ]
+        return [
+            executable_path,
+            script_path,
+            self.engine.name,
+            str(pc_id),
+            str(entity_dict),
+            publish_tree_file_path,
+            monitor_file_path,
+            str(options),
+        ]
+
+    def __write_bootstrap_snapshot(self, context, folder):
+        """
+        Write a context, along with the pipeline configuration it belongs to and the current user credentials, so the
+        publish process can start the engine without resolving the configuration again.
 
-        # modify the STARTUPINFO to run the subprocess in silent mode
-        startup_info = subprocess.STARTUPINFO()
-        startup_info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        startup_info.wShowWindow |= subprocess.SW_HIDE
+        :param context: The context to serialize
+        :param folder: Path to the folder where the snapshot will be written
+        :return: Path to the snapshot file or None if the snapshot couldn't be written
+        """
 
-        env = self.execute_hook_method("exec_info_hook", "get_subprocess_environment")
+        try:
+            serialized_context = context.serialize(with_user_credentials=True)
+        except Exception as e:
+            self.logger.debug("Couldn't serialize the current context: {}".format(e))
+            return None
+
+        # the snapshot contains the user credentials: the temporary file is only readable by the current user and
+        # the publish process deletes it once read
+        fd, snapshot_file_path = tempfile.mkstemp(
+            prefix="bootstrap_", suffix=".snapshot", dir=folder
+        )
+        with os.fdopen(fd, "w") as fp:
+            fp.write(serialized_context)
+
+        return snapshot_file_path
+
+    def __is_warm_worker_running(self, spool_folder):
+        """
+        Check if a warm worker is serving a spool folder or is about to.
+
+        :param spool_folder: Path to the spool folder of the worker
+        :return: True if a worker is running or queued, False otherwise
+        """
 
-        subprocess.Popen(cmd, startupinfo=startup_info, env=env)
+        # the worker may have been started by another session
+        if self._worker_spool.is_worker_alive(spool_folder):
+            return True
+
+        # the worker started by this session may still be waiting in the job queue or bootstrapping. A worker which is
+        # still alive but exiting won't serve the new requests anymore
+        if spool_folder in self._warm_workers:
+            process = self._warm_workers[spool_folder]
+            if process is None:
+                return True
+            if process.poll() is None and not self._worker_spool.is_worker_exiting(
+                spool_folder
+            ):
+                return True
+            del self._warm_workers[spool_folder]
+
+        return False
@@ -0,0 +1,516 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+"""
+Benchmark the monitor data path of the background publish app on synthetic jobs.
+
+A cache folder is filled with N publish sessions of M items of K tasks each, created by the post_publish hook. Most of
+the jobs are then run to the end by simulated publish processes while the others keep running during the benchmark,
+streaming their status changes. The following steps are measured:
+
+- the serialization of the jobs by ``PostPhase.post_publish``
+- the status changes written by ``change_progress_status``
+- the reload of the monitor data: cold, after some status changes and without any change
+- the model operations applying the reloaded data, the expansion of the sessions and the full reload of the dialog,
+  when PySide6 or PySide2 is installed
+
+Each step reports its latency, the number of monitor files parsed and the memory growth of the process. Qt runs
+offscreen so the benchmark can be run on a headless machine:
+
+    python benchmarks/run_benchmarks.py --sessions 200 --items 20 --tasks 3
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import stand_ins
+import synthetic
+
+# functions reading the monitor files, counted during each benchmark
+PARSE_FUNCTIONS = {
+    "monitor_io": [
+        "load_monitor_data",
+        "read_events",
+        "read_job_index",
+        "get_fingerprint",
+    ],
+    "resource_sampler": ["load_job_resources"],
+    "progress_channel": ["get_channels"],
+}
+
+
+class CallCounter(object):
+    """
+    Count the calls made to some module functions.
+    """
+
+    def __init__(self, functions):
+        """
+        Class constructor
+
+        :param functions: Dictionary of the lists of the function names to count, indexed by module
+        """
+
+        self.counts = {}
+        self.__originals = []
+        for module, names in functions.items():
+            for name in names:
+                self.counts[name] = 0
+                original = getattr(module, name)
+                self.__originals.append((module, name, original))
+                setattr(module, name, self.__wrap(name, original))
+
+    def restore(self):
+        """
+        Restore the original functions.
+        """
+        for module, name, original in self.__originals:
+            setattr(module, name, original)
+        self.__originals = []
+
+    def __wrap(self, name, function):
+        """
+        Wrap a function to count its calls.
+
+        :param name: Name of the function
+        :param function: The function to wrap
+        :return: The wrapper
+        """
+
+        def wrapper(*args, **kwargs):
+            self.counts[name] += 1
+            return function(*args, **kwargs)
+
+        return wrapper
+
+
+class Benchmark(object):
+    """
+    Samples of a measured step.
+    """
+
+    def __init__(self, name, counter=None, trace_memory=False):
+        """
+        Class constructor
+
+        :param name: Name of the benchmark
+        :param counter: The :class:`CallCounter` instance counting the parsed files, if any
+        :param trace_memory: If True, the peak of the memory allocated by Python is traced, at the cost of slower
+            samples
+        """
+
+        self.name = name
+        self.samples = []
+        self.parses = {}
+        self.extra = {}
+        self.rss_growth = 0
+        self.python_peak = None
+
+        self._counter = counter
+        self._trace_memory = trace_memory
+        self._read_usage = importlib.import_module(
+            stand_ins.PACKAGE_NAME + ".resource_sampler"
+        ).read_usage
+
+    @contextlib.contextmanager
+    def measure(self):
+        """
+        Measure a sample of the step run within the context.
+        """
+
+        counts = dict(self._counter.counts) if self._counter else {}
+        rss = self._read_usage()["rss"]
+        if self._trace_memory:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.append(time.perf_counter() - start)
+
+            if self._trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.python_peak = max(self.python_peak or 0, peak)
+            if rss is not None:
+                self.rss_growth += self._read_usage()["rss"] - rss
+            for name, count in (self._counter.counts if self._counter else {}).items():
+                if count - counts[name]:
+                    self.parses[name] = self.parses.get(name, 0) + count - counts[name]
+
+    def add_sample(self, duration):
+        """
+        Add a sample measured by the caller.
+
+        :param duration: Duration of the sample, in seconds
+        """
+        self.samples.append(duration)
+
+    def summarize(self):
+        """
+        Summarize the samples.
+
+        :return: A dictionary of the figures of the benchmark
+        """
+
+        samples = sorted(self.samples)
+        count = len(samples)
+        return {
+            "name": self.name,
+            "samples": count,
+            "total_s": sum(samples),
+            "mean_ms": sum(samples) / count * 1000.0 if count else None,
+            "p95_ms": samples[int(round(0.95 * (count - 1)))] * 1000.0
+            if count
+            else None,
+            "max_ms": samples[-1] * 1000.0 if count else None,
+            "rss_growth_mb": self.rss_growth / 1024.0**2,
+            "python_peak_mb": self.python_peak / 1024.0**2
+            if self.python_peak is not None
+            else None,
+            "parses": self.parses,
+            "extra": self.extra,
+        }
+
+
+def parse_args(argv):
+    """
+    Parse the command line arguments.
+
+    :param argv: The command line arguments
+    :return: The parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the monitor data path of the background publish app."
+    )
+    parser.add_argument("--sessions", type=int, default=50, help="Number of jobs")
+    parser.add_argument("--items", type=int, default=10, help="Items per job")
+    parser.add_argument("--tasks", type=int, default=3, help="Tasks per item")
+    parser.add_argument(
+        "--running",
+        type=float,
+        default=0.2,
+        help="Ratio of the jobs still running during the benchmark",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=10, help="Number of incremental reloads"
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=2,
+        help="Tasks processed by each running job between two reloads",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        default=0,
+        help="Number of the most recent jobs read at first, all of them if 0",
+    )
+    parser.add_argument(
+        "--nested",
+        action="store_true",
+        help="Add the items under a parent item, like the files of a scene",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace the memory allocated by Python, which slows the samples down",
+    )
+    parser.add_argument(
+        "--cache-folder", help="Folder to create the jobs in, a temporary one if unset"
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the jobs once the benchmark is done"
+    )
+    parser.add_argument("--json", help="Path to a file to save the results to")
+    return parser.parse_args(argv)
+
+
+def create_jobs(app, post_phase, args, benchmark):
+    """
+    Create the synthetic jobs through the post_publish hook.
+
+    :param app: The :class:`stand_ins.App` instance
+    :param post_phase: The post phase hook instance
+    :param args: The parsed command line arguments
+    :param benchmark: The :class:`Benchmark` instance measuring the hook
+    :return: A list of (job folder, publish tree) tuples, from the oldest job to the most recent one
+    """
+
+    engine_folder = os.path.join(app.cache_location, app.engine.name)
+
+    jobs = []
+    for session_index in range(args.sessions):
+        tree = synthetic.create_publish_tree(
+            "Session {}".format(session_index), args.items, args.tasks, args.nested
+        )
+        known_folders = (
+            set(os.listdir(engine_folder)) if os.path.isdir(engine_folder) else set()
+        )
+        with benchmark.measure():
+            post_phase.post_publish(tree)
+        (job_folder,) = (
+            set(os.listdir(engine_folder))
+            - known_folders
+            - {
+                app.constants.INDEX_FILE_NAME,
+                app.constants.INDEX_LOCK_FILE_NAME,
+            }
+        )
+        jobs.append((os.path.join(engine_folder, job_folder), tree))
+
+    return jobs
+
+
+def run_jobs(app, script, jobs, args, benchmark):
+    """
+    Run the synthetic jobs with simulated publish processes, measuring each status change.
+
+    :param app: The :class:`stand_ins.App` instance
+    :param script: The imported publish process script
+    :param jobs: List of (job folder, publish tree) tuples
+    :param args: The parsed command line arguments
+    :param benchmark: The :class:`Benchmark` instance measuring the status changes
+    :return: The list of the :class:`synthetic.SimulatedWorker` instances of the jobs still running
+    """
+
+    change_progress_status = script.change_progress_status
+
+    def measured_change_progress_status(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return change_progress_status(*args, **kwargs)
+        finally:
+            benchmark.add_sample(time.perf_counter() - start)
+
+    # the most recent jobs are the ones still running
+    running_count = int(round(len(jobs) * args.running))
+    running_workers = []
+
+    script.change_progress_status = measured_change_progress_status
+    try:
+        for job_index, (job_folder, tree) in enumerate(jobs):
+            worker = synthetic.SimulatedWorker(app, script, job_folder, tree)
+            if job_index < len(jobs) - running_count:
+                worker.advance()
+            else:
+                # stop in the middle of the publish step
+                worker.advance(args.items * args.tasks // 2)
+                running_workers.append(worker)
+    finally:
+        script.change_progress_status = change_progress_status
+
+    return running_workers
+
+
+def report(results, args, qt_available):
+    """
+    Print the results of the benchmarks.
+
+    :param results: List of the benchmark summaries
+    :param args: The parsed command line arguments
+    :param qt_available: True if the Qt benchmarks have been run
+    """
+
+    print(
+        "{} jobs x {} items x {} tasks, {} running, {} rounds of {} steps{}".format(
+            args.sessions,
+            args.items,
+            args.tasks,
+            int(round(args.sessions * args.running)),
+            args.rounds,
+            args.steps,
+            "" if qt_available else " (no Qt binding: model and dialog skipped)",
+        )
+    )
+
+    header = "{:<32} {:>7} {:>10} {:>10} {:>10} {:>9}  {}".format(
+        "benchmark", "samples", "mean ms", "p95 ms", "max ms", "rss +MB", "parses"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        details = ["{}={}".format(k, v) for k, v in sorted(result["parses"].items())]
+        details += ["{}={}".format(k, v) for k, v in sorted(result["extra"].items())]
+        if result["python_peak_mb"] is not None:
+            details.append("python_peak_mb={:.1f}".format(result["python_peak_mb"]))
+        print(
+            "{:<32} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>9.1f}  {}".format(
+                result["name"],
+                result["samples"],
+                result["mean_ms"] or 0.0,
+                result["p95_ms"] or 0.0,
+                result["max_ms"] or 0.0,
+                result["rss_growth_mb"],
+                " ".join(details),
+            )
+        )
+
+
+def main(argv=None):
+    """
+    Run the benchmarks.
+
+    :param argv: The command line arguments. If None, the arguments of the process are used.
+    """
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    cache_location = args.cache_folder or tempfile.mkdtemp(prefix="bg_publish_bench_")
+    app, package = stand_ins.install(
+        cache_location,
+        {
+            "use_file_watcher": False,
+            "stream_progress": False,
+            "history_max_sessions": args.history,
+        },
+    )
+    post_phase = stand_ins.load_file(
+        os.path.join(stand_ins.ROOT_FOLDER, "hooks", "post_phase.py"), "post_phase"
+    ).PostPhase()
+    script = stand_ins.load_file(
+        os.path.join(stand_ins.ROOT_FOLDER, "scripts", "run_publish_process.py"),
+        "run_publish_process",
+    )
+    monitor_reader = importlib.import_module(stand_ins.PACKAGE_NAME + ".monitor_reader")
+    qt_available = app.qt_application is not None
+
+    counter = CallCounter(
+        {
+            importlib.import_module(stand_ins.PACKAGE_NAME + "." + name): functions
+            for name, functions in PARSE_FUNCTIONS.items()
+        }
+    )
+    results = []
+    running_workers = []
+
+    def create_benchmark(name):
+        benchmark = Benchmark(name, counter, args.trace_memory)
+        results.append(benchmark)
+        return benchmark
+
+    try:
+        jobs = create_jobs(
+            app, post_phase, args, create_benchmark("post_publish serialization")
+        )
+        running_workers = run_jobs(
+            app, script, jobs, args, create_benchmark("change_progress_status")
+        )
+
+        cache_folder = os.path.join(cache_location, app.engine.name)
+        reader = monitor_reader.MonitorReader(cache_folder, max_sessions=args.history)
+        model = None
+        model_signals = {}
+        if qt_available:
+            model = package.model.PublishTreeModel(None)
+            for signal_name in ["dataChanged", "rowsInserted", "rowsRemoved"]:
+                model_signals[signal_name] = 0
+                getattr(model, signal_name).connect(
+                    lambda *args, n=signal_name: model_signals.update(
+                        {n: model_signals[n] + 1}
+                    )
+                )
+
+        def apply_diff(benchmark, diff):
+            signals = dict(model_signals)
+            with benchmark.measure():
+                for tree_file in model.apply_diff(diff):
+                    reader.freeze(tree_file)
+            for name, count in model_signals.items():
+                benchmark.extra[name] = (
+                    benchmark.extra.get(name, 0) + count - signals[name]
+                )
+
+        # cold reload, like when the monitor is opened
+        benchmark = create_benchmark("reload cold")
+        with benchmark.measure():
+            diff = reader.read()
+        benchmark.extra["added"] = len(diff["added"])
+        if model:
+            apply_diff(create_benchmark("model apply_diff cold"), diff)
+
+        # reload after the running jobs have made some progress
+        benchmark = create_benchmark("reload incremental")
+        model_benchmark = create_benchmark("model update_publish_trees")
+        for _ in range(args.rounds):
+            for worker in running_workers:
+                worker.advance(args.steps)
+            with benchmark.measure():
+                diff = reader.read()
+            benchmark.extra["statuses"] = benchmark.extra.get("statuses", 0) + sum(
+                len(u["task_statuses"]) for u in diff["updated"]
+            )
+            if model:
+                apply_diff(model_benchmark, diff)
+        if not model:
+            results.remove(model_benchmark)
+
+        # reload while nothing has changed
+        benchmark = create_benchmark("reload idle")
+        for _ in range(args.rounds):
+            with benchmark.measure():
+                reader.read()
+
+        if model:
+            # expand all the sessions, reading their tasks right away instead of in a background thread
+            model.session_load_requested.connect(
+                lambda log_folder: model.populate_session(
+                    log_folder, reader.read_session(log_folder)
+                )
+            )
+            benchmark = create_benchmark("model fetchMore")
+            for row in range(model.rowCount()):
+                index = model.index(row, 0)
+                if model.canFetchMore(index):
+                    with benchmark.measure():
+                        model.fetchMore(index)
+
+            # the whole dialog, reloading its data through its background task manager
+            dialog = package.AppDialog()
+            task_manager = dialog._bg_task_manager
+            benchmark = create_benchmark("dialog reload cold")
+            with benchmark.measure():
+                task_manager.run_pending()
+            benchmark = create_benchmark("dialog reload incremental")
+            for _ in range(args.rounds):
+                for worker in running_workers:
+                    worker.advance(args.steps)
+                with benchmark.measure():
+                    task_manager.run_pending()
+            dialog.close()
+
+    finally:
+        counter.restore()
+        for worker in running_workers:
+            worker.advance()
+        if not args.keep and not args.cache_folder:
+            shutil.rmtree(cache_location, ignore_errors=True)
+
+    summaries = [r.summarize() for r in results]
+    report(summaries, args, qt_available)
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(
+                {"arguments": vars(args), "qt": qt_available, "results": summaries},
+                fp,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Minimal stand-ins for the Toolkit core, the frameworks and the publish API, so the app code can be benchmarked outside
+# of a DCC on a headless machine.
+#
+# Only what the benchmarked code paths use is provided: the sgtk logging, hook and platform entry points, the Qt
+# binding (run offscreen), the qtwidgets delegates, the shotgunutils background task manager and the publish tree. The
+# Qt parts are only available when PySide6 or PySide2 is installed.
+
+import collections
+import importlib.util
+import json
+import logging
+import os
+import sys
+import types
+
+import yaml
+
+APP_NAME = "tk-multi-bg-publish"
+ENGINE_NAME = "tk-benchmark"
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYTHON_FOLDER = os.path.join(ROOT_FOLDER, "python")
+PACKAGE_NAME = "tk_multi_bgpublish"
+
+
+def load_qt():
+    """
+    Load the Qt binding, rendering offscreen.
+
+    :return: A tuple (QtCore, QtGui) where QtGui also holds the QtWidgets classes, as exposed by sgtk. (None, None) if
+        no binding is installed.
+    """
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    for binding in ["PySide6", "PySide2"]:
+        try:
+            qt_core = importlib.import_module(binding + ".QtCore")
+            qt_gui = importlib.import_module(binding + ".QtGui")
+            qt_widgets = importlib.import_module(binding + ".QtWidgets")
+        except ImportError:
+            continue
+
+        # sgtk exposes the widgets in QtGui, like Qt4 did. The bindings may load their classes lazily: go through
+        # their names instead of their dictionary
+        gui = types.ModuleType("QtGui")
+        for module in [qt_widgets, qt_gui]:
+            for name in dir(module):
+                if not name.startswith("__"):
+                    setattr(gui, name, getattr(module, name))
+
+        # the generated UI files still use the Qt4 translate signature, which sgtk patches back in
+        class QApplication(qt_widgets.QApplication):
+            UnicodeUTF8 = 0
+
+            @staticmethod
+            def translate(context, text, disambiguation=None, encoding=None, n=-1):
+                return qt_core.QCoreApplication.translate(
+                    context, text, disambiguation, n
+                )
+
+        gui.QApplication = QApplication
+        return qt_core, gui
+
+    return None, None
+
+
+def load_file(file_path, module_name):
+    """
+    Import a Python file which isn't part of a package, like a hook or a script.
+
+    :param file_path: Path to the Python file
+    :param module_name: Name to give to the module
+    :return: The imported module
+    """
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_default_settings():
+    """
+    Read the default value of each app setting from the app manifest.
+
+    :return: A dictionary of the setting values indexed by setting name
+    """
+    with open(os.path.join(ROOT_FOLDER, "info.yml"), "r") as fp:
+        manifest = yaml.safe_load(fp)
+    return {
+        name: setting.get("default_value")
+        for name, setting in manifest["configuration"].items()
+    }
+
+
+class Engine(object):
+    """
+    Stand-in for the current engine.
+    """
+
+    def __init__(self, app):
+        self.name = ENGINE_NAME
+        self.apps = {APP_NAME: app}
+
+
+class App(object):
+    """
+    Stand-in for the background publish app, which is also the current bundle of the app modules.
+    """
+
+    def __init__(self, cache_location, settings=None):
+        """
+        Class constructor
+
+        :param cache_location: Path to the folder where the app stores its jobs
+        :param settings: Dictionary of the settings overriding their default value
+        """
+
+        self.cache_location = cache_location
+        self.engine = Engine(self)
+        self.logger = logging.getLogger(APP_NAME)
+
+        self._settings = get_default_settings()
+        self._settings.update(settings or {})
+
+        # filled once the app package has been imported
+        self.constants = None
+        self.monitor_io = None
+
+        # a widget can only be created once a Qt application exists
+        self.qt_application = None
+
+    def get_setting(self, name, default=None):
+        return self._settings.get(name, default)
+
+
+class Hook(object):
+    """
+    Stand-in for the base class of the hooks.
+    """
+
+    logger = logging.getLogger(APP_NAME + ".hooks")
+
+
+def _create_task_manager_class(qt_core):
+    """
+    Create the background task manager stand-in class.
+
+    :param qt_core: The QtCore module
+    :return: The class
+    """
+
+    class BackgroundTaskManager(qt_core.QObject):
+        """
+        Stand-in for the shotgunutils background task manager.
+
+        The tasks are only run when :meth:`run_pending` is called, from the calling thread, so their duration can be
+        measured. The delay given to the polling reloads is skipped: the monitor is idle during that time.
+        """
+
+        task_completed = qt_core.Signal(int, object, object)
+        task_failed = qt_core.Signal(int, object, str, str)
+
+        def __init__(self, parent, max_threads=1, **kwargs):
+            qt_core.QObject.__init__(self, parent)
+            self._tasks = []
+            self._next_uid = 0
+
+        def start_processing(self):
+            pass
+
+        def shut_down(self):
+            self._tasks = []
+
+        def add_task(self, cb, task_kwargs=None, **kwargs):
+            self._next_uid += 1
+            self._tasks.append((self._next_uid, cb, dict(task_kwargs or {})))
+            return self._next_uid
+
+        def run_pending(self):
+            """
+            Run the tasks queued so far. The tasks they queue themselves are kept for the next call.
+
+            :return: The number of tasks run
+            """
+            tasks, self._tasks = self._tasks, []
+            for uid, cb, task_kwargs in tasks:
+                task_kwargs.pop("timeout", None)
+                self.task_completed.emit(uid, None, cb(**task_kwargs))
+            return len(tasks)
+
+    return BackgroundTaskManager
+
+
+def _create_delegates_module(qt_core, qt_gui):
+    """
+    Create the stand-in of the qtwidgets delegates module.
+
+    :param qt_core: The QtCore module
+    :param qt_gui: The QtGui module
+    :return: The module
+    """
+
+    delegates = types.ModuleType("delegates")
+
+    class ViewItemRolesMixin(object):
+        def initialize_roles(self, next_available_role):
+            for name in [
+                "VIEW_ITEM_HEADER_ROLE",
+                "VIEW_ITEM_TEXT_ROLE",
+                "VIEW_ITEM_ICON_ROLE",
+                "VIEW_ITEM_SEPARATOR_ROLE",
+                "VIEW_ITEM_HEIGHT_ROLE",
+            ]:
+                setattr(type(self), name, next_available_role)
+                next_available_role += 1
+            return next_available_role
+
+    # the roles are read from the class by the delegate, before any model is created
+    ViewItemRolesMixin.initialize_roles(ViewItemRolesMixin(), qt_core.Qt.UserRole)
+
+    class ViewItemDelegate(qt_gui.QStyledItemDelegate):
+        Padding = collections.namedtuple("Padding", ["top", "right", "bottom", "left"])
+        (LEFT, RIGHT, TOP, BOTTOM, CENTER) = range(5)
+
+        def __init__(self, view):
+            qt_gui.QStyledItemDelegate.__init__(self, view)
+            self.actions = []
+
+        def add_action(self, action, position):
+            self.actions.append((action, position))
+
+    delegates.ViewItemRolesMixin = ViewItemRolesMixin
+    delegates.ViewItemDelegate = ViewItemDelegate
+    return delegates
+
+
+def install(cache_location, settings=None):
+    """
+    Install the stand-ins and import the app package.
+
+    :param cache_location: Path to the folder where the app stores its jobs
+    :param settings: Dictionary of the settings overriding their default value
+    :return: A tuple (app, package) where package is the imported app package. Without any Qt binding, only its
+        modules which don't rely on Qt can be imported.
+    """
+
+    app = App(cache_location, settings)
+    qt_core, qt_gui = load_qt()
+
+    tank_vendor = types.ModuleType("tank_vendor")
+    tank_vendor.yaml = yaml
+    sys.modules["tank_vendor"] = tank_vendor
+
+    sgtk = types.ModuleType("sgtk")
+    sgtk.LogManager = types.SimpleNamespace(get_logger=logging.getLogger)
+    sgtk.get_hook_baseclass = lambda: Hook
+    platform = types.ModuleType("sgtk.platform")
+    platform.current_bundle = lambda: app
+    platform.current_engine = lambda: app.engine
+    sgtk.platform = platform
+    sys.modules["sgtk"] = sgtk
+    sys.modules["sgtk.platform"] = platform
+
+    if qt_core is None:
+        # register the package without running its __init__, which imports the Qt widgets
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [os.path.join(PYTHON_FOLDER, PACKAGE_NAME)]
+        sys.modules[PACKAGE_NAME] = package
+    else:
+        qt = types.ModuleType("sgtk.platform.qt")
+        qt.QtCore = qt_core
+        qt.QtGui = qt_gui
+        platform.qt = qt
+        sys.modules["sgtk.platform.qt"] = qt
+
+        frameworks = {
+            ("tk-framework-qtwidgets", "delegates"): _create_delegates_module(
+                qt_core, qt_gui
+            ),
+            ("tk-framework-shotgunutils", "shotgun_globals"): types.SimpleNamespace(
+                register_bg_task_manager=lambda manager: None,
+                unregister_bg_task_manager=lambda manager: None,
+            ),
+            ("tk-framework-shotgunutils", "task_manager"): types.SimpleNamespace(
+                BackgroundTaskManager=_create_task_manager_class(qt_core)
+            ),
+        }
+        platform.import_framework = lambda name, module: frameworks[(name, module)]
+
+        if not qt_gui.QApplication.instance():
+            app.qt_application = qt_gui.QApplication([])
+
+    if PYTHON_FOLDER not in sys.path:
+        sys.path.insert(0, PYTHON_FOLDER)
+    package = importlib.import_module(PACKAGE_NAME)
+
+    app.constants = importlib.import_module(PACKAGE_NAME + ".constants")
+    app.monitor_io = importlib.import_module(PACKAGE_NAME + ".monitor_io")
+
+    return app, package
+
+
+# ---------------------------------------------------------------------------------------------
+# Publish API
+# ---------------------------------------------------------------------------------------------
+
+
+class PublishSetting(object):
+    """
+    Stand-in for a setting of a publish task.
+    """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def to_dict(self):
+        return {"name": self.name, "value": self.value}
+
+
+class PublishProperties(dict):
+    """
+    Stand-in for the properties of a publish item, which can be accessed as keys or as attributes.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class PublishTask(object):
+    """
+    Stand-in for a publish task.
+    """
+
+    def __init__(self, name, settings=None, active=True):
+        self.name = name
+        self.active = active
+        self.settings = settings or {}
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "active": self.active,
+            "settings": {k: s.to_dict() for k, s in self.settings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, task_dict, serialization_version, item=None):
+        return cls(
+            task_dict["name"],
+            {
+                k: PublishSetting(s["name"], s["value"])
+                for k, s in task_dict["settings"].items()
+            },
+            task_dict["active"],
+        )
+
+
+class PublishItem(object):
+    """
+    Stand-in for a publish item.
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.properties = PublishProperties()
+        self.tasks = []
+        self.children = []
+        self.is_root = parent is None
+        if parent:
+            parent.children.append(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "properties": dict(self.properties),
+            "tasks": [t.to_dict() for t in self.tasks],
+            "children": [c.to_dict() for c in self.children],
+        }
+
+    def __iter__(self):
+        for child in self.children:
+            yield child
+            for descendant in child:
+                yield descendant
+
+
+class PublishTree(object):
+    """
+    Stand-in for the publish tree, iterating over its items depth first.
+    """
+
+    def __init__(self):
+        self.root_item = PublishItem("root")
+
+    def __iter__(self):
+        return iter(self.root_item)
+
+    def save_file(self, file_path):
+        with open(file_path, "w") as fp:
+            json.dump({"root_item": self.root_item.to_dict()}, fp)
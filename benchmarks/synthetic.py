@@ -0,0 +1,132 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Generation of synthetic background publish jobs.
+#
+# The jobs are created by the post_publish hook from publish trees of N items of M tasks each, then their status
+# changes are written by simulated publish processes going through the tasks exactly like the real one does.
+
+import os
+
+import stand_ins
+
+
+def create_publish_tree(session_name, item_count, task_count, nested=False):
+    """
+    Create a publish tree to publish in background.
+
+    :param session_name: Name of the publish session
+    :param item_count: Number of items of the tree
+    :param task_count: Number of tasks of each item
+    :param nested: If True, the items are children of a parent item without any task, like the files of a scene
+    :return: A :class:`stand_ins.PublishTree` instance
+    """
+
+    tree = stand_ins.PublishTree()
+    tree.root_item.properties.update(
+        {
+            "session_name": session_name,
+            "bg_processing": True,
+            "in_bg_process": False,
+        }
+    )
+
+    parent_item = tree.root_item
+    if nested:
+        parent_item = stand_ins.PublishItem("Scene", tree.root_item)
+
+    for item_index in range(item_count):
+        item = stand_ins.PublishItem("Item {}".format(item_index), parent_item)
+        for task_index in range(task_count):
+            item.tasks.append(
+                stand_ins.PublishTask(
+                    "Task {}".format(task_index),
+                    {"Name": stand_ins.PublishSetting("Name", "value")},
+                )
+            )
+
+    return tree
+
+
+class SimulatedWorker(object):
+    """
+    Simulated background publish process, writing the status changes of a job without running its tasks.
+
+    Each step processes the next task: the statuses are changed by the ``task_generator`` of the publish process
+    script, so the event log and the snapshot are written exactly like the real process writes them.
+    """
+
+    def __init__(self, app, script, job_folder, tree):
+        """
+        Class constructor
+
+        :param app: The :class:`stand_ins.App` instance
+        :param script: The imported publish process script
+        :param job_folder: Path to the job folder
+        :param tree: The publish tree of the job, as modified by the post_publish hook
+        """
+
+        self._app = app
+        self._script = script
+        self._tree = tree
+        self._monitor_state = app.monitor_io.MonitorState(
+            os.path.join(job_folder, app.constants.MONITOR_FILE_NAME),
+            flush_interval=app.get_setting("monitor_flush_interval") / 1000.0,
+        )
+        self._steps = self.__run()
+
+    @property
+    def finished(self):
+        """
+        True once the publish process has exited.
+        """
+        return self._steps is None
+
+    def advance(self, step_count=None):
+        """
+        Process the next tasks.
+
+        :param step_count: Number of tasks to process. If None, the job is run to the end.
+        :return: The number of tasks processed
+        """
+
+        processed_count = 0
+        while self._steps and (step_count is None or processed_count < step_count):
+            try:
+                next(self._steps)
+            except StopIteration:
+                self._steps = None
+                break
+            processed_count += 1
+        return processed_count
+
+    def __run(self):
+        """
+        Go through the publish and finalize steps of the job, yielding after each task.
+        """
+
+        constants = self._app.constants
+        latest_item, latest_task = self._script.get_latest_task(self._tree)
+        for stage, process_status, finished_status in [
+            ("publish", constants.PUBLISH_IN_PROGRESS, constants.PUBLISH_FINISHED),
+            ("finalize", constants.FINALIZE_IN_PROGRESS, constants.FINALIZE_FINISHED),
+        ]:
+            with self._monitor_state.measure_stage(stage):
+                for _ in self._script.task_generator(
+                    self._tree, self._monitor_state, process_status, finished_status
+                ):
+                    yield
+            # the last task is only flagged as done once the step is over
+            self._script.change_progress_status(
+                self._monitor_state,
+                latest_item.properties.uuid,
+                finished_status,
+                task_uuid=latest_task.settings["Task UUID"].value,
+            )
+            self._monitor_state.flush()
+
+        self._monitor_state.close()
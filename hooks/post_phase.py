@@ -10,7 +10,6 @@ import tempfile
 import uuid
 
 import sgtk
-from tank_vendor import yaml
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
@@ -50,6 +49,7 @@ class PostPhase(HookBaseClass):
         monitor_data = {
             "items": [],
             "session_name": publish_tree.root_item.properties.get("session_name", ""),
+            "process_finished": False,
         }
 
         current_engine = sgtk.platform.current_engine()
@@ -118,12 +118,19 @@ class PostPhase(HookBaseClass):
 
         # build the path to these files
         self.__TREE_FILE_PATH = os.path.join(tmp_folder_path, "publish_tree.yml")
-        monitor_file_path = os.path.join(tmp_folder_path, "monitor.yml")
+        monitor_file_path = os.path.join(
+            tmp_folder_path, bg_publish_app.constants.MONITOR_FILE_NAME
+        )
 
         # finally, save the publish tree and the monitor data to the files
+        # the monitor file is written atomically as the monitor may already be watching the folder
         publish_tree.save_file(self.__TREE_FILE_PATH)
-        with open(monitor_file_path, "w+") as fp:
-            yaml.safe_dump(monitor_data, fp)
+        bg_publish_app.monitor_io.save_monitor_data(monitor_file_path, monitor_data)
+
+        # register the job in the index the monitor uses to list the jobs without opening each job folder
+        bg_publish_app.monitor_io.update_job_index(
+            tmp_folder_path, bg_publish_app.monitor_io.get_job_summary(monitor_data)
+        )
 
         self.logger.info(
             "Background Publish files have been saved on disk.",
@@ -162,5 +169,8 @@ class PostPhase(HookBaseClass):
             current_engine = sgtk.platform.current_engine()
             bg_publish_app = current_engine.apps.get("tk-multi-bg-publish")
             # launch the background publishing process and show the monitor app
-            bg_publish_app.launch_publish_process(self.__TREE_FILE_PATH)
+            bg_publish_app.launch_publish_process(
+                self.__TREE_FILE_PATH,
+                session_path=publish_tree.root_item.properties.get("session_path"),
+            )
             bg_publish_app.create_panel()
@@ -7,3 +7,8 @@
 
 from .dialog import AppDialog
 from . import constants
+from . import monitor_io
+from . import worker_spool
+from . import shards
+from . import resource_sampler
+from .job_queue import JobQueue
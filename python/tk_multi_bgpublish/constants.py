@@ -17,3 +17,11 @@
     FINALIZE_FAILED,
     WARNING,
 ) = range(8)
+
+# names of the files stored in each background publish job folder
+MONITOR_FILE_NAME = "monitor.yml"
+EVENTS_FILE_NAME = "monitor_events.log"
+
+# names of the files stored at the root of the cache folder, indexing all the background publish jobs
+INDEX_FILE_NAME = "jobs_index.txt"
+INDEX_LOCK_FILE_NAME = "jobs_index.lock"
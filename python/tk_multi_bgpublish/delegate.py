@@ -5,6 +5,8 @@
 # This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
 # Source Code License included in this distribution package. See LICENSE.
 
+from collections import OrderedDict
+
 import sgtk
 from sgtk.platform.qt import QtGui, QtCore
 
@@ -20,6 +22,11 @@ COMPLETED_COLOR = QtGui.QColor(14, 230, 99)
 FAILED_COLOR = QtGui.QColor(187, 11, 11)
 WAITING_COLOR = QtGui.QColor(255, 255, 255)
 
+# the icons are drawn each time a row is painted but only a few different icons exist: keep the latest drawn ones to
+# avoid drawing them again
+ICON_CACHE_SIZE = 512
+_icon_cache = OrderedDict()
+
 
 def create_publish_tree_delegate(view):
     """
@@ -120,6 +127,21 @@ def _get_progress_icon(parent, index):
         )
         tooltip = "Publish in progress: {}%".format(progress_value)
 
+        # break the session duration down by stage
+        timings = index.data(PublishTreeModel.TIMINGS_ROLE) or {}
+        duration = index.data(PublishTreeModel.DURATION_ROLE)
+        if duration is not None:
+            tooltip += "\nDuration: {}".format(_format_duration(duration))
+        for stage, (start, end) in sorted(timings.items(), key=lambda t: t[1][0]):
+            if end is not None:
+                tooltip += "\n    {}: {}".format(
+                    stage.replace("_", " ").capitalize(), _format_duration(end - start)
+                )
+
+        resources = _format_resources(index.data(PublishTreeModel.RESOURCES_ROLE))
+        if resources:
+            tooltip += "\n" + resources
+
     return {
         "icon": icon,
         "icon_size": index.data(PublishTreeModel.ICON_SIZE_ROLE),
@@ -146,7 +168,7 @@ def _get_publish_icon(parent, index):
 
         icon_size = index.data(PublishTreeModel.ICON_SIZE_ROLE)
         status = index.data(PublishTreeModel.STATUS_ROLE)
-        tooltip = index.data(PublishTreeModel.TOOLTIP_ROLE)
+        tooltip = _get_step_tooltip(index, "publish")
 
         if status == constants.WAITING_TO_START:
             color = WAITING_COLOR
@@ -187,7 +209,7 @@ def _get_finalize_icon(parent, index):
 
         icon_size = index.data(PublishTreeModel.ICON_SIZE_ROLE)
         status = index.data(PublishTreeModel.STATUS_ROLE)
-        tooltip = index.data(PublishTreeModel.TOOLTIP_ROLE)
+        tooltip = _get_step_tooltip(index, "finalize")
 
         if status == constants.FINALIZE_FAILED:
             color = FAILED_COLOR
@@ -210,6 +232,89 @@ def _get_finalize_icon(parent, index):
     }
 
 
+def _get_step_tooltip(index, step):
+    """
+    Build the tooltip of the icon of a task step, with the duration of the step once it has ended.
+
+    :param index: The index of the task
+    :param step: The task step, "publish" or "finalize"
+    :return: The tooltip text
+    """
+
+    tooltip = index.data(PublishTreeModel.TOOLTIP_ROLE)
+    timing = (index.data(PublishTreeModel.TIMINGS_ROLE) or {}).get(step)
+    if timing and timing[1] is not None:
+        duration = "{} step: {}".format(
+            step.capitalize(), _format_duration(timing[1] - timing[0])
+        )
+        tooltip = "{}\n{}".format(tooltip, duration) if tooltip else duration
+
+    # the resources cover both steps of the task
+    resources = _format_resources(index.data(PublishTreeModel.RESOURCES_ROLE))
+    if resources:
+        tooltip = "{}\n{}".format(tooltip, resources) if tooltip else resources
+
+    return tooltip
+
+
+def _format_resources(resources):
+    """
+    Format the resources used by a publish session or a task to be displayed.
+
+    :param resources: The figures dictionary as saved by the resource sampler, or None
+    :return: The formatted resources or None if they are unknown
+    """
+
+    if not resources:
+        return None
+
+    lines = []
+    if resources.get("rss_peak") is not None:
+        lines.append(
+            "Memory: {} peak, {} average".format(
+                _format_size(resources["rss_peak"]),
+                _format_size(resources.get("rss_avg") or 0),
+            )
+        )
+    if resources.get("cpu_time") is not None:
+        lines.append("CPU time: {}".format(_format_duration(resources["cpu_time"])))
+    if resources.get("read_bytes") is not None:
+        lines.append(
+            "I/O: {} read, {} written".format(
+                _format_size(resources["read_bytes"]),
+                _format_size(resources.get("write_bytes") or 0),
+            )
+        )
+    return "\n".join(lines) or None
+
+
+def _format_size(size):
+    """
+    Format a size to be displayed.
+
+    :param size: The size in bytes
+    :return: The formatted size, e.g. "12.5 MB"
+    """
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} GB".format(size)
+
+
+def _format_duration(duration):
+    """
+    Format a duration to be displayed.
+
+    :param duration: The duration in seconds
+    :return: The formatted duration, e.g. "1m 05.2s"
+    """
+    minutes, seconds = divmod(max(0.0, duration), 60)
+    if minutes:
+        return "{}m {:04.1f}s".format(int(minutes), seconds)
+    return "{:.1f}s".format(seconds)
+
+
 def __draw_icon(
     icon_size,
     text,
@@ -234,6 +339,22 @@ def __draw_icon(
     :return: A QIcon containing the progress widget
     """
 
+    cache_key = (
+        icon_size.width(),
+        icon_size.height(),
+        text,
+        progress_value,
+        QtGui.QColor(progress_color).rgba(),
+        QtGui.QColor(text_color).rgba(),
+        pen_size,
+        padding,
+        font_size,
+    )
+    icon = _icon_cache.get(cache_key)
+    if icon is not None:
+        _icon_cache.move_to_end(cache_key)
+        return icon
+
     # create a pixmap to store the drawing
     pixmap = QtGui.QPixmap(icon_size.width(), icon_size.height())
     pixmap.fill(QtCore.Qt.transparent)
@@ -273,4 +394,9 @@ def __draw_icon(
 
     painter.end()
 
-    return QtGui.QIcon(pixmap)
+    icon = QtGui.QIcon(pixmap)
+    _icon_cache[cache_key] = icon
+    if len(_icon_cache) > ICON_CACHE_SIZE:
+        _icon_cache.popitem(last=False)
+
+    return icon
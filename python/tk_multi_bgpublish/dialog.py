@@ -16,6 +16,10 @@ from sgtk.platform.qt import QtCore, QtGui
 
 from .ui.dialog import Ui_Dialog
 from .model import PublishTreeModel
+from .monitor_reader import MonitorReader
+from .progress_subscriber import ProgressSubscriber
+from . import constants
+from . import monitor_io
 from .delegate import create_publish_tree_delegate
 
 shotgun_globals = sgtk.platform.import_framework(
@@ -47,15 +51,20 @@ class AppDialog(QtGui.QWidget):
         # first, call the base class and let it do its thing.
         QtGui.QWidget.__init__(self, parent)
 
-        # this variable will be used to store all the monitor files already loaded
-        self.__monitor_files = []
-
         self._bundle = sgtk.platform.current_bundle()
-        self._cache_folder = os.path.join(
-            self._bundle.cache_location, self._bundle.engine.name
+        self._cache_folder = os.path.normpath(
+            os.path.join(self._bundle.cache_location, self._bundle.engine.name)
         )
         self.__reload_timeout = self._bundle.get_setting("reload_timeout")
 
+        # the monitor files are read in a background thread while the model is only modified from the main thread
+        # only the most recent jobs are read at first, the older ones being loaded on demand
+        self._monitor_reader = MonitorReader(
+            self._cache_folder,
+            max_sessions=self._bundle.get_setting("history_max_sessions"),
+            max_days=self._bundle.get_setting("history_max_days"),
+        )
+
         # now load in the UI that was created in the UI designer
         self._ui = Ui_Dialog()
         self._ui.setupUi(self)
@@ -70,6 +79,12 @@ class AppDialog(QtGui.QWidget):
         self._publish_tree_model = PublishTreeModel(self)
         self._ui.view.setModel(self._publish_tree_model)
 
+        # the tasks of the expanded sessions are also read in the background, indexed by task id
+        self._session_requests = {}
+        self._publish_tree_model.session_load_requested.connect(
+            self._on_session_load_requested
+        )
+
         # create the delegate used to correctly display the model data into the view
         self._publish_tree_delegate = create_publish_tree_delegate(self._ui.view)
         self._ui.view.setItemDelegate(self._publish_tree_delegate)
@@ -78,6 +93,34 @@ class AppDialog(QtGui.QWidget):
         self._bg_task_manager.task_completed.connect(self._on_background_task_completed)
         self._bg_task_manager.task_failed.connect(self._on_background_task_failed)
 
+        # when enabled, rely on filesystem notifications to know when a job has changed instead of polling the cache
+        # folder every reload_timeout seconds
+        self._file_watcher = None
+        self.__changed_folders = set()
+        if self._bundle.get_setting("use_file_watcher"):
+            self._file_watcher = self._create_file_watcher()
+
+        # used to gather the notifications received in a short amount of time into a single refresh
+        self.__refresh_timer = QtCore.QTimer(self)
+        self.__refresh_timer.setSingleShot(True)
+        self.__refresh_timer.setInterval(50)
+        self.__refresh_timer.timeout.connect(self._refresh_changed_folders)
+
+        # the running publish processes stream their status changes: apply them as soon as they are received, the
+        # monitor files remaining the fallback for the jobs which can't be reached
+        self._progress_subscriber = None
+        if self._bundle.get_setting("stream_progress"):
+            self._progress_subscriber = ProgressSubscriber(self)
+            self._progress_subscriber.events_received.connect(
+                self._on_progress_events_received
+            )
+            self._progress_subscriber.channel_closed.connect(
+                self._on_progress_channel_closed
+            )
+
+        # the older jobs are loaded when clicking on the last row of the view
+        self._ui.view.clicked.connect(self._on_view_item_clicked)
+
         # initialize a context menu to add extra actions without polluting the UI
         self._ui.view.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self._ui.view.customContextMenuRequested.connect(
@@ -96,6 +139,9 @@ class AppDialog(QtGui.QWidget):
         :param event: Close event
         """
 
+        if self._progress_subscriber:
+            self._progress_subscriber.close()
+
         # close down background tasks
         if self._bg_task_manager:
             shotgun_globals.unregister_bg_task_manager(self._bg_task_manager)
@@ -104,58 +150,55 @@ class AppDialog(QtGui.QWidget):
 
         return QtGui.QWidget.closeEvent(self, event)
 
-    def reload(self, timeout=None):
+    def reload(self, timeout=None, job_folders=None):
         """
-        Reload the model with the monitor data.
+        Read the monitor data which have changed. This method is run in a background thread and doesn't modify the
+        model: the returned changes are applied from the main thread once the task is completed.
 
         :param timeout: Refresh timeout
+        :param job_folders: List of the job folders to refresh. If None, all the job folders found in the cache folder
+            will be refreshed.
+        :return: The changes as returned by :meth:`MonitorReader.read`
         """
 
         if timeout:
             time.sleep(timeout)
 
-        if not os.path.exists(self._cache_folder):
-            return
-
-        # parse the cache folder to get all the monitor files and fill the model
-        for bg_cache_folder in os.listdir(self._cache_folder):
-
-            monitor_file_path = os.path.join(
-                self._cache_folder, bg_cache_folder, "monitor.yml"
-            )
-            if not os.path.exists(monitor_file_path):
-                continue
-
-            if monitor_file_path not in self.__monitor_files:
-                # add the monitor data to the model
-                self._publish_tree_model.add_publish_tree(monitor_file_path)
-                self.__monitor_files.append(monitor_file_path)
-            else:
-                # refresh the existing tree
-                self._publish_tree_model.update_publish_tree(monitor_file_path)
-
-        # finally, delete the items which don't exist anymore
-        files_to_remove = []
-        for monitor_file_path in self.__monitor_files:
-            if not os.path.exists(monitor_file_path):
-                self._publish_tree_model.remove_publish_tree(monitor_file_path)
-                files_to_remove.append(monitor_file_path)
-        for f in files_to_remove:
-            self.__monitor_files.remove(f)
+        return self._monitor_reader.read(job_folders)
 
     def _on_background_task_completed(self, uid, group_id, result):
         """
         Slot triggered when the background manager has finished doing some task. The only task we're asking the manager
-        to do is to find the latest published file associated to the current item.
+        to do is to read the monitor data which have changed: apply them to the model.
 
         :param uid:      Unique id associated with the task
         :param group_id: The group the task is associated with
         :param result:   The data returned by the task
         """
+        log_folder = self._session_requests.pop(uid, None)
+        if log_folder is not None:
+            self._publish_tree_model.populate_session(log_folder, result)
+            return
+
         if uid not in self._pending_requests:
             return
         self._pending_requests.remove(uid)
 
+        # the sessions which have reached a terminal state don't need to be read anymore
+        for tree_file in self._publish_tree_model.apply_diff(result):
+            self._monitor_reader.freeze(tree_file)
+
+        if self._progress_subscriber:
+            for job_folder, channels in result["channels"].items():
+                self._progress_subscriber.subscribe(job_folder, channels)
+
+        # in watcher mode, there is no need to reload the data until a notification is received
+        if self._file_watcher:
+            self._update_watched_paths(result["watch_paths"])
+            if self.__changed_folders:
+                self.__refresh_timer.start()
+            return
+
         task_id = self._bg_task_manager.add_task(
             self.reload, task_kwargs={"timeout": self.__reload_timeout}
         )
@@ -171,6 +214,16 @@ class AppDialog(QtGui.QWidget):
         :param stack_trace: Full error traceback
         """
 
+        log_folder = self._session_requests.pop(uid, None)
+        if log_folder is not None:
+            self._bundle.logger.warning(
+                "Couldn't read the publish session tasks from {}: {}".format(
+                    log_folder, msg
+                )
+            )
+            self._publish_tree_model.populate_session(log_folder, None)
+            return
+
         if uid in self._pending_requests:
             self._pending_requests.remove(uid)
 
@@ -178,6 +231,180 @@ class AppDialog(QtGui.QWidget):
             "Error happening when reloading the data: {}".format(stack_trace)
         )
 
+        if self._file_watcher and self.__changed_folders:
+            self.__refresh_timer.start()
+
+    def _on_session_load_requested(self, log_folder):
+        """
+        Slot triggered when a publish session is expanded: read its items and tasks in a background thread.
+
+        :param log_folder: Path to the folder containing all the session files
+        """
+
+        if not self._bg_task_manager:
+            return
+
+        task_id = self._bg_task_manager.add_task(
+            self._monitor_reader.read_session,
+            task_kwargs={"job_folder": log_folder},
+        )
+        self._session_requests[task_id] = log_folder
+
+    # ---------------------------------------------------------------------------------------------
+    # Progress channels
+    # ---------------------------------------------------------------------------------------------
+
+    def _on_progress_events_received(self, job_folder, events, stage_events):
+        """
+        Slot triggered when some status changes have been streamed by a publish process.
+
+        :param job_folder: Path to the folder of the job which has changed
+        :param events: List of the received events
+        :param stage_events: List of the received stage events
+        """
+
+        update = {
+            "tree_file": os.path.join(job_folder, constants.MONITOR_FILE_NAME),
+            "task_statuses": [(e[2], e[3], e[0]) for e in events if e[2]],
+            "stage_events": stage_events,
+            "process_finished": None,
+        }
+        for tree_file in self._publish_tree_model.update_publish_trees([update]):
+            self._monitor_reader.freeze(tree_file)
+
+    def _on_progress_channel_closed(self, job_folder):
+        """
+        Slot triggered when a publish process has closed its progress channel.
+
+        :param job_folder: Path to the folder of the job
+        """
+
+        # the process has exited: read its final state from the monitor files, the resources being loaded once the
+        # session is frozen
+        if self._file_watcher:
+            self.__changed_folders.add(os.path.normpath(job_folder))
+            self.__refresh_timer.start()
+
+    # ---------------------------------------------------------------------------------------------
+    # File watcher
+    # ---------------------------------------------------------------------------------------------
+
+    def _create_file_watcher(self):
+        """
+        Create a file system watcher on the cache folder.
+
+        :return: A QFileSystemWatcher instance or None if the file system notifications are not available
+        """
+
+        if not os.path.exists(self._cache_folder):
+            os.makedirs(self._cache_folder)
+
+        file_watcher = QtCore.QFileSystemWatcher(self)
+        file_watcher.addPath(self._cache_folder)
+        if not file_watcher.directories():
+            self._bundle.logger.warning(
+                "Couldn't watch {} for changes, falling back on polling.".format(
+                    self._cache_folder
+                )
+            )
+            file_watcher.deleteLater()
+            return None
+
+        file_watcher.directoryChanged.connect(self._on_watched_path_changed)
+        file_watcher.fileChanged.connect(self._on_watched_path_changed)
+
+        return file_watcher
+
+    def _update_watched_paths(self, watch_paths):
+        """
+        Watch the folder and the event log of each job so the notifications are received as soon as a job changes.
+
+        :param watch_paths: Dictionary of the paths to watch for each publish session, indexed by monitor file, as
+            returned by :meth:`MonitorReader.read`
+        """
+
+        paths = set()
+        for tree_file, tree_paths in watch_paths.items():
+            # no need to watch the sessions which will never change again
+            if self._publish_tree_model.is_publish_tree_frozen(tree_file):
+                continue
+            paths.update(os.path.normpath(p) for p in tree_paths)
+
+        watched_paths = set(
+            os.path.normpath(p)
+            for p in self._file_watcher.directories() + self._file_watcher.files()
+        )
+        watched_paths.discard(self._cache_folder)
+
+        new_paths = paths - watched_paths
+        if new_paths:
+            self._file_watcher.addPaths(list(new_paths))
+        old_paths = watched_paths - paths
+        if old_paths:
+            self._file_watcher.removePaths(list(old_paths))
+
+    def _on_watched_path_changed(self, path):
+        """
+        Slot triggered when the file system watcher notifies a change.
+
+        :param path: Path to the folder or file which has changed
+        """
+
+        path = os.path.normpath(path)
+        if path == self._cache_folder:
+            # a job has been added or removed: the whole cache folder needs to be parsed
+            self.__changed_folders.add(self._cache_folder)
+        elif os.path.basename(path) == constants.EVENTS_FILE_NAME:
+            self.__changed_folders.add(os.path.dirname(path))
+        else:
+            self.__changed_folders.add(path)
+
+        self.__refresh_timer.start()
+
+    def _refresh_changed_folders(self):
+        """
+        Reload the jobs for which a change has been notified.
+        """
+
+        if not self._bg_task_manager or not self.__changed_folders:
+            return
+
+        # only run one reload at a time: the remaining changes will be processed once the current reload is done
+        if self._pending_requests:
+            return
+
+        if self._cache_folder in self.__changed_folders:
+            job_folders = None
+        else:
+            job_folders = list(self.__changed_folders)
+        self.__changed_folders = set()
+
+        task_id = self._bg_task_manager.add_task(
+            self.reload, task_kwargs={"job_folders": job_folders}
+        )
+        self._pending_requests.append(task_id)
+
+    def _on_view_item_clicked(self, index):
+        """
+        Slot triggered when an item of the view is clicked. Load the next page of older jobs if the clicked item is the
+        "load more" row.
+
+        :param index: The index of the clicked item
+        """
+
+        if (
+            index.data(PublishTreeModel.ITEM_TYPE_ROLE)
+            != PublishTreeModel.PUBLISH_LOAD_MORE
+        ):
+            return
+
+        self._monitor_reader.load_more(self._bundle.get_setting("history_page_size"))
+
+        # the older jobs are read during the next reload of the whole cache folder
+        if self._file_watcher:
+            self.__changed_folders.add(self._cache_folder)
+            self.__refresh_timer.start()
+
     def _on_context_menu_requested(self, pnt):
         """
         Populate the context menu
@@ -194,6 +421,11 @@ class AppDialog(QtGui.QWidget):
         if len(indexes) != 1:
             return
         item = indexes[0].model().itemFromIndex(indexes[0])
+        if (
+            item.data(PublishTreeModel.ITEM_TYPE_ROLE)
+            == PublishTreeModel.PUBLISH_LOAD_MORE
+        ):
+            return
 
         # build the context menu
         context_menu = QtGui.QMenu(self)
@@ -274,22 +506,56 @@ class AppDialog(QtGui.QWidget):
         Delete all the completed jobs
         """
 
+        # gather the items first as deleting a job removes its row from the model
+        items = []
         for r in range(self._publish_tree_model.rowCount()):
             item = self._publish_tree_model.item(r)
             progress = item.data(PublishTreeModel.PROGRESS_ROLE)
             if progress == 100:
-                self._delete_job(item, reload=False)
-        self.reload()
-
-    def _delete_job(self, item, reload=True):
+                items.append(item)
+
+        # the older jobs which haven't been loaded in the monitor are only known from the job index
+        try:
+            index = monitor_io.read_job_index(self._cache_folder)
+        except (OSError, ValueError) as e:
+            self._bundle.logger.warning(
+                "Couldn't read the job index to delete the older jobs: {}".format(e)
+            )
+            index = {}
+        log_folders = []
+        for job_name, entry in index.items():
+            log_folder = os.path.join(self._cache_folder, job_name)
+            if (
+                entry["terminal"]
+                and entry["progress"] == 100
+                and not self._publish_tree_model.get_session_item_from_log_folder(
+                    log_folder
+                )
+            ):
+                log_folders.append(log_folder)
+
+        for item in items:
+            self._delete_job_folder(item.data(PublishTreeModel.LOG_FOLDER_ROLE))
+        for log_folder in log_folders:
+            self._delete_job_folder(log_folder)
+        self._prune_job_index()
+
+    def _delete_job(self, item):
         """
         Delete a specific job
 
         :param item: The selected model item
-        :param reload: If True, the model will be reloaded once the log folder has been deleted
+        """
+        self._delete_job_folder(item.data(PublishTreeModel.LOG_FOLDER_ROLE))
+        self._prune_job_index()
+
+    def _delete_job_folder(self, log_folder):
+        """
+        Delete the folder of a job and remove the job from the model if it has been loaded
+
+        :param log_folder: Path to the folder containing all the job files
         """
 
-        log_folder = item.data(PublishTreeModel.LOG_FOLDER_ROLE)
         if not os.path.exists(log_folder):
             self._bundle.logger.error(
                 "Couldn't delete job: doesn't exist on disk anymore"
@@ -298,6 +564,20 @@ class AppDialog(QtGui.QWidget):
 
         shutil.rmtree(log_folder)
 
-        # finally, reload the model/view
-        if reload:
-            self.reload()
+        # finally, remove the job from the model/view
+        # the monitor reader will notice the job has been removed during the next reload
+        self._publish_tree_model.remove_publish_tree(
+            os.path.join(log_folder, constants.MONITOR_FILE_NAME)
+        )
+
+    def _prune_job_index(self):
+        """
+        Remove the deleted jobs from the job index.
+        """
+
+        # the index is shared with the publish processes: never wait for its lock from the main thread
+        if self._bg_task_manager:
+            self._bg_task_manager.add_task(
+                monitor_io.prune_job_index,
+                task_kwargs={"cache_folder": self._cache_folder},
+            )
@@ -0,0 +1,218 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+import heapq
+import itertools
+import threading
+
+
+class JobQueue(object):
+    """
+    Local queue of the background publish processes to run.
+
+    Only ``max_concurrent_jobs`` processes are running at the same time: the next job is started as soon as a running
+    process exits. Jobs are started by priority first (highest first), then in submission order. The jobs waiting in
+    the queue keep their WAITING_TO_START status in the monitor.
+
+    The jobs submitted with the same batch key are started together by a single process: when one of them gets a slot,
+    all the pending jobs sharing its key are removed from the queue and handed to its start callable. Only the jobs
+    waiting in the queue can be batched: without any ``max_concurrent_jobs`` limit, each job is started alone as soon as
+    it is submitted.
+
+    The queue only lives in the current session: it must be flushed before the session ends so the pending jobs are not
+    lost.
+
+    The processes are waited for from background threads, but starting a job may rely on the DCC and Toolkit APIs which
+    must be called from the main thread: once a slot is freed, the next jobs are started through ``run_in_main_thread``.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_jobs=0,
+        logger=None,
+        on_start_failed=None,
+        run_in_main_thread=None,
+    ):
+        """
+        Class constructor
+
+        :param max_concurrent_jobs: Maximum number of processes running at the same time. If 0, the jobs are started as
+            soon as they are submitted.
+        :param logger: Logger used to report the jobs which couldn't be started
+        :param on_start_failed: Callable called with the payload of each job which couldn't be started
+        :param run_in_main_thread: Callable running the callable it is given from the main thread without waiting for
+            it, like :meth:`sgtk.platform.Engine.async_execute_in_main_thread`. If None, the pending jobs are started
+            from the thread which has waited for the process freeing the slot.
+        """
+
+        self._max_concurrent_jobs = max_concurrent_jobs
+        self._logger = logger
+        self._on_start_failed = on_start_failed
+        self._run_in_main_thread = run_in_main_thread
+
+        self.__lock = threading.Lock()
+        self.__pending_jobs = []
+        self.__running_count = 0
+
+        # once flushed, the jobs are started without waiting for a free slot
+        self.__flushed = False
+
+        # used to keep the submission order between jobs of the same priority
+        self.__counter = itertools.count()
+
+    @property
+    def pending_count(self):
+        """
+        Number of jobs waiting for a free slot.
+        """
+        with self.__lock:
+            return len(self.__pending_jobs)
+
+    @property
+    def running_count(self):
+        """
+        Number of processes currently running.
+        """
+        with self.__lock:
+            return self.__running_count
+
+    def submit(self, start_job, priority=0, name=None, batch_key=None, payload=None):
+        """
+        Add a job to the queue. It will be started right away if a slot is free.
+
+        :param start_job: Callable starting the job process and returning its :class:`subprocess.Popen` instance, or
+            a list of instances if the job runs several processes. If the job has a batch key, the callable receives
+            the list of the payloads of all the jobs of the batch, in queue order.
+        :param priority: Priority of the job. Jobs with a higher priority are started first.
+        :param name: Name of the job, used for logging purpose
+        :param batch_key: Hashable value shared by the jobs which can be run by the same process. If None, the job is
+            always started alone.
+        :param payload: Data describing the job, given to the start callable of the batch
+        """
+
+        with self.__lock:
+            heapq.heappush(
+                self.__pending_jobs,
+                (-priority, next(self.__counter), name, start_job, batch_key, payload),
+            )
+
+        self.__start_pending_jobs()
+
+    def flush(self):
+        """
+        Start all the pending jobs right away, whatever the number of running processes. The jobs submitted afterwards
+        are also started right away.
+        """
+
+        with self.__lock:
+            self.__flushed = True
+
+        self.__start_pending_jobs()
+
+    def __start_pending_jobs(self):
+        """
+        Start the pending jobs while some slots are free.
+        """
+
+        while True:
+            with self.__lock:
+                if not self.__pending_jobs:
+                    return
+                if (
+                    self._max_concurrent_jobs
+                    and not self.__flushed
+                    and self.__running_count >= self._max_concurrent_jobs
+                ):
+                    return
+                job = heapq.heappop(self.__pending_jobs)
+                _, _, name, start_job, batch_key, payload = job
+                batch = None
+                if batch_key is not None:
+                    batch = [job] + self.__pop_batch(batch_key)
+                self.__running_count += 1
+
+            payloads = [payload] if batch is None else [j[5] for j in batch]
+            try:
+                if batch is None:
+                    process = start_job()
+                else:
+                    process = start_job(payloads)
+            except Exception as e:
+                process = None
+                if self._logger:
+                    self._logger.error(
+                        "Couldn't start the background publish job {}: {}".format(
+                            name, e
+                        )
+                    )
+                # the jobs would otherwise wait to start forever
+                self.__report_start_failure(payloads)
+
+            if process is None:
+                with self.__lock:
+                    self.__running_count -= 1
+                continue
+
+            # the slot is released once all the processes of the job have exited
+            waiting_thread = threading.Thread(
+                target=self.__wait_for_job, args=(process,)
+            )
+            waiting_thread.daemon = True
+            waiting_thread.start()
+
+    def __report_start_failure(self, payloads):
+        """
+        Report the jobs which couldn't be started.
+
+        :param payloads: List of the payloads of the jobs
+        """
+
+        if not self._on_start_failed:
+            return
+
+        for payload in payloads:
+            try:
+                self._on_start_failed(payload)
+            except Exception as e:
+                if self._logger:
+                    self._logger.error(
+                        "Couldn't report the failure of the background publish job: {}".format(
+                            e
+                        )
+                    )
+
+    def __pop_batch(self, batch_key):
+        """
+        Remove the pending jobs sharing a batch key from the queue. The lock must be held.
+
+        :param batch_key: The batch key
+        :return: The list of the removed jobs, in queue order
+        """
+
+        batch = sorted(j for j in self.__pending_jobs if j[4] == batch_key)
+        if batch:
+            self.__pending_jobs = [j for j in self.__pending_jobs if j[4] != batch_key]
+            heapq.heapify(self.__pending_jobs)
+        return batch
+
+    def __wait_for_job(self, process):
+        """
+        Wait for a job process to exit then start the next pending job.
+
+        :param process: The :class:`subprocess.Popen` instance of the job or the list of instances
+        """
+
+        for p in process if isinstance(process, list) else [process]:
+            p.wait()
+
+        with self.__lock:
+            self.__running_count -= 1
+
+        if self._run_in_main_thread:
+            self._run_in_main_thread(self.__start_pending_jobs)
+        else:
+            self.__start_pending_jobs()
@@ -10,9 +10,10 @@ import uuid
 
 import sgtk
 from sgtk.platform.qt import QtGui, QtCore
-from tank_vendor import yaml
 
 from . import constants
+from . import monitor_io
+from . import resource_sampler
 
 delegates = sgtk.platform.import_framework("tk-framework-qtwidgets", "delegates")
 ViewItemRolesMixin = delegates.ViewItemRolesMixin
@@ -34,10 +35,19 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         TOOLTIP_ROLE,
         LOG_FOLDER_ROLE,
         DATE_ROLE,
+        TIMINGS_ROLE,
+        DURATION_ROLE,
+        RESOURCES_ROLE,
         NEXT_AVAILABLE_ROLE,
-    ) = range(_BASE_ROLE, _BASE_ROLE + 10)
+    ) = range(_BASE_ROLE, _BASE_ROLE + 13)
 
-    (PUBLISH_SESSION, PUBLISH_ITEM, PUBLISH_TASK) = range(3)
+    (PUBLISH_SESSION, PUBLISH_ITEM, PUBLISH_TASK, PUBLISH_LOAD_MORE) = range(4)
+
+    LOAD_MORE_TEXT = "Load {} older job(s)..."
+
+    # emitted with the log folder of a publish session once it is expanded: its monitor file needs to be read to add
+    # its items and tasks, which is done by :meth:`populate_session`
+    session_load_requested = QtCore.Signal(str)
 
     TOOLTIP_TEXT = {
         constants.WAITING_TO_START: "The publish job is waiting to start",
@@ -55,15 +65,24 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         An item for publish element (session, item and task)
         """
 
-        def __init__(self, item_type, name, session_uuid, log_folder, item_uuid=None):
+        def __init__(
+            self,
+            item_type,
+            name,
+            session_uuid,
+            log_folder,
+            item_uuid=None,
+            creation_time=None,
+        ):
             """
             Class constructor
 
-            :param item_type: Type of the item (PUBLISH_SESSION, PUBLISH_ITEM or PUBLISH_TASK)
+            :param item_type: Type of the item (PUBLISH_SESSION, PUBLISH_ITEM, PUBLISH_TASK or PUBLISH_LOAD_MORE)
             :param name: Item name
             :param session_uuid: Unique identifier of the session the publish items and tasks belong to
             :param log_folder: Path to the folder containing all the session files (monitor file, log file, ...)
             :param item_uuid: Unique identifier of the publish item the tasks belong to
+            :param creation_time: Creation time of the log folder. If None, it will be read from the disk.
             """
 
             self.__item_type = item_type
@@ -72,6 +91,12 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
             self.__log_folder = log_folder
             self.__progress_value = 0
 
+            # the creation time is used to sort the sessions: store it once to avoid accessing the disk each time the
+            # model is sorted
+            if creation_time is None:
+                creation_time = os.stat(log_folder).st_ctime
+            self.__creation_time = creation_time
+
             super(PublishTreeModel.PublishTreeItem, self).__init__(name)
 
         @property
@@ -123,7 +148,15 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
                 return self.__log_folder
 
             if role == PublishTreeModel.DATE_ROLE:
-                return -os.stat(self.__log_folder).st_ctime
+                return -self.__creation_time
+
+            # the sessions last from the start of their first stage to the end of their last stage, while the tasks
+            # last the time of their publish and finalize steps
+            if role == PublishTreeModel.DURATION_ROLE:
+                return monitor_io.get_duration(
+                    self.data(PublishTreeModel.TIMINGS_ROLE),
+                    span=self.__item_type == PublishTreeModel.PUBLISH_SESSION,
+                )
 
             return super(PublishTreeModel.PublishTreeItem, self).data(role)
 
@@ -153,8 +186,41 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         self.setSortRole(self.DATE_ROLE)
 
         # this will be used to store all the tasks because of performance issue (going through the tree model is slower
-        # than parsing a list)
-        self.__tasks = []
+        # than looking up a dictionary): tasks items are indexed by UUID
+        self.__tasks = {}
+
+        # the task items of a publish session are only created when the session is expanded: until then, only the task
+        # statuses are stored, indexed by task UUID and gathered by publish session
+        self.__session_statuses = {}
+        self.__task_sessions = {}
+        self.__populated_sessions = set()
+
+        # publish sessions which have been expanded and whose monitor file is being read
+        self.__loading_sessions = set()
+
+        # start and end times of the publish and finalize steps of each task, indexed by task UUID
+        self.__task_timings = {}
+
+        # resources used by each task, indexed by task UUID. They are only known once the publish process is done
+        self.__task_resources = {}
+
+        # publish sessions added from the job index summary: their task statuses are only known once they are expanded
+        self.__summary_sessions = set()
+
+        # publish session items indexed by session UUID and by log folder. As they store the items themselves and not
+        # their row, they don't need to be updated when the model is sorted
+        self.__sessions = {}
+        self.__sessions_by_folder = {}
+
+        # number of tasks and of completed task steps (publish and finalize) of each publish session, kept up to date
+        # when a task status changes to avoid going through all the tasks to compute the session progress
+        self.__session_counters = {}
+
+        # monitor files of the publish sessions which have reached a terminal state and will never change again
+        self.__frozen_trees = set()
+
+        # row displayed after the publish sessions when the oldest ones haven't been loaded yet
+        self.__load_more_item = None
 
         self._bundle = sgtk.platform.current_bundle()
 
@@ -169,15 +235,65 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         self._bundle.logger.debug("Clearing the model...")
 
         # be sure to remove all the stored items
-        self.__tasks = []
+        self.__tasks = {}
+        self.__session_statuses = {}
+        self.__task_sessions = {}
+        self.__task_timings = {}
+        self.__task_resources = {}
+        self.__populated_sessions = set()
+        self.__loading_sessions = set()
+        self.__summary_sessions = set()
+        self.__session_counters = {}
+        self.__sessions = {}
+        self.__sessions_by_folder = {}
+        self.__frozen_trees = set()
+        self.__load_more_item = None
 
         super(PublishTreeModel, self).clear()
 
-    def add_publish_tree(self, tree_file):
+    def apply_diff(self, diff):
+        """
+        Apply all the changes read from the monitor files in a single batch.
+
+        :param diff: The changes as returned by :meth:`MonitorReader.read`
+        :return: The list of the monitor files of the publish sessions which have reached a terminal state
+        """
+
+        frozen_trees = []
+
+        for tree_file in diff["removed"]:
+            self.remove_publish_tree(tree_file)
+
+        for session_data in diff["added"]:
+            if session_data["monitor_data"] is None:
+                self.add_publish_tree_summary(
+                    session_data["tree_file"],
+                    session_data["summary"],
+                    session_data["creation_time"],
+                )
+            elif self.add_publish_tree(
+                session_data["tree_file"],
+                session_data["monitor_data"],
+                session_data["creation_time"],
+            ):
+                frozen_trees.append(session_data["tree_file"])
+
+        frozen_trees.extend(self.update_publish_trees(diff["updated"]))
+
+        if diff["hidden_count"] is not None:
+            self.set_hidden_count(diff["hidden_count"])
+
+        return frozen_trees
+
+    def add_publish_tree(self, tree_file, monitor_data, creation_time):
         """
-        Add a new publish session to the model
+        Add a new publish session to the model. Only the session row is created: its items and tasks will be added
+        once the session is expanded.
 
         :param tree_file: Path to the file where the publish monitor data are stored
+        :param monitor_data: The publish monitor data
+        :param creation_time: Creation time of the folder where the publish session files are stored
+        :return: True if the publish session has reached a terminal state, False otherwise
         """
 
         self._bundle.logger.debug(
@@ -187,26 +303,222 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         # create an uuid for the current session. It will be useful to gather all the tasks belonging to the same
         # session
         session_uuid = uuid.uuid4()
-
-        # load the monitor data
         log_folder = os.path.dirname(tree_file)
-        with open(tree_file, "r") as fp:
-            monitor_data = yaml.load(fp, Loader=yaml.FullLoader)
 
-        # first, add an item to represent the current session
+        # first, create an item to represent the current session
         session_item = PublishTreeModel.PublishTreeItem(
             PublishTreeModel.PUBLISH_SESSION,
             monitor_data["session_name"],
             session_uuid,
             log_folder,
+            creation_time=creation_time,
+        )
+        self.__sessions[session_uuid] = session_item
+        self.__sessions_by_folder[log_folder] = session_item
+        self.__session_statuses[session_uuid] = {}
+        self.__session_counters[session_uuid] = [0, 0]
+        session_item.setData(
+            monitor_data.get("stages", {}), PublishTreeModel.TIMINGS_ROLE
+        )
+        resources = monitor_data.get("resources") or {}
+        session_item.setData(resources.get("job"), PublishTreeModel.RESOURCES_ROLE)
+        self.__task_resources.update(resources.get("tasks", {}))
+
+        # then, store the task statuses to be able to compute the session progress
+        for item in monitor_data["items"]:
+            for task in item["tasks"]:
+                self.__task_sessions[task["uuid"]] = session_uuid
+                self.__task_timings[task["uuid"]] = task.get("timings", {})
+                self.__session_counters[session_uuid][0] += 1
+                self.__set_task_status(session_uuid, task["uuid"], task["status"])
+                if task["status"] in [
+                    constants.PUBLISH_FAILED,
+                    constants.FINALIZE_FAILED,
+                ]:
+                    self.report_error(session_item, None, task["status"])
+
+        progress_value = self.get_progress_value(session_uuid)
+        session_item.setData(progress_value, PublishTreeModel.PROGRESS_ROLE)
+
+        # finally, add the session to the model
+        # the sessions are sorted from the most recent one to the oldest one: insert it directly at the right position
+        self.invisibleRootItem().insertRow(
+            self.__get_sorted_row(session_item.data(PublishTreeModel.DATE_ROLE)),
+            session_item,
+        )
+
+        return self.__update_frozen_state(
+            tree_file, session_item, monitor_data["process_finished"]
+        )
+
+    def add_publish_tree_summary(self, tree_file, summary, creation_time):
+        """
+        Add a publish session which has reached a terminal state to the model from its job index summary, without
+        reading its monitor file. Its items and tasks will be read once the session is expanded.
+
+        :param tree_file: Path to the file where the publish monitor data are stored
+        :param summary: The publish session summary stored in the job index
+        :param creation_time: Creation time of the folder where the publish session files are stored
+        """
+
+        self._bundle.logger.debug(
+            f"Adding a finished publish session to the model from {tree_file}"
+        )
+
+        session_uuid = uuid.uuid4()
+        log_folder = os.path.dirname(tree_file)
+
+        session_item = PublishTreeModel.PublishTreeItem(
+            PublishTreeModel.PUBLISH_SESSION,
+            summary["session_name"],
+            session_uuid,
+            log_folder,
+            creation_time=creation_time,
+        )
+        self.__sessions[session_uuid] = session_item
+        self.__sessions_by_folder[log_folder] = session_item
+        self.__session_statuses[session_uuid] = {}
+        self.__session_counters[session_uuid] = [0, 0]
+        self.__summary_sessions.add(session_uuid)
+
+        if summary["status"] in [constants.PUBLISH_FAILED, constants.FINALIZE_FAILED]:
+            self.report_error(session_item, None, summary["status"])
+        session_item.setData(summary["progress"], PublishTreeModel.PROGRESS_ROLE)
+
+        self.invisibleRootItem().insertRow(
+            self.__get_sorted_row(session_item.data(PublishTreeModel.DATE_ROLE)),
+            session_item,
+        )
+
+        # the session will never change again
+        self.__frozen_trees.add(tree_file)
+
+    def set_hidden_count(self, hidden_count):
+        """
+        Update the row used to load the publish sessions which are older than the history window.
+
+        :param hidden_count: Number of publish sessions which haven't been loaded yet
+        """
+
+        if not hidden_count:
+            if self.__load_more_item:
+                self.invisibleRootItem().removeRow(self.__load_more_item.row())
+                self.__load_more_item = None
+            return
+
+        text = self.LOAD_MORE_TEXT.format(hidden_count)
+        if self.__load_more_item:
+            if self.__load_more_item.text() != text:
+                self.__load_more_item.setText(text)
+            return
+
+        # the row has the oldest possible date so it always stays after the publish sessions
+        self.__load_more_item = PublishTreeModel.PublishTreeItem(
+            PublishTreeModel.PUBLISH_LOAD_MORE,
+            text,
+            None,
+            None,
+            creation_time=float("-inf"),
+        )
+        self.invisibleRootItem().appendRow(self.__load_more_item)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        """
+        Override the :class:`sgtk.platform.qt.QtGui.QStandardItemModel` method.
+        Report the publish sessions which haven't been populated yet as having children so they can be expanded.
+
+        :param parent: The index of the parent item
+        :return: True if the parent item has children, False otherwise
+        """
+        session_item = self.__get_unpopulated_session(parent)
+        if session_item:
+            if session_item.session_uuid in self.__summary_sessions:
+                return True
+            return self.__session_counters[session_item.session_uuid][0] > 0
+        # the rows of the sessions being loaded are only added once their monitor file has been read
+        if parent.isValid():
+            item = self.itemFromIndex(parent)
+            if (
+                item is not None
+                and item.data(PublishTreeModel.ITEM_TYPE_ROLE)
+                == PublishTreeModel.PUBLISH_SESSION
+                and item.session_uuid in self.__loading_sessions
+            ):
+                return True
+        return super(PublishTreeModel, self).hasChildren(parent)
+
+    def canFetchMore(self, parent):
+        """
+        Override the :class:`sgtk.platform.qt.QtGui.QStandardItemModel` method.
+
+        :param parent: The index of the parent item
+        :return: True if the parent item is a publish session which hasn't been populated yet, False otherwise
+        """
+        return self.__get_unpopulated_session(parent) is not None
+
+    def fetchMore(self, parent):
+        """
+        Override the :class:`sgtk.platform.qt.QtGui.QStandardItemModel` method.
+        Request the items and tasks of a publish session: they are added by :meth:`populate_session` once its monitor
+        file has been read in a background thread.
+
+        :param parent: The index of the parent item
+        """
+
+        session_item = self.__get_unpopulated_session(parent)
+        if not session_item:
+            return
+
+        self.__populated_sessions.add(session_item.session_uuid)
+        self.__loading_sessions.add(session_item.session_uuid)
+        self.session_load_requested.emit(
+            session_item.data(PublishTreeModel.LOG_FOLDER_ROLE)
         )
-        self.invisibleRootItem().appendRow(session_item)
 
-        # then, add the items and tasks
+    def populate_session(self, log_folder, session_data):
+        """
+        Add the items and tasks of an expanded publish session once its monitor file has been read.
+
+        :param log_folder: Path to the folder containing all the session files
+        :param session_data: The session data as returned by :meth:`MonitorReader.read_session`, or None if they
+            couldn't be read
+        """
+
+        session_item = self.__sessions_by_folder.get(log_folder)
+        if (
+            session_item is None
+            or session_item.session_uuid not in self.__loading_sessions
+        ):
+            return
+
+        session_uuid = session_item.session_uuid
+        self.__loading_sessions.discard(session_uuid)
+        if session_data is None:
+            self.__emit_data_changed([session_item])
+            return
+        monitor_data = session_data["monitor_data"]
+
+        # the task statuses stored in the model are more recent than the ones stored in the monitor file
+        statuses = self.__session_statuses[session_uuid]
+        creation_time = -session_item.data(PublishTreeModel.DATE_ROLE)
+
+        # the stages of the sessions added from the job index are only known from now on
+        if session_item.data(PublishTreeModel.TIMINGS_ROLE) is None:
+            session_item.setData(
+                monitor_data.get("stages", {}), PublishTreeModel.TIMINGS_ROLE
+            )
+
+        # the job may have ended since the session has been added
+        resources = session_data["resources"] or {}
+        if resources:
+            session_item.setData(resources["job"], PublishTreeModel.RESOURCES_ROLE)
+            self.__task_resources.update(resources["tasks"])
+
+        rows = []
         for item in monitor_data["items"]:
             # if the parent item is the root item, do not add the item, only the task
             if item["is_parent_root"]:
-                parent_item = session_item
+                parent_item = None
             else:
                 parent_item = PublishTreeModel.PublishTreeItem(
                     PublishTreeModel.PUBLISH_ITEM,
@@ -214,8 +526,9 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
                     session_uuid,
                     log_folder,
                     item_uuid=item["uuid"],
+                    creation_time=creation_time,
                 )
-                session_item.appendRow(parent_item)
+                rows.append(parent_item)
             for task in item["tasks"]:
                 task_item = PublishTreeModel.PublishTreeItem(
                     PublishTreeModel.PUBLISH_TASK,
@@ -223,48 +536,138 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
                     session_uuid,
                     log_folder,
                     item_uuid=task["uuid"],
+                    creation_time=creation_time,
                 )
-                task_item.setData(task["status"], PublishTreeModel.STATUS_ROLE)
-                if task["status"] in [
+                # the statuses of the sessions added from the job index are only known from now on
+                task_status = statuses.setdefault(task["uuid"], task["status"])
+                self.__task_sessions[task["uuid"]] = session_uuid
+                task_item.setData(task_status, PublishTreeModel.STATUS_ROLE)
+                task_item.setData(
+                    self.__task_timings.setdefault(
+                        task["uuid"], task.get("timings", {})
+                    ),
+                    PublishTreeModel.TIMINGS_ROLE,
+                )
+                task_item.setData(
+                    self.__task_resources.get(task["uuid"]),
+                    PublishTreeModel.RESOURCES_ROLE,
+                )
+                if task_status in [
                     constants.PUBLISH_FAILED,
                     constants.FINALIZE_FAILED,
                 ]:
-                    self.report_error(session_item, task_item, task["status"])
-                parent_item.appendRow(task_item)
-                self.__tasks.append(task_item)
+                    self.report_error(session_item, task_item, task_status)
+                self.__tasks[task_item.item_uuid] = task_item
+                if parent_item:
+                    parent_item.appendRow(task_item)
+                else:
+                    rows.append(task_item)
 
-        progress_value = self.get_progress_value(session_uuid)
-        session_item.setData(progress_value, PublishTreeModel.PROGRESS_ROLE)
-        self.sort(0)
+        # add all the rows at once
+        session_item.appendRows(rows)
 
-    def update_publish_tree(self, tree_file):
+    def update_publish_trees(self, updates):
         """
-        Update the publish session data
+        Update the publish sessions data
 
-        :param tree_file: Path to the file where the publish monitor data are stored
+        :param updates: List of the changes of each publish session as returned by :meth:`MonitorReader.read`
+        :return: The list of the monitor files of the publish sessions which have reached a terminal state
         """
 
-        with open(tree_file, "r") as fp:
-            monitor_data = yaml.load(fp, Loader=yaml.FullLoader)
-
-        for item in monitor_data["items"]:
-            for task in item["tasks"]:
-                task_item = self.get_item_from_uuid(task["uuid"])
-                if task_item:
-
-                    session_item = self.get_session_item(task_item.session_uuid)
-
-                    task_item.setData(task["status"], PublishTreeModel.STATUS_ROLE)
-                    if task["status"] in [
+        changed_items = []
+        updated_sessions = set()
+
+        # the model signals are blocked while the statuses are changed: a single dataChanged signal is emitted for each
+        # range of changed rows once all the changes are done
+        self.blockSignals(True)
+        try:
+            for update in updates:
+                # the session item only exists once the session has been added
+                session_item = self.get_session_item_from_log_folder(
+                    os.path.dirname(update["tree_file"])
+                )
+                if session_item and update.get("stage_events"):
+                    stages = dict(
+                        session_item.data(PublishTreeModel.TIMINGS_ROLE) or {}
+                    )
+                    for timestamp, stage, boundary in update["stage_events"]:
+                        monitor_io.update_timings(stages, stage, boundary, timestamp)
+                    session_item.setData(stages, PublishTreeModel.TIMINGS_ROLE)
+                    changed_items.append(session_item)
+
+                for task_uuid, task_status, timestamp in update["task_statuses"]:
+                    session_uuid = self.__task_sessions.get(task_uuid)
+                    if session_uuid is None or not self.__set_task_status(
+                        session_uuid, task_uuid, task_status, timestamp=timestamp
+                    ):
+                        continue
+
+                    updated_sessions.add(session_uuid)
+
+                    # the task item only exists if the session has been expanded
+                    task_item = self.get_item_from_uuid(task_uuid)
+                    if task_item:
+                        changed_items.append(task_item)
+
+                    if task_status in [
                         constants.PUBLISH_FAILED,
                         constants.FINALIZE_FAILED,
                     ]:
-                        self.report_error(session_item, task_item, task["status"])
+                        session_item = self.get_session_item(session_uuid)
+                        self.report_error(session_item, task_item, task_status)
+
+            # once the task statuses have been updated, force the publish sessions to refresh their progress value
+            for session_uuid in updated_sessions:
+                session_item = self.get_session_item(session_uuid)
+                progress_value = self.get_progress_value(session_uuid)
+                session_item.setData(progress_value, PublishTreeModel.PROGRESS_ROLE)
+                changed_items.append(session_item)
+        finally:
+            self.blockSignals(False)
+
+        self.__emit_data_changed(changed_items)
+
+        frozen_trees = []
+        for update in updates:
+            session_item = self.get_session_item_from_log_folder(
+                os.path.dirname(update["tree_file"])
+            )
+            if session_item and self.__update_frozen_state(
+                update["tree_file"], session_item, update["process_finished"]
+            ):
+                frozen_trees.append(update["tree_file"])
+                self.load_resources(os.path.dirname(update["tree_file"]))
 
-                    # once the task status has been updated, force the publish session to refresh its progress value
-                    progress_value = self.get_progress_value(task_item.session_uuid)
-                    session_item.setData(progress_value, PublishTreeModel.PROGRESS_ROLE)
-                    session_item.emitDataChanged()
+        return frozen_trees
+
+    def load_resources(self, log_folder):
+        """
+        Load the resources used by a publish session once its publish process is done.
+
+        :param log_folder: Path to the folder containing all the session files
+        """
+
+        session_item = self.__sessions_by_folder.get(log_folder)
+        resources = resource_sampler.load_job_resources(log_folder)
+        if session_item is None or not resources:
+            return
+
+        changed_items = [session_item]
+        self.blockSignals(True)
+        try:
+            session_item.setData(resources["job"], PublishTreeModel.RESOURCES_ROLE)
+            for task_uuid, task_resources in resources["tasks"].items():
+                if self.__task_sessions.get(task_uuid) != session_item.session_uuid:
+                    continue
+                self.__task_resources[task_uuid] = task_resources
+                task_item = self.get_item_from_uuid(task_uuid)
+                if task_item:
+                    task_item.setData(task_resources, PublishTreeModel.RESOURCES_ROLE)
+                    changed_items.append(task_item)
+        finally:
+            self.blockSignals(False)
+
+        self.__emit_data_changed(changed_items)
 
     def remove_publish_tree(self, tree_file):
         """
@@ -273,29 +676,41 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         :param tree_file: Path to the file where the publish monitor data are stored
         """
 
-        log_folder = os.path.dirname(tree_file)
+        self.__frozen_trees.discard(tree_file)
+
+        session_item = self.__sessions_by_folder.pop(os.path.dirname(tree_file), None)
+        if session_item:
+            self.__sessions.pop(session_item.session_uuid, None)
+            # evict the session tasks from the indexes so their items can be released
+            for task_uuid in self.__session_statuses.pop(session_item.session_uuid, {}):
+                self.__tasks.pop(task_uuid, None)
+                self.__task_sessions.pop(task_uuid, None)
+                self.__task_timings.pop(task_uuid, None)
+                self.__task_resources.pop(task_uuid, None)
+            self.__session_counters.pop(session_item.session_uuid, None)
+            self.__populated_sessions.discard(session_item.session_uuid)
+            self.__loading_sessions.discard(session_item.session_uuid)
+            self.__summary_sessions.discard(session_item.session_uuid)
+            self.invisibleRootItem().removeRow(session_item.row())
+
+    def is_publish_tree_frozen(self, tree_file):
+        """
+        Check if a publish session has reached a terminal state, meaning its monitor data will never change again.
 
-        for r in range(self.rowCount()):
-            item = self.item(r)
-            if (
-                item.data(PublishTreeModel.ITEM_TYPE_ROLE)
-                == PublishTreeModel.PUBLISH_SESSION
-            ):
-                if item.data(PublishTreeModel.LOG_FOLDER_ROLE) == log_folder:
-                    self.invisibleRootItem().removeRow(r)
-                    break
+        :param tree_file: Path to the file where the publish monitor data are stored
+        :return: True if the publish session is frozen, False otherwise
+        """
+        return tree_file in self.__frozen_trees
 
     def get_item_from_uuid(self, item_uuid):
         """
         Get the model item from the publish item UUID
 
         :param item_uuid: UUID of the publish item we want to get the associated model item
-        :return: The PublishTreeModel.PublishTreeItem representing the publish item
+        :return: The PublishTreeModel.PublishTreeItem representing the publish item or None if the publish session it
+            belongs to hasn't been expanded yet
         """
-        for i in self.__tasks:
-            if i.item_uuid == item_uuid:
-                return i
-        return None
+        return self.__tasks.get(item_uuid)
 
     def get_session_item(self, session_uuid):
         """
@@ -304,16 +719,16 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         :param session_uuid: UUID of the publish session we want to get the associated model item
         :return: The PublishTreeModel.PublishTreeItem representing the publish session
         """
-        for r in range(self.rowCount()):
-            item = self.item(r)
-            if (
-                item.data(PublishTreeModel.ITEM_TYPE_ROLE)
-                != PublishTreeModel.PUBLISH_SESSION
-            ):
-                continue
-            if item.session_uuid == session_uuid:
-                return item
-        return None
+        return self.__sessions.get(session_uuid)
+
+    def get_session_item_from_log_folder(self, log_folder):
+        """
+        Get the model item from the folder where the publish session files are stored
+
+        :param log_folder: Path to the folder containing all the session files
+        :return: The PublishTreeModel.PublishTreeItem representing the publish session
+        """
+        return self.__sessions_by_folder.get(log_folder)
 
     def get_progress_value(self, session_uuid):
         """
@@ -323,33 +738,167 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
         :return: The progress value of the publish session
         """
 
-        task_completed = 0
-        task_nb = 0
-
-        for t in self.__tasks:
-            if t.session_uuid != session_uuid:
-                continue
-            task_nb += 1
-            task_status = t.data(self.STATUS_ROLE)
-            if task_status in [
-                constants.PUBLISH_FINISHED,
-                constants.FINALIZE_IN_PROGRESS,
-            ]:
-                task_completed += 1
-            elif task_status == constants.FINALIZE_FINISHED:
-                task_completed += 2
+        task_nb, task_completed = self.__session_counters.get(session_uuid, (0, 0))
 
         progress = 100 * task_completed / (task_nb * 2) if task_nb != 0 else 0
 
         return int(progress)
 
+    def __get_sorted_row(self, date):
+        """
+        Find the row where a publish session needs to be inserted to keep the sessions sorted.
+
+        :param date: Value of the DATE_ROLE of the session to insert
+        :return: The row to insert the session at
+        """
+
+        low = 0
+        high = self.rowCount()
+        while low < high:
+            middle = (low + high) // 2
+            if self.item(middle).data(PublishTreeModel.DATE_ROLE) <= date:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __get_unpopulated_session(self, index):
+        """
+        Get the publish session item from its index if its items and tasks haven't been added yet.
+
+        :param index: The index of the item
+        :return: The PublishTreeModel.PublishTreeItem representing the publish session or None
+        """
+
+        if not index.isValid():
+            return None
+        item = self.itemFromIndex(index)
+        if (
+            item is None
+            or item.data(PublishTreeModel.ITEM_TYPE_ROLE)
+            != PublishTreeModel.PUBLISH_SESSION
+            or item.session_uuid in self.__populated_sessions
+        ):
+            return None
+        return item
+
+    def __set_task_status(self, session_uuid, task_uuid, task_status, timestamp=None):
+        """
+        Change the status of a task and update the counters of the publish session it belongs to.
+
+        :param session_uuid: UUID of the publish session the task belongs to
+        :param task_uuid: UUID of the publish task
+        :param task_status: The new publish task status
+        :param timestamp: Time of the status change, used to record the start and end times of the task steps. If
+            None, the task timings are left untouched.
+        :return: True if the status has changed, False otherwise
+        """
+
+        statuses = self.__session_statuses[session_uuid]
+        previous_status = statuses.get(task_uuid)
+        if previous_status == task_status:
+            return False
+        statuses[task_uuid] = task_status
+
+        counters = self.__session_counters[session_uuid]
+        counters[1] += self.__get_completed_steps(task_status)
+        counters[1] -= self.__get_completed_steps(previous_status)
+
+        if timestamp is not None:
+            timings = self.__task_timings.setdefault(task_uuid, {})
+            monitor_io.update_task_timings(timings, task_status, timestamp)
+
+        task_item = self.get_item_from_uuid(task_uuid)
+        if task_item:
+            task_item.setData(task_status, PublishTreeModel.STATUS_ROLE)
+            if timestamp is not None:
+                task_item.setData(
+                    dict(self.__task_timings[task_uuid]), PublishTreeModel.TIMINGS_ROLE
+                )
+
+        return True
+
+    @staticmethod
+    def __get_completed_steps(task_status):
+        """
+        Get the number of steps (publish and finalize) a task has completed.
+
+        :param task_status: The publish task status
+        :return: The number of completed steps
+        """
+        if task_status in [
+            constants.PUBLISH_FINISHED,
+            constants.FINALIZE_IN_PROGRESS,
+        ]:
+            return 1
+        elif task_status == constants.FINALIZE_FINISHED:
+            return 2
+        return 0
+
+    def __update_frozen_state(self, tree_file, session_item, process_finished):
+        """
+        Freeze the publish session if it has reached a terminal state: all its tasks are finalized or it has failed, and
+        its publish process has exited.
+
+        :param tree_file: Path to the file where the publish monitor data are stored
+        :param session_item: The publish session item
+        :param process_finished: True if the publish process has exited, None if it is unknown
+        :return: True if the publish session has just been frozen, False otherwise
+        """
+
+        if tree_file in self.__frozen_trees:
+            return False
+
+        # all the tasks are finalized once both steps of each task are completed
+        task_nb, task_completed = self.__session_counters.get(
+            session_item.session_uuid, (0, 0)
+        )
+
+        # the process only saves the resources it used once the tasks are done: wait for it to exit to freeze them
+        if task_completed == task_nb * 2 or session_item.data(self.STATUS_ROLE) in [
+            constants.PUBLISH_FAILED,
+            constants.FINALIZE_FAILED,
+        ]:
+            frozen = bool(process_finished)
+        else:
+            frozen = False
+
+        if frozen:
+            self._bundle.logger.debug(f"Publish session {tree_file} is now frozen")
+            self.__frozen_trees.add(tree_file)
+
+        return frozen
+
+    def __emit_data_changed(self, items):
+        """
+        Emit a single dataChanged signal for each range of rows containing the given items.
+
+        :param items: List of the items which have changed
+        """
+
+        ranges = {}
+        for item in items:
+            parent = item.parent()
+            key = id(parent) if parent is not None else None
+            row = item.row()
+            _, first, last = ranges.get(key, (parent, row, row))
+            ranges[key] = (parent, min(first, row), max(last, row))
+
+        for parent, first, last in ranges.values():
+            parent_index = (
+                parent.index() if parent is not None else QtCore.QModelIndex()
+            )
+            self.dataChanged.emit(
+                self.index(first, 0, parent_index), self.index(last, 0, parent_index)
+            )
+
     @staticmethod
     def report_error(session_item, task_item, task_status):
         """
         Modify the display text when the task item has failed
 
         :param session_item: The publish session item
-        :param task_item: The publish task item
+        :param task_item: The publish task item or None if it hasn't been created yet
         :param task_status: The publish task status
         """
 
@@ -358,6 +907,8 @@ class PublishTreeModel(QtGui.QStandardItemModel, ViewItemRolesMixin):
 
         # update session item and task item text to display them in red
         for i in [session_item, task_item]:
+            if i is None:
+                continue
             text = i.data(QtCore.Qt.DisplayRole)
             if not text.startswith("<span"):
                 i.setData(
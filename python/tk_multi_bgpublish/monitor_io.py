@@ -0,0 +1,924 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Helpers to read and write the monitor data of a background publish job.
+#
+# The monitor data are split in two files stored in the job folder:
+#  - monitor.yml: a snapshot of the whole publish tree statuses, compacted at phase boundaries
+#  - monitor_events.log: an append-only log where the publish process writes one line per status change
+#
+# Each line of the event log has the following format: "<timestamp> <item uuid> <task uuid> <status>", where a "-"
+# stands for a missing uuid. The snapshot stores the offset of the first event it doesn't contain yet, so readers only
+# have to consume the bytes written after this offset.
+#
+# The event log also records the boundaries of the stages of the publish process (bootstrap, session opening, publish,
+# finalize, ...) as "<timestamp> <stage> <start|end>" lines. The timestamps of the events give the start and end times
+# of each stage and of the publish and finalize steps of each task, which are also stored in the snapshot.
+#
+# The snapshot is always replaced atomically so readers never see a partially written file.
+#
+# The root of the cache folder also stores an index of all the jobs (jobs_index.txt) so the monitor doesn't have to open
+# each job folder to list them. Each line of the index has the following tab-separated format:
+# "<job folder name> <creation time> <status> <terminal> <progress> <session name>", where terminal is 1 once the
+# publish process has exited. The index is shared by all the publish processes: it is only modified while holding a
+# lock file and is always replaced atomically.
+
+import contextlib
+import os
+import tempfile
+import threading
+import time
+
+from tank_vendor import yaml
+
+from . import constants
+from . import progress_channel
+
+# placeholder written in the event log when an event doesn't target an item or a task
+NO_UUID = "-"
+
+# delay (in seconds) after which a lock on the job index is considered as left behind by a dead process
+INDEX_LOCK_TIMEOUT = 10.0
+
+# maximum delay (in seconds) to wait for the lock on the job index, long enough to take a lock left behind
+INDEX_LOCK_WAIT = 15.0
+
+# number of attempts to replace a file which is being read on Windows
+REPLACE_ATTEMPTS = 5
+
+FAILED_STATUSES = [constants.PUBLISH_FAILED, constants.FINALIZE_FAILED]
+
+(STAGE_START, STAGE_END) = ("start", "end")
+
+# step of a task each status belongs to, and whether the status starts or ends this step
+_TASK_STEP_BOUNDARIES = {
+    constants.PUBLISH_IN_PROGRESS: ("publish", STAGE_START),
+    constants.PUBLISH_FINISHED: ("publish", STAGE_END),
+    constants.PUBLISH_FAILED: ("publish", STAGE_END),
+    constants.FINALIZE_IN_PROGRESS: ("finalize", STAGE_START),
+    constants.FINALIZE_FINISHED: ("finalize", STAGE_END),
+    constants.FINALIZE_FAILED: ("finalize", STAGE_END),
+}
+
+
+def get_events_file_path(monitor_file_path):
+    """
+    Get the path to the event log associated to a monitor file.
+
+    :param monitor_file_path: Path to the monitor file
+    :return: Path to the event log stored next to the monitor file
+    """
+    return os.path.join(os.path.dirname(monitor_file_path), constants.EVENTS_FILE_NAME)
+
+
+def get_fingerprint(monitor_file_path):
+    """
+    Get a cheap fingerprint of the monitor data of a job, to know if they have changed without reading them.
+
+    :param monitor_file_path: Path to the monitor file
+    :return: A tuple of (mtime_ns, size, inode) tuples for the monitor file and its event log, or None if the monitor
+        file doesn't exist
+    """
+
+    fingerprint = []
+    for file_path in (monitor_file_path, get_events_file_path(monitor_file_path)):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            if file_path == monitor_file_path:
+                return None
+            fingerprint.append(None)
+        else:
+            fingerprint.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+
+    return tuple(fingerprint)
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, encoding=None):
+    """
+    Context manager writing a file atomically.
+
+    The content is written to a temporary file of the same folder which then replaces the file, so a reader either gets
+    the previous content or the new one but never a truncated file. The temporary file is removed if anything fails.
+
+    :param file_path: Path to the file to write
+    :param encoding: Encoding of the file. If None, the platform default encoding is used.
+    :return: The file object to write the content to, in text mode
+    """
+
+    fd, tmp_file_path = tempfile.mkstemp(
+        prefix=".{}_".format(os.path.splitext(os.path.basename(file_path))[0]),
+        suffix=".tmp",
+        dir=os.path.dirname(file_path),
+    )
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as fp:
+            yield fp
+        # on Windows, the replacement fails if another process is reading the file at the same time: retry a few times
+        for attempt in range(REPLACE_ATTEMPTS):
+            try:
+                os.replace(tmp_file_path, file_path)
+                break
+            except PermissionError:
+                if attempt == REPLACE_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.05)
+    finally:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+
+
+def load_monitor_data(monitor_file_path):
+    """
+    Load the monitor snapshot from disk.
+
+    :param monitor_file_path: Path to the monitor file
+    :return: The monitor data as a dictionary
+    """
+    with open(monitor_file_path, "r") as fp:
+        return yaml.load(fp, Loader=yaml.FullLoader)
+
+
+def save_monitor_data(monitor_file_path, monitor_data):
+    """
+    Atomically save the monitor snapshot to disk.
+
+    The data are written to a temporary file which then replaces the monitor file, so a reader either gets the previous
+    snapshot or the new one but never a truncated file.
+
+    :param monitor_file_path: Path to the monitor file
+    :param monitor_data: The monitor data to save
+    """
+
+    with atomic_write(monitor_file_path) as fp:
+        yaml.safe_dump(monitor_data, fp)
+
+
+def format_event(item_uuid, status, task_uuid=None, timestamp=None):
+    """
+    Build the event log line for a status change.
+
+    :param item_uuid: UUID of the item to update, if any
+    :param status: Value of the new status
+    :param task_uuid: UUID of the task to update, if any
+    :param timestamp: Time of the status change. If None, the current time is used.
+    :return: The line to append to the event log
+    """
+    return "{:.3f} {} {} {}\n".format(
+        time.time() if timestamp is None else timestamp,
+        item_uuid or NO_UUID,
+        task_uuid or NO_UUID,
+        status,
+    )
+
+
+def format_stage_event(stage, boundary, timestamp):
+    """
+    Build the event log line for the start or the end of a stage of the publish process.
+
+    :param stage: Name of the stage
+    :param boundary: STAGE_START or STAGE_END
+    :param timestamp: Time the stage has started or ended at
+    :return: The line to append to the event log
+    """
+    return "{:.3f} {} {}\n".format(timestamp, stage, boundary)
+
+
+def append_event(events_file_path, item_uuid, status, task_uuid=None):
+    """
+    Append a status change to the event log.
+
+    :param events_file_path: Path to the event log
+    :param item_uuid: UUID of the item to update, if any
+    :param status: Value of the new status
+    :param task_uuid: UUID of the task to update, if any
+    """
+
+    # write the whole line at once so a reader never sees a partial line other than the last one
+    with open(events_file_path, "a") as fp:
+        fp.write(format_event(item_uuid, status, task_uuid=task_uuid))
+
+
+def read_events(events_file_path, offset=0, stage_events=None):
+    """
+    Read the events appended to the event log since the given offset.
+
+    :param events_file_path: Path to the event log
+    :param offset: Offset (in bytes) of the first event to read
+    :param stage_events: If a list is given, the (timestamp, stage, boundary) tuples of the stage events are appended
+        to it
+    :return: A tuple (events, offset) where events is a list of (timestamp, item uuid, task uuid, status) tuples and
+        offset is the position to use for the next read
+    """
+
+    if not os.path.exists(events_file_path):
+        return [], offset
+
+    with open(events_file_path, "rb") as fp:
+        fp.seek(offset)
+        chunk = fp.read()
+
+    # the last line may still be written by the publish process: only consume complete lines
+    end = chunk.rfind(b"\n") + 1
+
+    return (
+        parse_events(chunk[:end].decode("utf-8"), stage_events=stage_events),
+        offset + end,
+    )
+
+
+def parse_events(text, stage_events=None):
+    """
+    Parse event log lines.
+
+    :param text: The complete lines to parse
+    :param stage_events: If a list is given, the (timestamp, stage, boundary) tuples of the stage events are appended
+        to it
+    :return: A list of (timestamp, item uuid, task uuid, status) tuples
+    """
+
+    events = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 3:
+            if stage_events is not None:
+                stage_events.append((float(fields[0]), fields[1], fields[2]))
+            continue
+        if len(fields) != 4:
+            continue
+        timestamp, item_uuid, task_uuid, status = fields
+        events.append(
+            (
+                float(timestamp),
+                None if item_uuid == NO_UUID else item_uuid,
+                None if task_uuid == NO_UUID else task_uuid,
+                int(status),
+            )
+        )
+
+    return events
+
+
+def apply_events(monitor_data, events, stage_events=None):
+    """
+    Apply the given events to the monitor data.
+
+    :param monitor_data: The monitor data to update
+    :param events: List of events as returned by :func:`read_events`
+    :param stage_events: List of stage events as returned by :func:`read_events`
+    """
+
+    for timestamp, stage, boundary in stage_events or []:
+        update_timings(
+            monitor_data.setdefault("stages", {}), stage, boundary, timestamp
+        )
+
+    if not events:
+        return
+
+    # index the items and tasks once to avoid going through the whole tree for each event
+    entries = {}
+    for item in monitor_data["items"]:
+        entries[item["uuid"]] = item
+        for task in item["tasks"]:
+            entries[task["uuid"]] = task
+
+    for timestamp, item_uuid, task_uuid, status in events:
+        for entry_uuid in (item_uuid, task_uuid):
+            entry = entries.get(entry_uuid)
+            if entry is not None:
+                entry["status"] = status
+        task = entries.get(task_uuid)
+        if task is not None:
+            update_task_timings(task.setdefault("timings", {}), status, timestamp)
+
+
+def update_timings(timings, name, boundary, timestamp):
+    """
+    Record the start or the end of a stage. When several processes run the same stage (shard mode), the stage lasts
+    from the earliest start to the latest end.
+
+    :param timings: Dictionary of the [start, end] times of each stage, updated in place. The end is None while the
+        stage is running.
+    :param name: Name of the stage
+    :param boundary: STAGE_START or STAGE_END
+    :param timestamp: Time the stage has started or ended at
+    """
+
+    timing = timings.get(name)
+    if boundary == STAGE_START:
+        if timing is None:
+            timings[name] = [timestamp, None]
+        else:
+            timing[0] = min(timing[0], timestamp)
+    elif boundary == STAGE_END:
+        if timing is None:
+            timings[name] = [timestamp, timestamp]
+        else:
+            timing[1] = timestamp if timing[1] is None else max(timing[1], timestamp)
+
+
+def update_task_timings(timings, status, timestamp):
+    """
+    Record the start or the end of a task step from a task status change.
+
+    :param timings: Dictionary of the [start, end] times of the "publish" and "finalize" steps of the task, updated in
+        place
+    :param status: The new task status
+    :param timestamp: Time of the status change
+    """
+    boundary = _TASK_STEP_BOUNDARIES.get(status)
+    if boundary is not None:
+        update_timings(timings, boundary[0], boundary[1], timestamp)
+
+
+def get_duration(timings, span=False):
+    """
+    Get the duration of the stages which have ended.
+
+    :param timings: Dictionary of the [start, end] times of each stage
+    :param span: If True, the duration goes from the earliest start to the latest end, otherwise it is the sum of the
+        stage durations
+    :return: The duration in seconds or None if no stage has ended
+    """
+
+    ended = [t for t in (timings or {}).values() if t[1] is not None]
+    if not ended:
+        return None
+    if span:
+        return max(t[1] for t in ended) - min(t[0] for t in ended)
+    return sum(t[1] - t[0] for t in ended)
+
+
+def get_job_summary(monitor_data):
+    """
+    Summarize the monitor data of a job as stored in the job index.
+
+    :param monitor_data: The monitor data of the job
+    :return: A dictionary with the "session_name", "status", "terminal" and "progress" keys
+    """
+
+    statuses = [
+        task["status"] for item in monitor_data["items"] for task in item["tasks"]
+    ]
+
+    # a failed job keeps its failure status, otherwise the job is as advanced as its least advanced task
+    failed_statuses = [s for s in statuses if s in FAILED_STATUSES]
+    if failed_statuses:
+        status = failed_statuses[-1]
+    elif statuses:
+        status = min(statuses)
+    else:
+        status = constants.FINALIZE_FINISHED
+
+    completed_steps = 0
+    for s in statuses:
+        if s in [constants.PUBLISH_FINISHED, constants.FINALIZE_IN_PROGRESS]:
+            completed_steps += 1
+        elif s == constants.FINALIZE_FINISHED:
+            completed_steps += 2
+
+    return {
+        "session_name": monitor_data.get("session_name", ""),
+        "status": status,
+        "terminal": bool(monitor_data.get("process_finished", False)),
+        "progress": int(100 * completed_steps / (len(statuses) * 2)) if statuses else 0,
+    }
+
+
+def get_index_file_path(cache_folder):
+    """
+    Get the path to the job index of a cache folder.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    :return: Path to the job index
+    """
+    return os.path.join(cache_folder, constants.INDEX_FILE_NAME)
+
+
+def read_job_index(cache_folder):
+    """
+    Read the job index of a cache folder.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    :return: A dictionary of the job entries indexed by job folder name. Each entry is a dictionary with the
+        "creation_time", "status", "terminal", "progress" and "session_name" keys.
+    """
+
+    index_file_path = get_index_file_path(cache_folder)
+    if not os.path.exists(index_file_path):
+        return {}
+
+    with open(index_file_path, "r", encoding="utf-8") as fp:
+        lines = fp.read().splitlines()
+
+    entries = {}
+    for line in lines:
+        fields = line.split("\t", 5)
+        if len(fields) != 6:
+            continue
+        job_name, creation_time, status, terminal, progress, session_name = fields
+        # a malformed line is dropped by the next write of the index
+        try:
+            entries[job_name] = {
+                "creation_time": float(creation_time),
+                "status": int(status),
+                "terminal": terminal == "1",
+                "progress": int(progress),
+                "session_name": session_name,
+            }
+        except ValueError:
+            continue
+
+    return entries
+
+
+def update_job_index(job_folder, entry=None):
+    """
+    Add, update or remove a job in the job index stored in its parent folder.
+
+    :param job_folder: Path to the job folder
+    :param entry: Dictionary of the job entry values to update, as returned by :func:`get_job_summary`. If None, the
+        job is removed from the index.
+    """
+
+    cache_folder = os.path.dirname(job_folder)
+
+    # the index is only a shortcut for the monitor, which reads the job folders it doesn't list: a job must never fail
+    # because its index entry couldn't be written, it will be written again by the next update
+    try:
+        _update_job_index(cache_folder, os.path.basename(job_folder), entry)
+    except (OSError, ValueError):
+        pass
+
+
+def prune_job_index(cache_folder):
+    """
+    Remove the jobs whose folder has been deleted from the job index.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    """
+
+    try:
+        with _lock_job_index(cache_folder):
+            entries = read_job_index(cache_folder)
+            deleted_jobs = [
+                name
+                for name in entries
+                if not os.path.isdir(os.path.join(cache_folder, name))
+            ]
+            if deleted_jobs:
+                for name in deleted_jobs:
+                    del entries[name]
+                _write_job_index(cache_folder, entries)
+    except (OSError, ValueError):
+        pass
+
+
+def _update_job_index(cache_folder, job_name, entry):
+    """
+    Add, update or remove a job in the job index.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    :param job_name: Name of the job folder
+    :param entry: Dictionary of the job entry values to update or None to remove the job from the index
+    """
+
+    with _lock_job_index(cache_folder):
+
+        entries = read_job_index(cache_folder)
+
+        if entry is None:
+            entries.pop(job_name, None)
+        else:
+            job_entry = entries.setdefault(job_name, {})
+            job_entry.update(entry)
+            if "creation_time" not in job_entry:
+                job_entry["creation_time"] = os.stat(
+                    os.path.join(cache_folder, job_name)
+                ).st_ctime
+
+        _write_job_index(cache_folder, entries)
+
+
+def _write_job_index(cache_folder, entries):
+    """
+    Write the job index. The lock of the index must be held.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    :param entries: Dictionary of the job entries indexed by job folder name
+    """
+
+    lines = []
+    for name, e in entries.items():
+        session_name = e.get("session_name", "").replace("\t", " ")
+        lines.append(
+            "{}\t{:.3f}\t{}\t{}\t{}\t{}\n".format(
+                name,
+                e["creation_time"],
+                e.get("status", constants.WAITING_TO_START),
+                1 if e.get("terminal") else 0,
+                e.get("progress", 0),
+                " ".join(session_name.splitlines()),
+            )
+        )
+
+    with atomic_write(get_index_file_path(cache_folder), encoding="utf-8") as fp:
+        fp.writelines(lines)
+
+
+@contextlib.contextmanager
+def _lock_job_index(cache_folder):
+    """
+    Context manager holding the lock of the job index of a cache folder.
+
+    :param cache_folder: Path to the folder where all the job folders are stored
+    :raises TimeoutError: If the lock couldn't be taken within INDEX_LOCK_WAIT seconds
+    """
+
+    lock_file_path = os.path.join(cache_folder, constants.INDEX_LOCK_FILE_NAME)
+    deadline = time.time() + INDEX_LOCK_WAIT
+    while True:
+        try:
+            fd = os.open(lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            # the process holding the lock may have died without releasing it
+            _remove_stale_lock(lock_file_path)
+        except PermissionError:
+            # on Windows, the lock file can't be created while it is being removed
+            pass
+        if time.time() > deadline:
+            raise TimeoutError(
+                "Couldn't lock the job index of {} within {} seconds".format(
+                    cache_folder, INDEX_LOCK_WAIT
+                )
+            )
+        time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        # the lock may have been taken away if it has been held for too long: only remove it if it is still ours
+        lock_inode = os.fstat(fd).st_ino
+        os.close(fd)
+        try:
+            if os.stat(lock_file_path).st_ino == lock_inode:
+                os.remove(lock_file_path)
+        except OSError:
+            pass
+
+
+def _remove_stale_lock(lock_file_path):
+    """
+    Remove a lock on the job index left behind by a dead process.
+
+    The lock is first renamed, which is atomic: when several processes find the same stale lock, only one of them takes
+    it away and the others keep waiting for the lock it will then take.
+
+    :param lock_file_path: Path to the lock file
+    """
+
+    stale_file_path = "{}.{}.{}.stale".format(
+        lock_file_path, os.getpid(), threading.get_ident()
+    )
+    try:
+        if time.time() - os.path.getmtime(lock_file_path) <= INDEX_LOCK_TIMEOUT:
+            return
+        os.rename(lock_file_path, stale_file_path)
+    except OSError:
+        return
+
+    # another process may have taken the stale lock away and locked the index again in the meantime: give this lock
+    # back to it
+    try:
+        if time.time() - os.path.getmtime(stale_file_path) <= INDEX_LOCK_TIMEOUT:
+            os.rename(stale_file_path, lock_file_path)
+            return
+    except OSError:
+        pass
+
+    try:
+        os.remove(stale_file_path)
+    except OSError:
+        pass
+
+
+def fail_pending_job(monitor_file_path):
+    """
+    Flag the tasks of a job whose publish process will never run as failed, so the job reaches a terminal state.
+
+    :param monitor_file_path: Path to the monitor file of the job
+    """
+
+    monitor_state = MonitorState(monitor_file_path)
+    try:
+        for item in monitor_state.data["items"]:
+            for task in item["tasks"]:
+                if task["status"] == constants.WAITING_TO_START:
+                    monitor_state.set_status(
+                        item["uuid"], constants.PUBLISH_FAILED, task_uuid=task["uuid"]
+                    )
+    finally:
+        monitor_state.close()
+
+
+class MonitorState(object):
+    """
+    In-memory copy of the monitor data, owned by the background publish process.
+
+    Every status change is immediately appended to the event log while the snapshot is written out at most every
+    ``flush_interval`` seconds, or when explicitly flushed at the end of a phase. The job index is only updated when the
+    snapshot is explicitly flushed.
+
+    When several processes publish the same job (shard mode), they all append their status changes to the same event
+    log but only one of them owns the snapshot: it replays the whole event log before each write so the snapshot also
+    contains the changes made by the other processes.
+
+    The status changes can be made from several threads of the same process. They can also be streamed to the open
+    monitors through a progress channel, so they are displayed without waiting for the monitor to read the event log.
+    """
+
+    _IN_PROGRESS_STATUSES = [
+        constants.PUBLISH_IN_PROGRESS,
+        constants.FINALIZE_IN_PROGRESS,
+    ]
+
+    def __init__(
+        self,
+        monitor_file_path,
+        flush_interval=0.5,
+        owns_snapshot=True,
+        shared=False,
+        stream=False,
+        on_in_flight_changed=None,
+    ):
+        """
+        Class constructor
+
+        :param monitor_file_path: Path to the monitor file
+        :param flush_interval: Minimum delay (in seconds) between two snapshot writes
+        :param owns_snapshot: If False, the status changes are only written to the event log, the snapshot and the job
+            index being maintained by another process
+        :param shared: True if other processes write to the same event log
+        :param stream: If True, the status changes are also sent to the open monitors through a progress channel
+        :param on_in_flight_changed: Callable called with the UUID of the previous task being processed and the UUID of
+            the new one, each of them possibly None, when the task being processed changes. It is called with the lock
+            held, from the thread changing the status.
+        """
+
+        self._monitor_file_path = monitor_file_path
+        self._flush_interval = flush_interval
+        self._owns_snapshot = owns_snapshot
+        self._shared = shared
+        self._last_flush = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+
+        # the task currently processed by the publish process, used to know which task has failed
+        self._in_flight = None
+        self._on_in_flight_changed = on_in_flight_changed
+
+        self._data = load_monitor_data(monitor_file_path)
+
+        # if the process is resumed, start from the latest known statuses
+        events_file_path = get_events_file_path(monitor_file_path)
+        stage_events = []
+        events, self._replayed_offset = read_events(
+            events_file_path,
+            self._data.get("events_offset", 0),
+            stage_events=stage_events,
+        )
+        apply_events(self._data, events, stage_events=stage_events)
+
+        self._entries = {}
+        for item in self._data["items"]:
+            self._entries[item["uuid"]] = item
+            for task in item["tasks"]:
+                self._entries[task["uuid"]] = task
+
+        self._events_fp = open(events_file_path, "ab")
+
+        # the changes are always written to the event log before being streamed, the channel only speeds up their
+        # display
+        self._channel = None
+        if stream:
+            try:
+                self._channel = progress_channel.ProgressChannel(
+                    os.path.dirname(monitor_file_path)
+                )
+            except OSError:
+                # the monitors will read the changes from the event log
+                pass
+
+    @property
+    def data(self):
+        """
+        The monitor data currently known by the publish process.
+        """
+        return self._data
+
+    @property
+    def in_flight_task(self):
+        """
+        A tuple (item uuid, task uuid) of the task being processed or None if no task is being processed.
+        """
+        return self._in_flight
+
+    def set_status(self, item_uuid, status, task_uuid=None, track_in_flight=True):
+        """
+        Change the status of an item and/or a task.
+
+        :param item_uuid: UUID of the item to update, if any
+        :param status: Value of the new status
+        :param task_uuid: UUID of the task to update, if any
+        :param track_in_flight: If False, the task won't be reported as the task being processed. Used for the tasks
+            run in parallel which report their failure themselves.
+        """
+        with self._lock:
+            self.__set_status(item_uuid, status, task_uuid, track_in_flight)
+
+    def __set_status(self, item_uuid, status, task_uuid, track_in_flight):
+        """
+        Change the status of an item and/or a task, the lock being held.
+
+        :param item_uuid: UUID of the item to update, if any
+        :param status: Value of the new status
+        :param task_uuid: UUID of the task to update, if any
+        :param track_in_flight: If False, the task won't be reported as the task being processed
+        """
+
+        timestamp = time.time()
+
+        for entry_uuid in (item_uuid, task_uuid):
+            entry = self._entries.get(entry_uuid)
+            if entry is not None:
+                entry["status"] = status
+
+        task = self._entries.get(task_uuid)
+        if task is not None:
+            update_task_timings(task.setdefault("timings", {}), status, timestamp)
+
+        if task_uuid and track_in_flight:
+            previous_in_flight = self._in_flight
+            if status in self._IN_PROGRESS_STATUSES:
+                self._in_flight = (item_uuid, task_uuid)
+            elif self._in_flight and self._in_flight[1] == task_uuid:
+                self._in_flight = None
+            if self._on_in_flight_changed and self._in_flight != previous_in_flight:
+                self._on_in_flight_changed(
+                    (previous_in_flight or (None, None))[1],
+                    (self._in_flight or (None, None))[1],
+                )
+
+        self.__write_event(
+            format_event(item_uuid, status, task_uuid=task_uuid, timestamp=timestamp)
+        )
+
+    def record_stage(self, stage, start_time, end_time=None):
+        """
+        Record the start time and the end time of a stage of the publish process.
+
+        :param stage: Name of the stage
+        :param start_time: Time the stage has started at
+        :param end_time: Time the stage has ended at. If None, the stage is still running.
+        """
+        with self._lock:
+            self.__write_stage_event(stage, STAGE_START, start_time)
+            if end_time is not None:
+                self.__write_stage_event(stage, STAGE_END, end_time)
+
+    @contextlib.contextmanager
+    def measure_stage(self, stage):
+        """
+        Record the start time and the end time of a stage of the publish process run within the context, even if it
+        fails.
+
+        :param stage: Name of the stage
+        """
+        self.record_stage(stage, time.time())
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.__write_stage_event(stage, STAGE_END, time.time())
+
+    def __write_stage_event(self, stage, boundary, timestamp):
+        """
+        Record the start or the end of a stage, the lock being held.
+
+        :param stage: Name of the stage
+        :param boundary: STAGE_START or STAGE_END
+        :param timestamp: Time the stage has started or ended at
+        """
+        update_timings(self._data.setdefault("stages", {}), stage, boundary, timestamp)
+        self.__write_event(format_stage_event(stage, boundary, timestamp))
+
+    def __write_event(self, line):
+        """
+        Append a line to the event log and send it to the open monitors, the lock being held.
+
+        :param line: The event log line
+        """
+
+        self._events_fp.write(line.encode("utf-8"))
+        self._events_fp.flush()
+        if self._channel:
+            self._channel.send(line)
+
+        self._dirty = True
+        self.__flush(False)
+
+    def flush(self, force=True):
+        """
+        Write the snapshot to disk if it has changed.
+
+        :param force: If False, the snapshot will only be written if the flush interval has elapsed since the last write
+        """
+        with self._lock:
+            self.__flush(force)
+
+    def __flush(self, force):
+        """
+        Write the snapshot to disk if it has changed, the lock being held.
+
+        :param force: If False, the snapshot will only be written if the flush interval has elapsed since the last write
+        """
+
+        if not self._dirty or not self._owns_snapshot:
+            return
+        if not force and time.time() - self._last_flush < self._flush_interval:
+            return
+
+        if self._shared:
+            # the event log is the only place where the changes of all the processes are gathered
+            self.__replay_events()
+            self._data["events_offset"] = self._replayed_offset
+        else:
+            self._data["events_offset"] = self._events_fp.tell()
+        save_monitor_data(self._monitor_file_path, self._data)
+        self._last_flush = time.time()
+        self._dirty = False
+
+        # the job index is shared by all the publish processes: only update it at phase boundaries
+        if force:
+            update_job_index(
+                os.path.dirname(self._monitor_file_path), get_job_summary(self._data)
+            )
+
+    def __replay_events(self):
+        """
+        Apply the changes written to the event log by the other processes, the lock being held.
+        """
+        stage_events = []
+        events, self._replayed_offset = read_events(
+            get_events_file_path(self._monitor_file_path),
+            self._replayed_offset,
+            stage_events=stage_events,
+        )
+        apply_events(self._data, events, stage_events=stage_events)
+
+    def fail_unfinished_tasks(self, task_uuids, failed_status):
+        """
+        Flag the tasks which are waiting to start or in progress as failed, like the tasks of a process which has died.
+
+        :param task_uuids: List of the UUIDs of the tasks to check
+        :param failed_status: Value of the failed status
+        """
+
+        task_uuids = set(task_uuids)
+        with self._lock:
+            # the tasks may have been processed by other processes
+            if self._shared:
+                self.__replay_events()
+            for item in self._data["items"]:
+                for task in item["tasks"]:
+                    if (
+                        task["uuid"] in task_uuids
+                        and task["status"]
+                        in [constants.WAITING_TO_START] + self._IN_PROGRESS_STATUSES
+                    ):
+                        self.__set_status(
+                            item["uuid"], failed_status, task["uuid"], False
+                        )
+            self.__flush(True)
+
+    def close(self):
+        """
+        Flush the pending changes, flag the monitor data as final and release the event log.
+        """
+        with self._lock:
+            if self._events_fp.closed:
+                return
+            # let the monitor know that nothing will be written anymore
+            self._data["process_finished"] = True
+            self._dirty = True
+            self.__flush(True)
+            self._events_fp.close()
+            if self._channel:
+                self._channel.close()
@@ -0,0 +1,464 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+import os
+import threading
+import time
+
+from . import constants
+from . import monitor_io
+from . import progress_channel
+from . import resource_sampler
+
+
+class MonitorReader(object):
+    """
+    Read the monitor data of the background publish jobs stored in the cache folder.
+
+    This class doesn't rely on Qt so it can be run in a background thread: it only reads the files and returns what has
+    changed since the previous read. The changes are then applied to the model from the main thread.
+    """
+
+    FAILED_STATUSES = [constants.PUBLISH_FAILED, constants.FINALIZE_FAILED]
+
+    def __init__(self, cache_folder, max_sessions=0, max_days=0):
+        """
+        Class constructor
+
+        :param cache_folder: Path to the folder where all the job folders are stored
+        :param max_sessions: Number of the most recent publish sessions to read at first. If 0, all the sessions will be
+            read.
+        :param max_days: Number of days of publish sessions to read at first. If 0, all the sessions will be read.
+        """
+
+        self._cache_folder = cache_folder
+        self._max_sessions = max_sessions
+        self._max_days = max_days
+
+        # creation time of each job folder, read only once
+        self.__creation_times = {}
+
+        # only the job folders created after this time are read, the older ones being loaded on demand
+        self.__history_cutoff = None
+        self.__history_initialized = False
+
+        # fingerprint of each monitor file already read when it was last read, to avoid parsing files which haven't
+        # changed
+        self.__fingerprints = {}
+
+        # offset of the next event to read in the event log of each monitor file
+        self.__events_offsets = {}
+
+        # tasks which aren't finalized yet of each running session
+        self.__pending_tasks = {}
+
+        # monitor files of the sessions which have failed or whose tasks are all finalized: their snapshot needs to be
+        # checked to know when their process has exited, after it has saved the resources it used
+        self.__exiting_trees = set()
+
+        # monitor files of the sessions which have reached a terminal state and will never change again
+        self.__frozen_trees = set()
+
+        # job folders found without any monitor file, their job being created
+        self.__unread_folders = set()
+
+        # content of the job index, only parsed again when the index file has changed
+        self.__index = {}
+        self.__index_fingerprint = None
+        self.__pruned_index_fingerprint = None
+
+        # the main thread makes its requests while a read may be running in a background thread: they are queued and
+        # only applied at the start of the next read, which is the only one to modify the reader state
+        self.__lock = threading.Lock()
+        self.__freeze_requests = set()
+        self.__load_more_requests = []
+
+    def freeze(self, tree_file):
+        """
+        Stop reading a monitor file as its publish session has reached a terminal state, from the next read on.
+
+        :param tree_file: Path to the file where the publish monitor data are stored
+        """
+        with self.__lock:
+            self.__freeze_requests.add(tree_file)
+
+    def read(self, job_folders=None):
+        """
+        Read the monitor data which have changed since the last read.
+
+        :param job_folders: List of the job folders to read. If None, all the job folders found in the cache folder
+            will be read.
+        :return: A dictionary with the following keys:
+            - added: a list of dictionaries describing the new publish sessions, with the "tree_file", "monitor_data",
+              "summary" and "creation_time" keys. The sessions which had already reached a terminal state are only
+              described by the summary stored in the job index: their monitor data are None
+            - updated: a list of dictionaries describing the changes of the known publish sessions, with the
+              "tree_file", "task_statuses", "stage_events" and "process_finished" keys. The task statuses are
+              (task uuid, status, timestamp) tuples, the timestamp being None when it is unknown
+            - removed: a list of the monitor files which don't exist anymore
+            - hidden_count: the number of older publish sessions which haven't been loaded yet, or None if only some
+              job folders have been read
+            - channels: a dictionary of the (port, token) pairs of the progress channels advertised by the running
+              publish processes, indexed by job folder
+            - watch_paths: a dictionary of the paths to watch to be notified when a publish session changes, indexed
+              by monitor file. Only the sessions which have been read and can still change are listed
+        """
+
+        diff = {
+            "added": [],
+            "updated": [],
+            "removed": [],
+            "hidden_count": None,
+            "channels": {},
+            "watch_paths": {},
+        }
+
+        with self.__lock:
+            freeze_requests = self.__freeze_requests
+            load_more_requests = self.__load_more_requests
+            self.__freeze_requests = set()
+            self.__load_more_requests = []
+        self.__frozen_trees.update(freeze_requests)
+        for page_size in load_more_requests:
+            self.__extend_history_window(page_size)
+
+        if not os.path.exists(self._cache_folder):
+            return diff
+
+        # when all the job folders are listed, the jobs which are not part of the list anymore have been removed
+        all_folders = job_folders is None
+        if all_folders:
+            self.__read_index()
+            job_folders = [e.path for e in os.scandir(self._cache_folder) if e.is_dir()]
+            self.__prune_index(job_folders)
+            job_folders, diff["hidden_count"] = self.__apply_history_window(job_folders)
+
+        for job_folder in job_folders:
+
+            tree_file = os.path.join(job_folder, constants.MONITOR_FILE_NAME)
+
+            # the sessions which have reached a terminal state will never change again
+            if tree_file in self.__frozen_trees:
+                continue
+
+            # the sessions older than the history window are only read once the window has been extended
+            if (
+                not all_folders
+                and self.__history_cutoff is not None
+                and self.__creation_times.get(job_folder, self.__history_cutoff)
+                < self.__history_cutoff
+            ):
+                continue
+
+            # only read the monitor data if something has changed since the last read
+            fingerprint = monitor_io.get_fingerprint(tree_file)
+            previous_fingerprint = self.__fingerprints.get(tree_file)
+            if fingerprint is None:
+                if previous_fingerprint is not None:
+                    diff["removed"].append(tree_file)
+                elif os.path.isdir(job_folder):
+                    self.__unread_folders.add(job_folder)
+                else:
+                    self.__unread_folders.discard(job_folder)
+                continue
+            self.__unread_folders.discard(job_folder)
+            if fingerprint == previous_fingerprint:
+                continue
+
+            # no need to open the monitor file of a session which had already reached a terminal state, the job index
+            # already knows everything to display it
+            index_entry = self.__index.get(os.path.basename(job_folder))
+            if previous_fingerprint is None and index_entry and index_entry["terminal"]:
+                diff["added"].append(
+                    {
+                        "tree_file": tree_file,
+                        "monitor_data": None,
+                        "summary": index_entry,
+                        "creation_time": index_entry["creation_time"],
+                    }
+                )
+                self.__fingerprints[tree_file] = fingerprint
+                self.__frozen_trees.add(tree_file)
+                continue
+
+            # the running publish processes may stream their changes. Only look for their channels once the job has
+            # changed, which always happens when a process starts, to avoid listing every job folder
+            channels = progress_channel.get_channels(job_folder)
+            if channels:
+                diff["channels"][job_folder] = channels
+
+            if previous_fingerprint is None:
+                diff["added"].append(self.__read_new_tree(tree_file))
+            else:
+                diff["updated"].append(
+                    self.__read_tree_changes(
+                        tree_file, fingerprint[0] != previous_fingerprint[0]
+                    )
+                )
+            self.__fingerprints[tree_file] = fingerprint
+
+        if all_folders:
+            job_folders = set(job_folders)
+            diff["removed"].extend(
+                f for f in self.__fingerprints if os.path.dirname(f) not in job_folders
+            )
+            self.__unread_folders &= job_folders
+
+        for tree_file in diff["removed"]:
+            self.__fingerprints.pop(tree_file, None)
+            self.__events_offsets.pop(tree_file, None)
+            self.__pending_tasks.pop(tree_file, None)
+            self.__exiting_trees.discard(tree_file)
+            self.__frozen_trees.discard(tree_file)
+
+        # a job changes when files are added to its folder or when its event log grows
+        for job_folder in self.__unread_folders:
+            tree_file = os.path.join(job_folder, constants.MONITOR_FILE_NAME)
+            diff["watch_paths"][tree_file] = [job_folder]
+        for tree_file in self.__fingerprints:
+            if tree_file in self.__frozen_trees:
+                continue
+            watch_paths = [os.path.dirname(tree_file)]
+            events_file = monitor_io.get_events_file_path(tree_file)
+            if os.path.exists(events_file):
+                watch_paths.append(events_file)
+            diff["watch_paths"][tree_file] = watch_paths
+
+        return diff
+
+    def load_more(self, page_size):
+        """
+        Extend the history window to the next page of older publish sessions. This method can be called from any
+        thread: the older sessions will be read during the next read of all the job folders.
+
+        :param page_size: Number of older publish sessions to add
+        """
+        with self.__lock:
+            self.__load_more_requests.append(page_size)
+
+    def read_session(self, job_folder):
+        """
+        Read the items and tasks of a publish session, to display them once the session is expanded. This method
+        doesn't change the reader state so it can be run at the same time as :meth:`read`.
+
+        :param job_folder: Path to the job folder
+        :return: A dictionary with the "monitor_data" and "resources" keys. The resources are None until the job is
+            done.
+        """
+        return {
+            "monitor_data": monitor_io.load_monitor_data(
+                os.path.join(job_folder, constants.MONITOR_FILE_NAME)
+            ),
+            "resources": resource_sampler.load_job_resources(job_folder),
+        }
+
+    def __extend_history_window(self, page_size):
+        """
+        Extend the history window to the next page of older publish sessions.
+
+        :param page_size: Number of older publish sessions to add
+        """
+
+        if self.__history_cutoff is None:
+            return
+
+        older_times = sorted(
+            (t for t in self.__creation_times.values() if t < self.__history_cutoff),
+            reverse=True,
+        )
+        if len(older_times) <= page_size:
+            self.__history_cutoff = None
+        else:
+            self.__history_cutoff = older_times[page_size - 1]
+
+    def __read_index(self):
+        """
+        Read the job index again if it has changed since the last read.
+        """
+
+        index_file_path = monitor_io.get_index_file_path(self._cache_folder)
+        try:
+            stat = os.stat(index_file_path)
+        except OSError:
+            self.__index = {}
+            self.__index_fingerprint = None
+            return
+
+        fingerprint = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if fingerprint != self.__index_fingerprint:
+            self.__index = monitor_io.read_job_index(self._cache_folder)
+            self.__index_fingerprint = fingerprint
+
+    def __prune_index(self, job_folders):
+        """
+        Remove the jobs which have been deleted from the disk from the job index, once for each version of the index.
+
+        :param job_folders: List of all the job folders
+        """
+
+        if self.__index_fingerprint == self.__pruned_index_fingerprint:
+            return
+        self.__pruned_index_fingerprint = self.__index_fingerprint
+
+        job_names = set(os.path.basename(f) for f in job_folders)
+        if any(name not in job_names for name in self.__index):
+            monitor_io.prune_job_index(self._cache_folder)
+
+    def __apply_history_window(self, job_folders):
+        """
+        Filter out the job folders which are older than the history window.
+
+        :param job_folders: List of all the job folders
+        :return: A tuple (job folders, hidden count) where job folders is the list of the job folders within the history
+            window and hidden count the number of job folders which have been filtered out
+        """
+
+        creation_times = {}
+        for job_folder in job_folders:
+            creation_time = self.__creation_times.get(job_folder)
+            if creation_time is None:
+                index_entry = self.__index.get(os.path.basename(job_folder))
+                if index_entry:
+                    creation_time = index_entry["creation_time"]
+            if creation_time is None:
+                try:
+                    creation_time = os.stat(job_folder).st_ctime
+                except OSError:
+                    continue
+            creation_times[job_folder] = creation_time
+        self.__creation_times = creation_times
+
+        # the window is computed during the first read: the sessions created later on will always be part of it
+        if not self.__history_initialized:
+            self.__history_initialized = True
+            cutoffs = []
+            if self._max_days:
+                cutoffs.append(time.time() - self._max_days * 24 * 3600)
+            if self._max_sessions and len(creation_times) > self._max_sessions:
+                cutoffs.append(
+                    sorted(creation_times.values(), reverse=True)[
+                        self._max_sessions - 1
+                    ]
+                )
+            if cutoffs:
+                self.__history_cutoff = max(cutoffs)
+
+        if self.__history_cutoff is None:
+            return list(creation_times), 0
+
+        visible_folders = [
+            f for f, t in creation_times.items() if t >= self.__history_cutoff
+        ]
+        return visible_folders, len(creation_times) - len(visible_folders)
+
+    def __read_new_tree(self, tree_file):
+        """
+        Read the monitor data of a publish session which has never been read.
+
+        :param tree_file: Path to the file where the publish monitor data are stored
+        :return: A dictionary describing the new publish session
+        """
+
+        monitor_data = monitor_io.load_monitor_data(tree_file)
+
+        job_folder = os.path.dirname(tree_file)
+        creation_time = self.__creation_times.get(job_folder)
+        if creation_time is None:
+            creation_time = os.stat(job_folder).st_ctime
+
+        # the snapshot may not contain the latest status changes yet: apply the events written after it
+        stage_events = []
+        events, offset = monitor_io.read_events(
+            monitor_io.get_events_file_path(tree_file),
+            monitor_data.get("events_offset", 0),
+            stage_events=stage_events,
+        )
+        monitor_io.apply_events(monitor_data, events, stage_events=stage_events)
+        self.__events_offsets[tree_file] = offset
+
+        # the publish process flags the monitor file once it has exited. Monitor files written by older versions
+        # don't have this flag but their failure was always the last thing written by the process
+        monitor_data.setdefault("process_finished", True)
+
+        # the resources are only saved once the job is done
+        monitor_data["resources"] = resource_sampler.load_job_resources(job_folder)
+
+        pending_tasks = set()
+        for item in monitor_data["items"]:
+            for task in item["tasks"]:
+                if task["status"] in self.FAILED_STATUSES:
+                    self.__exiting_trees.add(tree_file)
+                elif task["status"] != constants.FINALIZE_FINISHED:
+                    pending_tasks.add(task["uuid"])
+
+        if not monitor_data["process_finished"]:
+            if pending_tasks:
+                self.__pending_tasks[tree_file] = pending_tasks
+            else:
+                self.__exiting_trees.add(tree_file)
+
+        return {
+            "tree_file": tree_file,
+            "monitor_data": monitor_data,
+            "summary": None,
+            "creation_time": creation_time,
+        }
+
+    def __read_tree_changes(self, tree_file, snapshot_changed):
+        """
+        Read the status changes of a publish session which has already been read.
+
+        :param tree_file: Path to the file where the publish monitor data are stored
+        :param snapshot_changed: True if the monitor file has changed since the last read
+        :return: A dictionary describing the changes of the publish session
+        """
+
+        process_finished = None
+        stage_events = []
+
+        events_file = monitor_io.get_events_file_path(tree_file)
+        if os.path.exists(events_file):
+            # only consume the events written since the last read
+            events, offset = monitor_io.read_events(
+                events_file,
+                self.__events_offsets.get(tree_file, 0),
+                stage_events=stage_events,
+            )
+            self.__events_offsets[tree_file] = offset
+            task_statuses = [(e[2], e[3], e[0]) for e in events if e[2]]
+            if any(s in self.FAILED_STATUSES for _, s, _ in task_statuses):
+                self.__exiting_trees.add(tree_file)
+
+            pending_tasks = self.__pending_tasks.get(tree_file)
+            if pending_tasks is not None:
+                pending_tasks.difference_update(
+                    u for u, s, _ in task_statuses if s == constants.FINALIZE_FINISHED
+                )
+                if not pending_tasks:
+                    del self.__pending_tasks[tree_file]
+                    self.__exiting_trees.add(tree_file)
+
+            # the snapshot only needs to be parsed to know if the process of a failed or finalized session has exited
+            if tree_file in self.__exiting_trees and snapshot_changed:
+                monitor_data = monitor_io.load_monitor_data(tree_file)
+                process_finished = monitor_data.get("process_finished", True)
+        else:
+            # publish process which doesn't write any event log: fall back on the snapshot
+            monitor_data = monitor_io.load_monitor_data(tree_file)
+            task_statuses = [
+                (task["uuid"], task["status"], None)
+                for item in monitor_data["items"]
+                for task in item["tasks"]
+            ]
+            process_finished = monitor_data.get("process_finished", True)
+
+        return {
+            "tree_file": tree_file,
+            "task_statuses": task_statuses,
+            "stage_events": stage_events,
+            "process_finished": process_finished,
+        }
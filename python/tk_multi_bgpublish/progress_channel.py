@@ -0,0 +1,224 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Streaming channel used by the background publish process to push its status changes to the monitor as soon as they
+# happen.
+#
+# The publish process listens on a local TCP port and advertises it in a "progress_<pid>.channel" file of the job
+# folder, so several processes publishing the same job (shard mode) each advertise their own channel. The channel file
+# also holds a random token, only readable by the user owning the job as the file is created with 0600 permissions: a
+# monitor must send it first once connected, the other connections being closed. Every status
+# change is sent to the connected monitors as the same line as the one appended to the event log. The event log stays
+# the durable source of truth: a monitor which is opened later on or which misses some lines reads them from the file.
+
+import hmac
+import os
+import queue
+import secrets
+import socket
+import threading
+
+from . import monitor_io
+
+CHANNEL_FILE_PREFIX = "progress_"
+CHANNEL_FILE_EXTENSION = ".channel"
+
+# delay (in seconds) after which a monitor which doesn't read the lines sent to it is disconnected
+SEND_TIMEOUT = 1.0
+
+# number of random bytes of the token a monitor must send to be accepted
+TOKEN_SIZE = 16
+
+
+def get_channel_file_path(job_folder, pid=None):
+    """
+    Get the path to the file advertising the channel of a publish process.
+
+    :param job_folder: Path to the job folder
+    :param pid: ID of the publish process. If None, the current process is used.
+    :return: Path to the channel file
+    """
+    return os.path.join(
+        job_folder,
+        "{}{}{}".format(
+            CHANNEL_FILE_PREFIX,
+            os.getpid() if pid is None else pid,
+            CHANNEL_FILE_EXTENSION,
+        ),
+    )
+
+
+def get_channels(job_folder):
+    """
+    Get the channels advertised in a job folder.
+
+    :param job_folder: Path to the job folder
+    :return: The list of the (port, token) pairs of the channels the publish processes of the job are listening on
+    """
+
+    channels = []
+    try:
+        file_names = os.listdir(job_folder)
+    except OSError:
+        return channels
+
+    for file_name in file_names:
+        if not file_name.startswith(CHANNEL_FILE_PREFIX) or not file_name.endswith(
+            CHANNEL_FILE_EXTENSION
+        ):
+            continue
+        try:
+            with open(os.path.join(job_folder, file_name), "r") as fp:
+                port, token = fp.read().split()
+            channels.append((int(port), token))
+        except (OSError, ValueError):
+            # the channel file is being written or removed
+            continue
+
+    return channels
+
+
+class ProgressChannel(object):
+    """
+    Channel of a publish process, sending its status changes to the connected monitors.
+
+    The lines are sent from a background thread so the publish process is never slowed down by a monitor.
+    """
+
+    def __init__(self, job_folder):
+        """
+        Class constructor
+
+        :param job_folder: Path to the job folder where the channel is advertised
+        """
+
+        self._channel_file_path = get_channel_file_path(job_folder)
+
+        self.__lock = threading.Lock()
+        self.__clients = []
+        self.__lines = queue.Queue()
+        self.__closed = False
+        self.__token = secrets.token_hex(TOKEN_SIZE)
+
+        # only accept connections from the local machine
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.bind(("127.0.0.1", 0))
+        self.__server.listen(5)
+
+        # advertise the channel atomically so a monitor never reads a partial port. The file is only readable by the
+        # current user, which keeps the token private
+        with monitor_io.atomic_write(self._channel_file_path) as fp:
+            fp.write("{} {}".format(self.__server.getsockname()[1], self.__token))
+
+        self.__threads = []
+        for target in (self.__accept_clients, self.__send_lines):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def send(self, line):
+        """
+        Send a line to all the connected monitors.
+
+        :param line: The line to send, including its trailing new line
+        """
+        self.__lines.put(line.encode("utf-8"))
+
+    def close(self):
+        """
+        Stop advertising the channel and disconnect the monitors once the pending lines have been sent.
+        """
+
+        try:
+            os.remove(self._channel_file_path)
+        except OSError:
+            pass
+
+        # the monitors accepted from now on are disconnected right away, the other ones once the pending lines are sent
+        with self.__lock:
+            self.__closed = True
+        self.__lines.put(None)
+
+        # closing the socket doesn't wake up a thread blocked in accept() on Linux: shut it down first so the process
+        # doesn't keep a thread per job in warm worker or batch mode
+        try:
+            self.__server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.__server.close()
+        except OSError:
+            pass
+
+        for thread in self.__threads:
+            thread.join(SEND_TIMEOUT)
+
+    def __accept_clients(self):
+        """
+        Accept the connections of the monitors until the channel is closed.
+        """
+        while True:
+            try:
+                client, _ = self.__server.accept()
+            except OSError:
+                return
+            client.settimeout(SEND_TIMEOUT)
+            if not self.__authenticate(client):
+                client.close()
+                continue
+            with self.__lock:
+                if not self.__closed:
+                    self.__clients.append(client)
+                    continue
+            client.close()
+            return
+
+    def __authenticate(self, client):
+        """
+        Check that a monitor has sent the token of the channel.
+
+        :param client: The socket of the monitor
+        :return: True if the monitor has sent the right token, False otherwise
+        """
+
+        expected = "{}\n".format(self.__token).encode("ascii")
+        received = b""
+        try:
+            while len(received) < len(expected) and not received.endswith(b"\n"):
+                chunk = client.recv(len(expected) - len(received))
+                if not chunk:
+                    return False
+                received += chunk
+        except OSError:
+            return False
+        return hmac.compare_digest(received, expected)
+
+    def __send_lines(self):
+        """
+        Send the queued lines to the connected monitors until the channel is closed.
+        """
+
+        while True:
+            line = self.__lines.get()
+
+            with self.__lock:
+                clients = list(self.__clients)
+
+            if line is None:
+                for client in clients:
+                    client.close()
+                return
+
+            for client in clients:
+                try:
+                    client.sendall(line)
+                except OSError:
+                    # the monitor has been closed or is too slow: it will read the missing lines from the event log
+                    with self.__lock:
+                        self.__clients.remove(client)
+                    client.close()
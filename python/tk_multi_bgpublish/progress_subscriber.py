@@ -0,0 +1,212 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+import errno
+import socket
+
+from sgtk.platform.qt import QtCore
+
+from . import monitor_io
+
+# delay (in seconds) to connect to a progress channel, which always lives on the local machine
+CONNECT_TIMEOUT = 0.2
+
+# errors reported by a non-blocking connection which is still being established
+CONNECTING_ERRORS = (
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EAGAIN,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+)
+
+
+class ProgressSubscriber(QtCore.QObject):
+    """
+    Receive the status changes streamed by the running publish processes through their progress channel.
+
+    The sockets are watched by the Qt event loop so the changes are received from the main thread as soon as they are
+    sent, without any polling. The connections are established the same way so the main thread never waits for a
+    channel.
+    """
+
+    # emitted with the job folder, the list of events and the list of stage events as returned by
+    # :func:`monitor_io.parse_events`
+    events_received = QtCore.Signal(str, object, object)
+
+    # emitted with the job folder once a publish process has closed its channel
+    channel_closed = QtCore.Signal(str)
+
+    def __init__(self, parent=None):
+        """
+        Class constructor
+
+        :param parent: The parent QObject
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        # the open connections, indexed by (job folder, port)
+        self.__connections = {}
+
+        # the connections being established, indexed by (job folder, port)
+        self.__pending_connections = {}
+
+        # the channels which couldn't be reached: their process has died without removing its channel file
+        self.__failed_channels = set()
+
+    def subscribe(self, job_folder, channels):
+        """
+        Connect to the progress channels of a job which aren't connected yet.
+
+        :param job_folder: Path to the job folder
+        :param channels: List of the (port, token) pairs of the progress channels advertised in the job folder
+        """
+
+        for port, token in channels:
+            key = (job_folder, port)
+            if (
+                key in self.__connections
+                or key in self.__pending_connections
+                or key in self.__failed_channels
+            ):
+                continue
+
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.setblocking(False)
+            error = client.connect_ex(("127.0.0.1", port))
+            if error and error not in CONNECTING_ERRORS:
+                client.close()
+                self.__failed_channels.add(key)
+                continue
+
+            # the socket becomes writable once connected. On Windows, a failed connection is reported as an exception
+            notifiers = []
+            for notifier_type in (
+                QtCore.QSocketNotifier.Write,
+                QtCore.QSocketNotifier.Exception,
+            ):
+                notifier = QtCore.QSocketNotifier(client.fileno(), notifier_type, self)
+                notifier.activated.connect(lambda *args, k=key: self.__connected(k))
+                notifiers.append(notifier)
+            self.__pending_connections[key] = [client, notifiers, token]
+
+            QtCore.QTimer.singleShot(
+                int(CONNECT_TIMEOUT * 1000), lambda k=key: self.__connect_timeout(k)
+            )
+
+    def close(self):
+        """
+        Close all the connections.
+        """
+        for key in list(self.__pending_connections):
+            self.__abort_connection(key)
+        for key in list(self.__connections):
+            self.__disconnect(key)
+
+    def __connected(self, key):
+        """
+        Start reading from a connection once it is established, after sending the token of the channel.
+
+        :param key: The (job folder, port) key of the connection
+        """
+
+        if key not in self.__pending_connections:
+            return
+        client, notifiers, token = self.__pending_connections.pop(key)
+        for notifier in notifiers:
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+
+        try:
+            error = client.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if not error:
+                # the token is much smaller than the socket buffer: it is sent at once
+                client.sendall("{}\n".format(token).encode("ascii"))
+        except OSError:
+            error = True
+        if error:
+            client.close()
+            self.__failed_channels.add(key)
+            return
+
+        notifier = QtCore.QSocketNotifier(
+            client.fileno(), QtCore.QSocketNotifier.Read, self
+        )
+        notifier.activated.connect(lambda *args, k=key: self.__read(k))
+        self.__connections[key] = [client, notifier, b""]
+
+    def __connect_timeout(self, key):
+        """
+        Give up on a connection which couldn't be established in time.
+
+        :param key: The (job folder, port) key of the connection
+        """
+        if key in self.__pending_connections:
+            self.__abort_connection(key)
+            self.__failed_channels.add(key)
+
+    def __abort_connection(self, key):
+        """
+        Close a connection being established.
+
+        :param key: The (job folder, port) key of the connection
+        """
+        client, notifiers, _ = self.__pending_connections.pop(key)
+        for notifier in notifiers:
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        client.close()
+
+    def __read(self, key):
+        """
+        Read the lines sent through a connection.
+
+        :param key: The (job folder, port) key of the connection
+        """
+
+        connection = self.__connections.get(key)
+        if connection is None:
+            return
+        client, _, pending = connection
+
+        closed = False
+        while True:
+            try:
+                chunk = client.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                closed = True
+                break
+            if not chunk:
+                closed = True
+                break
+            pending += chunk
+
+        # only parse complete lines, the remaining bytes being part of the next read
+        end = pending.rfind(b"\n") + 1
+        connection[2] = pending[end:]
+        stage_events = []
+        events = monitor_io.parse_events(
+            pending[:end].decode("utf-8"), stage_events=stage_events
+        )
+        if events or stage_events:
+            self.events_received.emit(key[0], events, stage_events)
+
+        if closed:
+            self.__disconnect(key)
+            self.channel_closed.emit(key[0])
+
+    def __disconnect(self, key):
+        """
+        Close a connection.
+
+        :param key: The (job folder, port) key of the connection
+        """
+        client, notifier, _ = self.__connections.pop(key)
+        notifier.setEnabled(False)
+        notifier.deleteLater()
+        client.close()
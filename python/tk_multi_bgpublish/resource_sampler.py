@@ -0,0 +1,340 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Sampling of the resources used by a background publish process.
+#
+# A sample of the memory (RSS), the CPU time and the bytes read and written by the process is taken each time the task
+# being processed changes, attributing what has been used since the previous sample to the task which has just ended.
+# A sampler thread also samples the tasks running longer than the sampling interval. The figures are saved in the
+# job folder once the job is done, in "resources.yml" or in "resources_shard<index>.yml" for the other shards of a job.
+#
+# psutil is used when it is available. Otherwise, the figures are read from os.times() and, on Linux, from the /proc
+# file system. The figures which can't be read on the current platform are left to None.
+
+import os
+import sys
+import threading
+import time
+
+from tank_vendor import yaml
+
+from . import monitor_io
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESOURCES_FILE_PREFIX = "resources"
+RESOURCES_FILE_EXTENSION = ".yml"
+
+
+def read_usage():
+    """
+    Read the resources used by the current process so far.
+
+    :return: A dictionary with the "rss" (in bytes), "cpu_time" (in seconds), "read_bytes" and "write_bytes" keys. The
+        values which can't be read are None.
+    """
+
+    usage = {"rss": None, "cpu_time": None, "read_bytes": None, "write_bytes": None}
+
+    if psutil:
+        process = psutil.Process()
+        usage["rss"] = process.memory_info().rss
+        cpu_times = process.cpu_times()
+        usage["cpu_time"] = cpu_times.user + cpu_times.system
+        # the I/O counters are not available on macOS
+        if hasattr(process, "io_counters"):
+            io_counters = process.io_counters()
+            usage["read_bytes"] = io_counters.read_bytes
+            usage["write_bytes"] = io_counters.write_bytes
+        return usage
+
+    times = os.times()
+    usage["cpu_time"] = times.user + times.system
+
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            usage["rss"] = int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # only the peak memory is known: good enough to compute the peak of the job
+        if resource:
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes while macOS reports bytes
+            usage["rss"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    try:
+        with open("/proc/self/io", "r") as fp:
+            for line in fp:
+                key, _, value = line.partition(":")
+                if key in ["read_bytes", "write_bytes"]:
+                    usage[key] = int(value)
+    except (OSError, ValueError):
+        pass
+
+    return usage
+
+
+def get_resources_file_path(job_folder, shard=0):
+    """
+    Get the path to the file where a publish process saves the resources it has used.
+
+    :param job_folder: Path to the job folder
+    :param shard: Index of the shard run by the process
+    :return: Path to the resources file
+    """
+    name = RESOURCES_FILE_PREFIX
+    if shard:
+        name += "_shard{}".format(shard)
+    return os.path.join(job_folder, name + RESOURCES_FILE_EXTENSION)
+
+
+def load_job_resources(job_folder):
+    """
+    Load the resources used by all the publish processes of a job.
+
+    :param job_folder: Path to the job folder
+    :return: A dictionary with the "job" key, holding the figures of the whole job, and the "tasks" key, holding the
+        figures of each task indexed by task UUID. None if no resources have been saved yet.
+    """
+
+    try:
+        file_names = sorted(os.listdir(job_folder))
+    except OSError:
+        return None
+
+    job_resources = None
+    for file_name in file_names:
+        if not file_name.startswith(RESOURCES_FILE_PREFIX) or not file_name.endswith(
+            RESOURCES_FILE_EXTENSION
+        ):
+            continue
+        try:
+            with open(os.path.join(job_folder, file_name), "r") as fp:
+                resources = yaml.load(fp, Loader=yaml.FullLoader) or {}
+        except Exception:
+            continue
+        # an empty file doesn't hold any figures
+        if not resources:
+            continue
+        if job_resources is None:
+            job_resources = resources
+            continue
+        job_resources["job"] = merge_figures(job_resources["job"], resources["job"])
+        job_resources["tasks"].update(resources["tasks"])
+
+    return job_resources
+
+
+def merge_figures(figures, other_figures):
+    """
+    Merge the figures of two processes run at the same time. Their figures add up, the sum of their memory peaks being
+    an upper bound of the peak of the job.
+
+    :param figures: A figures dictionary as saved by :class:`ResourceSampler`
+    :param other_figures: Another figures dictionary
+    :return: The merged figures dictionary
+    """
+
+    merged = {}
+    for key in ["cpu_time", "read_bytes", "write_bytes", "rss_peak", "rss_avg"]:
+        values = [f[key] for f in (figures, other_figures) if f.get(key) is not None]
+        merged[key] = sum(values) if values else None
+    merged["samples"] = figures.get("samples", 0) + other_figures.get("samples", 0)
+    return merged
+
+
+class ResourceSampler(object):
+    """
+    Sample the resources used by the process, attributing them to the task being processed.
+
+    The samples are taken when the task being processed changes, which must be reported through :meth:`task_changed`,
+    and by a background thread when no sample has been taken for the sampling interval.
+
+    The tasks run in parallel don't report themselves as the task being processed: what they use is attributed to the
+    task being processed at the same time, if any, and always to the whole job.
+    """
+
+    def __init__(self, interval=1.0):
+        """
+        Class constructor
+
+        :param interval: Maximum delay (in seconds) between two samples
+        """
+
+        self._interval = interval
+
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+        self.__current_task = None
+        self.__previous_usage = None
+        self.__previous_time = None
+        self.__job_figures = self.__create_figures()
+        self.__task_figures = {}
+
+    def start(self):
+        """
+        Start sampling the resources.
+        """
+
+        self.__previous_usage = read_usage()
+        self.__previous_time = time.time()
+
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop sampling the resources.
+
+        :return: The figures of the job, as returned by :meth:`get_figures`
+        """
+
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        with self.__lock:
+            self.__sample(self.__current_task)
+
+        return self.get_figures()
+
+    def get_figures(self):
+        """
+        Get the resources used so far.
+
+        :return: A dictionary with the "job" key, holding the figures of the whole job, and the "tasks" key, holding
+            the figures of each task indexed by task UUID. Each figures dictionary has the "samples", "rss_peak",
+            "rss_avg" (in bytes), "cpu_time" (in seconds), "read_bytes" and "write_bytes" keys.
+        """
+        with self.__lock:
+            return {
+                "job": self.__summarize(self.__job_figures),
+                "tasks": {
+                    task_uuid: self.__summarize(figures)
+                    for task_uuid, figures in self.__task_figures.items()
+                },
+            }
+
+    def save(self, file_path):
+        """
+        Atomically save the resources used so far.
+
+        :param file_path: Path to the resources file
+        """
+
+        with monitor_io.atomic_write(file_path) as fp:
+            yaml.safe_dump(self.get_figures(), fp)
+
+    def task_changed(self, previous_task_uuid, task_uuid):
+        """
+        Attribute the resources used since the previous sample to the task which has just ended, then to the new task
+        being processed.
+
+        :param previous_task_uuid: UUID of the task which was being processed, if any
+        :param task_uuid: UUID of the task being processed from now on, if any
+        """
+
+        with self.__lock:
+            if self.__previous_usage is not None:
+                try:
+                    self.__sample(previous_task_uuid)
+                except Exception:
+                    # a failed sample must never fail the task, the resources are attributed by the next sample
+                    pass
+            self.__current_task = task_uuid
+
+    def __run(self):
+        """
+        Sample the resources of the long tasks until the sampler is stopped.
+        """
+
+        delay = self._interval
+        while not self.__stop_event.wait(delay):
+            with self.__lock:
+                # a sample has been taken in the meantime by a task change
+                elapsed = time.time() - self.__previous_time
+                if elapsed < self._interval:
+                    delay = self._interval - elapsed
+                    continue
+                self.__sample(self.__current_task)
+            delay = self._interval
+
+    def __sample(self, task_uuid):
+        """
+        Read the resources used since the previous sample and attribute them to a task. The lock must be held so the
+        samples are applied in the order they have been read.
+
+        :param task_uuid: UUID of the task to attribute the resources to, or None to only attribute them to the job
+        """
+
+        usage = read_usage()
+
+        buckets = [self.__job_figures]
+        if task_uuid:
+            buckets.append(
+                self.__task_figures.setdefault(task_uuid, self.__create_figures())
+            )
+
+        for figures in buckets:
+            figures["samples"] += 1
+            if usage["rss"] is not None:
+                figures["rss_total"] += usage["rss"]
+                figures["rss_peak"] = max(figures["rss_peak"], usage["rss"])
+            for key in ["cpu_time", "read_bytes", "write_bytes"]:
+                if usage[key] is None or self.__previous_usage[key] is None:
+                    figures[key] = None
+                elif figures[key] is not None:
+                    figures[key] += usage[key] - self.__previous_usage[key]
+
+        self.__previous_usage = usage
+        self.__previous_time = time.time()
+
+    @staticmethod
+    def __create_figures():
+        """
+        Create the accumulators of the resources used by a job or a task.
+
+        :return: A dictionary of accumulators
+        """
+        return {
+            "samples": 0,
+            "rss_total": 0,
+            "rss_peak": 0,
+            "cpu_time": 0.0,
+            "read_bytes": 0,
+            "write_bytes": 0,
+        }
+
+    @staticmethod
+    def __summarize(figures):
+        """
+        Build the figures to save from the accumulators.
+
+        :param figures: The accumulators of a job or a task
+        :return: The figures dictionary
+        """
+        samples = figures["samples"]
+        return {
+            "samples": samples,
+            "rss_peak": figures["rss_peak"] or None,
+            "rss_avg": int(figures["rss_total"] / samples)
+            if samples and figures["rss_total"]
+            else None,
+            "cpu_time": figures["cpu_time"],
+            "read_bytes": figures["read_bytes"],
+            "write_bytes": figures["write_bytes"],
+        }
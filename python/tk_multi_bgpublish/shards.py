@@ -0,0 +1,258 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Helpers to split the publish step of a job across several processes (shards).
+#
+# Each top-level item of the publish tree is assigned to a shard along with all its descendants, so an item is always
+# published by the same process as its parent. The launcher writes the publish tree file once before starting the
+# shards, which only read it. Every shard opens the session and publishes its own items, then saves its publish tree to
+# its own "publish_tree_shard_<index>.yml" file and reports its status in a "shard_<index>.status" file of the job
+# folder. Shard 0 owns the job: it waits for the other shards, merges their publish trees into the job publish tree so
+# the finalize step sees the properties set during the publish step, including the ones set on the shared root item,
+# and runs the finalize step alone. The tasks of a shard which has died without reporting its status are flagged as
+# failed by shard 0.
+
+import json
+import os
+import threading
+import time
+
+from . import monitor_io
+
+SHARD_STATUS_FILE_NAME = "shard_{}.status"
+SHARD_TREE_FILE_NAME = "publish_tree_shard_{}.yml"
+
+(SHARD_RUNNING, SHARD_FINISHED, SHARD_FAILED) = ("running", "finished", "failed")
+
+# delay (in seconds) between two touches of the status file of a running shard
+HEARTBEAT_INTERVAL = 1.0
+
+# delay (in seconds) after which a running shard which hasn't touched its status file is considered as dead
+STALE_SHARD_TIMEOUT = 30.0
+
+# delay (in seconds) after which a shard which hasn't reported any status is considered as dead, bootstrapping the
+# engine and opening the session taking a while
+STARTUP_TIMEOUT = 600.0
+
+
+def get_item_shards(tree, shard_count):
+    """
+    Assign the items of a publish tree to the shards. Each top-level item is assigned with its descendants to the
+    shard with the fewest tasks so far, which gives the same result in all the shard processes.
+
+    :param tree: The publish tree
+    :param shard_count: Number of shards
+    :return: A dictionary of the shard index of each item, indexed by item id
+    """
+
+    item_shards = {}
+    shard_loads = [0] * shard_count
+
+    for top_level_item in tree.root_item.children:
+        subtree = [top_level_item]
+        for item in subtree:
+            subtree.extend(item.children)
+
+        shard = shard_loads.index(min(shard_loads))
+        for item in subtree:
+            item_shards[id(item)] = shard
+            shard_loads[shard] += len([t for t in item.tasks if t.active])
+
+    return item_shards
+
+
+def get_shard_tree_path(job_folder, shard):
+    """
+    Get the path to the publish tree saved by a shard once its items have been published.
+
+    :param job_folder: Path to the job folder
+    :param shard: Index of the shard
+    :return: Path to the shard publish tree
+    """
+    return os.path.join(job_folder, SHARD_TREE_FILE_NAME.format(shard))
+
+
+def prepare_publish_tree(publish_tree):
+    """
+    Flag the publish tree of a job as being processed in background before the shards are started, as they only read
+    the publish tree file.
+
+    :param publish_tree: Path to the job publish tree, atomically replaced
+    """
+
+    with open(publish_tree, "r") as fp:
+        tree = json.load(fp)
+
+    tree["root_item"]["global_properties"]["in_bg_process"] = True
+
+    with monitor_io.atomic_write(publish_tree) as fp:
+        json.dump(tree, fp)
+
+
+def merge_shard_trees(publish_tree, job_folder, shard_count):
+    """
+    Merge the publish trees saved by the shards into a single publish tree. Each top-level item is taken, with its
+    descendants, from the tree of the shard which has published it.
+
+    :param publish_tree: Path to the job publish tree, atomically replaced by the merged tree
+    :param job_folder: Path to the job folder
+    :param shard_count: Number of shards
+    """
+
+    with open(publish_tree, "r") as fp:
+        root_item = json.load(fp)["root_item"]
+
+    shard_trees = []
+    for shard in range(shard_count):
+        with open(get_shard_tree_path(job_folder, shard), "r") as fp:
+            shard_trees.append(json.load(fp))
+
+    # the top-level items carry the shard they have been published by
+    merged_tree = shard_trees[0]
+    children = merged_tree["root_item"]["children"]
+    for i, child in enumerate(children):
+        shard = child["global_properties"].get("bg_publish_shard", 0)
+        if shard:
+            children[i] = shard_trees[shard]["root_item"]["children"][i]
+
+    # the root item is shared by all the shards: keep the properties each shard has set during the publish step
+    for shard_tree in shard_trees[1:]:
+        _merge_properties(
+            merged_tree["root_item"]["global_properties"],
+            root_item["global_properties"],
+            shard_tree["root_item"]["global_properties"],
+        )
+        local_properties = shard_tree["root_item"].get("local_properties", {})
+        for plugin, properties in local_properties.items():
+            _merge_properties(
+                merged_tree["root_item"]
+                .setdefault("local_properties", {})
+                .setdefault(plugin, {}),
+                root_item.get("local_properties", {}).get(plugin, {}),
+                properties,
+            )
+
+    with monitor_io.atomic_write(publish_tree) as fp:
+        json.dump(merged_tree, fp)
+
+
+def _merge_properties(merged_properties, properties, shard_properties):
+    """
+    Copy the properties a shard has set or changed into the merged properties.
+
+    :param merged_properties: Dictionary of the merged properties, updated in place
+    :param properties: Dictionary of the properties before the shards were started
+    :param shard_properties: Dictionary of the properties of the shard once it is done
+    """
+    for name, value in shard_properties.items():
+        if name not in properties or properties[name] != value:
+            merged_properties[name] = value
+
+
+class ShardStatus(object):
+    """
+    Status file of a shard, touched regularly while the shard is running.
+    """
+
+    def __init__(self, job_folder, shard):
+        """
+        Class constructor
+
+        :param job_folder: Path to the job folder
+        :param shard: Index of the shard
+        """
+        self._status_file_path = os.path.join(
+            job_folder, SHARD_STATUS_FILE_NAME.format(shard)
+        )
+        self.__stop_event = threading.Event()
+
+    def start(self):
+        """
+        Flag the shard as running.
+        """
+
+        self.__write(SHARD_RUNNING)
+
+        heartbeat_thread = threading.Thread(target=self.__heartbeat)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+    def finish(self, succeeded):
+        """
+        Flag the shard as done.
+
+        :param succeeded: True if all the items of the shard have been published, False otherwise
+        """
+        self.__stop_event.set()
+        self.__write(SHARD_FINISHED if succeeded else SHARD_FAILED)
+
+    def __write(self, status):
+        """
+        Atomically write the shard status.
+
+        :param status: The shard status
+        """
+        with monitor_io.atomic_write(self._status_file_path) as fp:
+            fp.write(status)
+
+    def __heartbeat(self):
+        """
+        Touch the status file regularly to let shard 0 know the shard is still alive, even during a long publish.
+        """
+        while not self.__stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(self._status_file_path, None)
+            except OSError:
+                pass
+
+
+def wait_for_shards(job_folder, shard_count, poll_interval=0.5, on_shard_died=None):
+    """
+    Wait for all the shards other than shard 0 to be done.
+
+    :param job_folder: Path to the job folder
+    :param shard_count: Number of shards
+    :param poll_interval: Delay (in seconds) between two checks of the shard statuses
+    :param on_shard_died: Callable called with the index of each shard whose process has died without reporting its
+        status, to fail the tasks it hasn't finished
+    :return: True if all the shards have succeeded, False otherwise
+    """
+
+    pending_shards = set(range(1, shard_count))
+    succeeded = True
+    start_time = time.time()
+
+    while pending_shards:
+        for shard in list(pending_shards):
+            status_file_path = os.path.join(
+                job_folder, SHARD_STATUS_FILE_NAME.format(shard)
+            )
+            try:
+                with open(status_file_path, "r") as fp:
+                    status = fp.read().strip()
+                timeout = STALE_SHARD_TIMEOUT
+                last_touch = os.path.getmtime(status_file_path)
+            except OSError:
+                # the shard process may not have started yet
+                status = None
+                timeout = STARTUP_TIMEOUT
+                last_touch = start_time
+
+            if status in [SHARD_FINISHED, SHARD_FAILED]:
+                pending_shards.discard(shard)
+                succeeded = succeeded and status == SHARD_FINISHED
+            elif time.time() - last_touch > timeout:
+                # the shard process has died without reporting its status
+                pending_shards.discard(shard)
+                succeeded = False
+                if on_shard_died:
+                    on_shard_died(shard)
+
+        if pending_shards:
+            time.sleep(poll_interval)
+
+    return succeeded
@@ -0,0 +1,285 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+# Helpers to exchange the publish jobs with a warm worker, a long-lived background publish process which runs the jobs
+# one after another without bootstrapping the engine again.
+#
+# There is one spool folder per engine and pipeline configuration. Each job request is written to the spool folder as a
+# "<sort key>.job" YAML file, the sort key ordering the requests by priority then by submission time. The worker claims
+# a request by renaming it, so a request is never processed twice.
+#
+# The worker holds a "worker.lock" file while it is running and touches it regularly: a lock which hasn't been touched
+# for a while has been left behind by a dead worker. Before exiting, an idle worker flags itself as exiting, releases
+# the lock and checks the spool folder one last time so a request written in the meantime is never left behind. The
+# exiting flag lets a launcher know that a worker process which is still alive but doesn't hold the lock won't serve
+# the requests anymore, as opposed to a worker which is still bootstrapping.
+
+import os
+import threading
+import time
+import uuid
+
+from tank_vendor import yaml
+
+from . import monitor_io
+
+WORKER_LOCK_FILE_NAME = "worker.lock"
+WORKER_EXITING_FILE_NAME = "worker.exiting"
+REQUEST_EXTENSION = ".job"
+
+# delay (in seconds) between two touches of the worker lock
+HEARTBEAT_INTERVAL = 1.0
+
+# delay (in seconds) after which a lock which hasn't been touched is considered as left behind by a dead worker
+STALE_LOCK_TIMEOUT = 10.0
+
+
+def get_spool_folder(cache_location, engine_name, pipeline_config_id):
+    """
+    Get the spool folder of the warm worker of an engine and a pipeline configuration.
+
+    :param cache_location: Path to the app cache location
+    :param engine_name: Name of the engine run by the worker
+    :param pipeline_config_id: ID of the pipeline configuration used to bootstrap the worker
+    :return: Path to the spool folder
+    """
+    return os.path.join(
+        cache_location, "workers", "{}_{}".format(engine_name, pipeline_config_id)
+    )
+
+
+def submit_request(spool_folder, request, priority=0):
+    """
+    Write a job request to the spool folder.
+
+    :param spool_folder: Path to the spool folder
+    :param request: Dictionary describing the job to run
+    :param priority: Priority of the job. Jobs with a higher priority are run first.
+    :return: Path to the request file
+    """
+
+    if not os.path.exists(spool_folder):
+        os.makedirs(spool_folder)
+
+    sort_key = "{:06d}_{:.6f}_{}".format(
+        max(0, 500000 - priority), time.time(), uuid.uuid4().hex
+    )
+
+    # write the request atomically so the worker never reads a partial request
+    request_file_path = os.path.join(spool_folder, sort_key + REQUEST_EXTENSION)
+    with monitor_io.atomic_write(request_file_path) as fp:
+        yaml.safe_dump(request, fp)
+
+    return request_file_path
+
+
+def withdraw_request(request_file_path):
+    """
+    Remove a job request from the spool folder, unless a worker has already claimed it.
+
+    :param request_file_path: Path to the request file, as returned by :func:`submit_request`
+    :return: True if the request has been removed, False if a worker has claimed it
+    """
+
+    # the request is claimed like a worker does, so it can't be claimed by a worker at the same time
+    claimed_file_path = request_file_path + ".{}".format(os.getpid())
+    try:
+        os.rename(request_file_path, claimed_file_path)
+    except OSError:
+        return False
+    os.remove(claimed_file_path)
+    return True
+
+
+def claim_next_request(spool_folder):
+    """
+    Claim the next job request of the spool folder.
+
+    :param spool_folder: Path to the spool folder
+    :return: The request dictionary or None if there is no request to process
+    """
+
+    if not os.path.exists(spool_folder):
+        return None
+
+    for file_name in sorted(os.listdir(spool_folder)):
+        if not file_name.endswith(REQUEST_EXTENSION):
+            continue
+        request_file_path = os.path.join(spool_folder, file_name)
+        claimed_file_path = request_file_path + ".{}".format(os.getpid())
+        try:
+            os.rename(request_file_path, claimed_file_path)
+        except OSError:
+            # the request has been claimed by another worker
+            continue
+        try:
+            with open(claimed_file_path, "r") as fp:
+                return yaml.load(fp, Loader=yaml.FullLoader)
+        finally:
+            os.remove(claimed_file_path)
+
+    return None
+
+
+def has_pending_requests(spool_folder):
+    """
+    Check if some job requests are waiting in the spool folder.
+
+    :param spool_folder: Path to the spool folder
+    :return: True if some requests are waiting, False otherwise
+    """
+    if not os.path.exists(spool_folder):
+        return False
+    return any(f.endswith(REQUEST_EXTENSION) for f in os.listdir(spool_folder))
+
+
+def is_worker_alive(spool_folder):
+    """
+    Check if a worker is currently serving the spool folder.
+
+    :param spool_folder: Path to the spool folder
+    :return: True if a worker holds the lock of the spool folder, False otherwise
+    """
+    try:
+        lock_age = time.time() - os.path.getmtime(
+            os.path.join(spool_folder, WORKER_LOCK_FILE_NAME)
+        )
+    except OSError:
+        return False
+    return lock_age < STALE_LOCK_TIMEOUT
+
+
+def is_worker_exiting(spool_folder):
+    """
+    Check if the last worker serving the spool folder has stopped serving the requests.
+
+    :param spool_folder: Path to the spool folder
+    :return: True if the worker has flagged itself as exiting, False otherwise
+    """
+    return os.path.exists(os.path.join(spool_folder, WORKER_EXITING_FILE_NAME))
+
+
+class WorkerLock(object):
+    """
+    Lock held by the worker serving a spool folder, kept alive by a heartbeat thread.
+    """
+
+    def __init__(self, spool_folder):
+        """
+        Class constructor
+
+        :param spool_folder: Path to the spool folder
+        """
+        self._lock_file_path = os.path.join(spool_folder, WORKER_LOCK_FILE_NAME)
+        self.__stop_event = None
+
+    def acquire(self):
+        """
+        Try to acquire the lock.
+
+        :return: True if the lock has been acquired, False if another worker holds it
+        """
+
+        if not os.path.exists(os.path.dirname(self._lock_file_path)):
+            os.makedirs(os.path.dirname(self._lock_file_path))
+
+        if os.path.exists(self._lock_file_path) and not is_worker_alive(
+            os.path.dirname(self._lock_file_path)
+        ):
+            try:
+                os.remove(self._lock_file_path)
+            except OSError:
+                pass
+
+        try:
+            fd = os.open(self._lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(fd, str(os.getpid()).encode("utf-8"))
+        os.close(fd)
+
+        # the requests are served again
+        exiting_file_path = os.path.join(
+            os.path.dirname(self._lock_file_path), WORKER_EXITING_FILE_NAME
+        )
+        if os.path.exists(exiting_file_path):
+            os.remove(exiting_file_path)
+
+        self.__stop_event = threading.Event()
+        heartbeat_thread = threading.Thread(
+            target=self.__heartbeat, args=(self.__stop_event,)
+        )
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+        return True
+
+    def release(self):
+        """
+        Release the lock.
+        """
+
+        if self.__stop_event is None:
+            return
+        self.__stop_event.set()
+        self.__stop_event = None
+
+        try:
+            os.remove(self._lock_file_path)
+        except OSError:
+            pass
+
+    def __heartbeat(self, stop_event):
+        """
+        Touch the lock file regularly to let the launchers know the worker is still alive, even during a long publish.
+
+        :param stop_event: Event set once the lock has been released
+        """
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(self._lock_file_path, None)
+            except OSError:
+                pass
+
+
+def serve(spool_folder, run_job, idle_timeout, poll_interval=0.5):
+    """
+    Run the job requests of the spool folder one after another until no request has been received for a while.
+
+    :param spool_folder: Path to the spool folder
+    :param run_job: Callable running the job described by the request dictionary given as argument
+    :param idle_timeout: Delay (in seconds) without any request after which the worker exits
+    :param poll_interval: Delay (in seconds) between two checks of the spool folder
+    """
+
+    lock = WorkerLock(spool_folder)
+    if not lock.acquire():
+        return
+
+    try:
+        last_job_time = time.time()
+        while True:
+            request = claim_next_request(spool_folder)
+            if request is not None:
+                run_job(request)
+                last_job_time = time.time()
+                continue
+
+            if time.time() - last_job_time < idle_timeout:
+                time.sleep(poll_interval)
+                continue
+
+            # release the lock before the last check: a launcher writing a request after this check will see there
+            # is no worker anymore and start a new one
+            with open(os.path.join(spool_folder, WORKER_EXITING_FILE_NAME), "w"):
+                pass
+            lock.release()
+            if not has_pending_requests(spool_folder) or not lock.acquire():
+                return
+            last_job_time = time.time()
+    finally:
+        lock.release()
@@ -6,16 +6,23 @@
 # Source Code License included in this distribution package. See LICENSE.
 
 import ast
+import concurrent.futures
+import contextlib
+import cProfile
+import io
 import logging
 import os
+import pstats
 import sys
+import time
 
 import sgtk
-from tank_vendor import yaml
+
+logger = sgtk.LogManager.get_logger(__name__)
 
 
 def change_progress_status(
-    monitor_file_path,
+    monitor_state,
     item_uuid,
     process_status,
     task_uuid=None,
@@ -23,9 +30,9 @@ def change_progress_status(
     finish_status=None,
 ):
     """
-    Update the monitor file once a task/item has been processed.
+    Update the monitor data once a task/item has been processed.
 
-    :param monitor_file_path: Path to the monitor file
+    :param monitor_state: The MonitorState instance holding the monitor data
     :param item_uuid: UUID of the item to update
     :param process_status: Value of the status to update the task to
     :param task_uuid: UUID of the task to update
@@ -33,181 +40,402 @@ def change_progress_status(
     :param finish_status: Value of the status to update the previous task with
     """
 
-    # open the monitor file to get the monitor data
-    with open(monitor_file_path, "r") as fp:
-        monitor_data = yaml.load(fp, Loader=yaml.FullLoader)
-
-    for item in monitor_data["items"]:
-        # change the status of the item if it has not been done yet
-        if item["uuid"] == item_uuid and item["status"] != process_status:
-            item["status"] = process_status
-        # if a task UUID is provided, try to find the corresponding task to change its status
-        if task_uuid:
-            for task in item["tasks"]:
-                # find that task, update its status
-                if task["uuid"] == task_uuid:
-                    task["status"] = process_status
-                # if a UUID has been provided for the previous task, find the task and update its status
-                elif (
-                    previous_task_uuid
-                    and task["uuid"] == previous_task_uuid
-                    and finish_status
-                ):
-                    task["status"] = finish_status
-                else:
-                    continue
+    # only the previous task status is changed, not the status of the item it belongs to
+    if previous_task_uuid and finish_status is not None:
+        monitor_state.set_status(None, finish_status, task_uuid=previous_task_uuid)
 
-    # finally, save the data into the monitor file
-    with open(monitor_file_path, "w") as fp:
-        yaml.safe_dump(monitor_data, fp)
+    monitor_state.set_status(item_uuid, process_status, task_uuid=task_uuid)
 
 
-def change_failed_task_status(monitor_file_path, progress_status, failed_status):
+def change_failed_task_status(monitor_state, failed_status):
     """
-    One a task has failed during one of the publishing step, try to find which one and update its status.
+    One a task has failed during one of the publishing step, update the status of the task being processed.
 
-    :param monitor_file_path: Path to the monitor file
-    :param progress_status: Value of the progress status
+    :param monitor_state: The MonitorState instance holding the monitor data
     :param failed_status: Value of the failed status
     """
 
-    # open the monitor file to get the data
-    with open(monitor_file_path, "r") as fp:
-        monitor_data = yaml.load(fp, Loader=yaml.FullLoader)
+    if monitor_state.in_flight_task:
+        item_uuid, task_uuid = monitor_state.in_flight_task
+        monitor_state.set_status(item_uuid, failed_status, task_uuid=task_uuid)
 
-    # go through each item/tasks to find which one is the first with the progress status: it will be the failing task
-    for item in monitor_data["items"]:
-        for task in item["tasks"]:
-            if task["status"] != progress_status:
-                continue
-            task["status"] = failed_status
-            item["status"] = failed_status
-            break
+    # finally, save the failure into the monitor file
+    monitor_state.flush()
+
+
+class ThreadedTaskRunner(object):
+    """
+    Run the thread-safe tasks of a publish step on a bounded thread pool, each task reporting its own status.
+
+    The consecutive thread-safe tasks of an item are run one after another by the same pool thread so the order of the
+    tasks within an item is kept, the tasks of different items being run in parallel.
+    """
+
+    def __init__(
+        self,
+        monitor_state,
+        max_threads,
+        run_task,
+        process_status,
+        finished_status,
+        failed_status,
+    ):
+        """
+        Class constructor
+
+        :param monitor_state: The MonitorState instance holding the monitor data
+        :param max_threads: Maximum number of tasks run at the same time
+        :param run_task: Callable running the publish step of the task given as argument
+        :param process_status: Value of the status to update the task to once it starts
+        :param finished_status: Value of the status to update the task to once it is done
+        :param failed_status: Value of the status to update the task to if it fails
+        """
+
+        self._monitor_state = monitor_state
+        self._run_task = run_task
+        self._process_status = process_status
+        self._finished_status = finished_status
+        self._failed_status = failed_status
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads)
+        self.__futures = []
+        # the futures of each item, by item id
+        self.__item_futures = {}
+
+    @staticmethod
+    def is_thread_safe(task):
+        """
+        Check if a task can be run in parallel of the other tasks. Publish plugins flag their tasks with a
+        "Thread Safe" setting, which can also be set per task in the publish tree.
+
+        :param task: The publish task
+        :return: True if the task is thread-safe, False otherwise
+        """
+        setting = task.settings.get("Thread Safe")
+        return bool(setting and setting.value)
+
+    def submit(self, item, tasks, item_status=None):
+        """
+        Run some tasks of an item on the thread pool, one after another.
+
+        The caller must make sure the previous tasks of the item and the tasks of its parent are done.
+
+        :param item: The publish item the tasks belong to
+        :param tasks: List of the publish tasks to run
+        :param item_status: Value of the status to update the item to once all the tasks are done, if any
+        """
+        future = self.__executor.submit(self.__run, item, tasks, item_status)
+        self.__futures.append(future)
+        self.__item_futures.setdefault(id(item), []).append(future)
+
+    def has_pending_tasks(self, item):
+        """
+        Check if some tasks of an item have been submitted to the thread pool.
+
+        :param item: The publish item
+        :return: True if the item has some tasks run by the thread pool, False otherwise
+        """
+        return id(item) in self.__item_futures
+
+    def wait_for_item(self, item):
+        """
+        Wait for the tasks of an item run by the thread pool to be done.
+
+        :param item: The publish item, if None nothing is waited for
+        :raises RuntimeError: If some tasks of the item have failed
+        """
+
+        if item is None:
+            return
+
+        failures = [
+            f.result() for f in self.__item_futures.pop(id(item), []) if f.result()
+        ]
+        if failures:
+            raise RuntimeError(
+                "{} task(s) failed: {}".format(len(failures), ", ".join(failures))
+            )
+
+    def wait(self):
+        """
+        Wait for all the submitted tasks to be done.
+
+        :raises RuntimeError: If some tasks have failed
+        """
+
+        self.__executor.shutdown(wait=True)
+        self.__item_futures.clear()
+
+        failures = [f.result() for f in self.__futures if f.result()]
+        if failures:
+            raise RuntimeError(
+                "{} task(s) failed: {}".format(len(failures), ", ".join(failures))
+            )
+
+    def shutdown(self):
+        """
+        Wait for the running tasks without starting the pending ones.
+        """
+        for future in self.__futures:
+            future.cancel()
+        self.__executor.shutdown(wait=True)
+        self.__item_futures.clear()
+
+    def __run(self, item, tasks, item_status):
+        """
+        Run some tasks of an item one after another and report their status.
+
+        :param item: The publish item the tasks belong to
+        :param tasks: List of the publish tasks to run
+        :param item_status: Value of the status to update the item to once all the tasks are done, if any
+        :return: An error message if a task has failed, None otherwise
+        """
+
+        for task in tasks:
+            task_uuid = task.settings["Task UUID"].value
+            self._monitor_state.set_status(
+                item.properties.uuid,
+                self._process_status,
+                task_uuid=task_uuid,
+                track_in_flight=False,
+            )
+            try:
+                self._run_task(task)
+            except Exception as e:
+                logger.exception(
+                    "Error happening during task {}: {}".format(task.name, e)
+                )
+                # the failure is reported to the item as well, the next tasks of the item are not run
+                self._monitor_state.set_status(
+                    item.properties.uuid,
+                    self._failed_status,
+                    task_uuid=task_uuid,
+                    track_in_flight=False,
+                )
+                return "{} ({})".format(task.name, e)
 
-    # finally, save the data into the monitor file
-    with open(monitor_file_path, "w") as fp:
-        yaml.safe_dump(monitor_data, fp)
+            self._monitor_state.set_status(
+                None, self._finished_status, task_uuid=task_uuid, track_in_flight=False
+            )
 
+        if item_status is not None and item.properties.get("uuid"):
+            self._monitor_state.set_status(
+                item.properties.uuid, item_status, track_in_flight=False
+            )
+        return None
 
-def task_generator(tree, monitor_file_path, process_status, finished_status):
+
+def task_generator(
+    tree,
+    monitor_state,
+    process_status,
+    finished_status,
+    items=None,
+    task_runner=None,
+):
     """
     Custom iterator on the publish tasks. It will yield the next task and change its status as well as the status of
     the previous task.
 
+    The thread-safe tasks are run by the task runner once the previous tasks of their item and the tasks of the parent
+    item are done, and an item is only flagged as finished once all its tasks are done.
+
     :param tree: Publish Tree to go through
-    :param monitor_file_path: Path to the monitor file
+    :param monitor_state: The MonitorState instance holding the monitor data
     :param process_status: Value of the status to update the task to
     :param finished_status: Value of the status to update the previous task to
+    :param items: Set of the ids of the items to go through. If None, all the items will be processed.
+    :param task_runner: The ThreadedTaskRunner instance to use to run the thread-safe tasks. If None, all the tasks
+        are yielded to the publish manager.
     """
     previous_task = None
+
+    def wait_for_item(item):
+        """
+        Wait for the tasks of an item run in parallel, flagging the previous task as done first so it isn't reported
+        as failed if one of the parallel tasks fails.
+
+        :param item: The publish item to wait for, if None nothing is waited for
+        """
+        nonlocal previous_task
+        if not task_runner.has_pending_tasks(item):
+            return
+        if previous_task:
+            change_progress_status(
+                monitor_state,
+                None,
+                finished_status,
+                task_uuid=previous_task.settings["Task UUID"].value,
+            )
+            previous_task = None
+        task_runner.wait_for_item(item)
+
     for item in tree:
+        if items is not None and id(item) not in items:
+            continue
+        # the tasks of an item can only start once the tasks of its parent are done
+        if task_runner:
+            wait_for_item(item.parent)
+        parallel_tasks = []
         for task in item.tasks:
-            if task.active:
-                task_uuid = task.settings["Task UUID"].value
-                previous_task_uuid = (
-                    None
-                    if not previous_task
-                    else previous_task.settings["Task UUID"].value
-                )
-                # change the status of the task before returning it
-                change_progress_status(
-                    monitor_file_path,
-                    item.properties.uuid,
-                    process_status,
-                    task_uuid=task_uuid,
-                    previous_task_uuid=previous_task_uuid,
-                    finish_status=finished_status,
-                )
-                previous_task = task
-                yield task
-        # once all the tasks have been done, change the status of the item itself
-        if item.properties.get("uuid"):
+            if not task.active:
+                continue
+            if task_runner and task_runner.is_thread_safe(task):
+                parallel_tasks.append(task)
+                continue
+            # the previous thread-safe tasks of the item must be done before running the next task
+            if parallel_tasks:
+                task_runner.submit(item, parallel_tasks)
+                parallel_tasks = []
+                wait_for_item(item)
+            task_uuid = task.settings["Task UUID"].value
+            previous_task_uuid = (
+                None if not previous_task else previous_task.settings["Task UUID"].value
+            )
+            # change the status of the task before returning it
             change_progress_status(
-                monitor_file_path, item.properties.uuid, finished_status
+                monitor_state,
+                item.properties.uuid,
+                process_status,
+                task_uuid=task_uuid,
+                previous_task_uuid=previous_task_uuid,
+                finish_status=finished_status,
             )
+            previous_task = task
+            yield task
+        # once all the tasks have been done, change the status of the item itself: if the last tasks are run in
+        # parallel, the task runner does it once they are done
+        if parallel_tasks:
+            task_runner.submit(item, parallel_tasks, item_status=finished_status)
+        elif item.properties.get("uuid"):
+            change_progress_status(monitor_state, item.properties.uuid, finished_status)
 
+    # the step is only over once the tasks run in parallel are done
+    if task_runner:
+        if previous_task:
+            change_progress_status(
+                monitor_state,
+                None,
+                finished_status,
+                task_uuid=previous_task.settings["Task UUID"].value,
+            )
+        task_runner.wait()
 
-def main(
-    engine_name,
-    pipeline_config_id,
-    entity_dict,
-    publish_tree,
-    monitor_file_path,
+
+def create_task_runner(
+    bg_publish_app,
+    monitor_state,
+    run_task,
+    process_status,
+    finished_status,
+    failed_status,
 ):
     """
-    Main function of the script which launch the background publishing process.
-    It will be responsible for:
-     - initializing the environment
-     - bootstrapping the engine
-     - open the session work file
-     - use the Publish API to create a manager and run the publish/finalize steps
-    As soon as a step for a task is done, the task status will be updated in the monitor.yml file. This file will be
-    used by the monitor UI to display the publish progress.
+    Create the runner of the thread-safe tasks of a publish step, if enabled.
 
-    :param engine_name: Name of the engine to launch
-    :param pipeline_config_id: ID of the pipeline config to use when bootstrapping the engine
-    :param entity_dict: Flow Production Tracking dictionary of the entity to use when bootstrapping the engine
-    :param publish_tree: Path to the file to use to load the publish tree
-    :param monitor_file_path: Path to the file to use to monitor the publish process
+    :param bg_publish_app: The background publish app
+    :param monitor_state: The MonitorState instance holding the monitor data
+    :param run_task: Callable running the publish step of the task given as argument
+    :param process_status: Value of the status to update the tasks to once they start
+    :param finished_status: Value of the status to update the tasks to once they are done
+    :param failed_status: Value of the status to update the tasks to if they fail
+    :return: A ThreadedTaskRunner instance or None if the tasks must run one after another
     """
 
-    # initialize a log handler
-    log_path = os.path.join(os.path.dirname(monitor_file_path), "bg_publish.log")
-    log_handler = logging.FileHandler(log_path)
-    sgtk.LogManager().initialize_custom_handler(log_handler)
-
-    # bootstrap the engine
-    mgr = sgtk.bootstrap.ToolkitManager()
-    mgr.plugin_id = "basic.desktop"
-    mgr.pipeline_configuration = pipeline_config_id
-    current_engine = mgr.bootstrap_engine(engine_name, entity_dict)
-
-    publish_app = current_engine.apps.get("tk-multi-publish2")
-    bg_publish_app = current_engine.apps.get("tk-multi-bg-publish")
-
-    # initialize the environment
-    if engine_name == "tk-maya":
-        import maya.standalone
+    max_threads = bg_publish_app.get_setting("max_task_threads")
+    if not max_threads:
+        return None
 
-        maya.standalone.initialize()
-        import maya.cmds as cmds
+    return ThreadedTaskRunner(
+        monitor_state,
+        max_threads,
+        run_task,
+        process_status,
+        finished_status,
+        failed_status,
+    )
 
-        # import pymel to be sure everything has been sourced and imported
-        import pymel.core as pm
-    elif engine_name == "tk-alias":
-        alias_api = current_engine.alias_py
-    elif engine_name == "tk-vred":
-        import vrController
-        import vrFileIO
-        import vrScenegraph
 
-    # load the publish tree
-    # manager = publish_app.create_publish_manager(publish_logger=current_engine.logger)
-    manager = publish_app.create_publish_manager(publish_logger=log_handler)
-    manager.load(publish_tree)
+def get_latest_task(tree, items=None):
+    """
+    Get the latest item of the tree and its latest active task, which need to be flagged as done once a publish step
+    is over.
 
-    # modify the publish tree to indicate that we're now processing in background mode
-    manager.tree.root_item.properties["in_bg_process"] = True
-    manager.save(publish_tree)
+    :param tree: Publish Tree to go through
+    :param items: Set of the ids of the items to go through. If None, all the items will be considered.
+    :return: A tuple (item, task) or (None, None) if there is no item to process
+    """
 
-    # get the latest item of the tree - we'll need it later to update the statuses
-    # same for the task
     latest_item = None
-    for item in manager.tree:
+    for item in tree:
+        if items is not None and id(item) not in items:
+            continue
         if item.properties.get("uuid"):
             latest_item = item
+    if latest_item is None:
+        return None, None
+
     latest_task = None
     for task in latest_item.tasks:
         if task.active:
             latest_task = task
 
-    # open the file we want to perform operations on
-    session_path = manager.tree.root_item.properties.get("session_path")
+    return latest_item, latest_task
+
+
+def start_engine_from_snapshot(engine_name, snapshot_file_path):
+    """
+    Start the engine from the context serialized by the session which has launched the publish process, to avoid
+    resolving the pipeline configuration again.
+
+    :param engine_name: Name of the engine to start
+    :param snapshot_file_path: Path to the file where the context has been serialized
+    :return: The started engine or None if it couldn't be started from the snapshot
+    """
+
+    try:
+        with open(snapshot_file_path, "r") as fp:
+            serialized_context = fp.read()
+    except Exception as e:
+        logger.warning("Couldn't read the bootstrap snapshot: {}".format(e))
+        return None
+    finally:
+        # the snapshot contains the user credentials, don't leave it behind
+        if os.path.exists(snapshot_file_path):
+            os.remove(snapshot_file_path)
+
+    try:
+        # the user stored along with the context becomes the current user
+        context = sgtk.Context.deserialize(serialized_context)
+        return sgtk.platform.start_engine(engine_name, context.sgtk, context)
+    except Exception as e:
+        logger.warning(
+            "Couldn't start the engine from the bootstrap snapshot, bootstrapping it instead: {}".format(
+                e
+            )
+        )
+        return None
+
+
+def open_session(current_engine, engine_name, session_path):
+    """
+    Open the session work file in the host application.
+
+    :param current_engine: The engine running the publish process
+    :param engine_name: Name of the engine running the publish process
+    :param session_path: Path to the work file to open
+    """
+
     if engine_name == "tk-maya":
+        import maya.cmds as cmds
+
         cmds.file(session_path, open=True, force=True)
     elif engine_name == "tk-alias":
-        alias_api.open_file(session_path)
+        current_engine.alias_py.open_file(session_path)
     elif engine_name == "tk-vred":
+        import vrFileIO
+        import vrScenegraph
+
         vrFileIO.load(
             [session_path],
             vrScenegraph.getRootNode(),
@@ -215,65 +443,679 @@ def main(
             showImportOptions=False,
         )
 
-    # run publish() method for each task
-    # we're using a custom task iterator in order to be able to update the task status once an action is done
+
+def is_session_opened(current_engine, engine_name, session_path):
+    """
+    Check if a session work file is opened in the host application without any change.
+
+    :param current_engine: The engine running the publish process
+    :param engine_name: Name of the engine running the publish process
+    :param session_path: Path to the work file
+    :return: True if the work file is opened and hasn't been modified since, False otherwise or if it can't be known
+    """
+
+    if not session_path:
+        return False
+
+    if engine_name == "tk-maya":
+        import maya.cmds as cmds
+
+        current_path = cmds.file(query=True, sceneName=True)
+        modified = cmds.file(query=True, modified=True)
+    else:
+        # the state of the session can't be queried: consider it as changed
+        return False
+
+    if modified or not current_path:
+        return False
+    return os.path.normcase(os.path.normpath(current_path)) == os.path.normcase(
+        os.path.normpath(session_path)
+    )
+
+
+@contextlib.contextmanager
+def job_log_handler(job_folder, main_handler=None):
+    """
+    Write the logs to the log file of a job folder while the job is running.
+
+    :param job_folder: Path to the job folder
+    :param main_handler: Log handler of the process, detached while the job is running so its logs only end up in the
+        job log file
+    """
+
+    handler = logging.FileHandler(os.path.join(job_folder, "bg_publish.log"))
+    root_logger = sgtk.LogManager().root_logger
+    if main_handler:
+        root_logger.removeHandler(main_handler)
+    sgtk.LogManager().initialize_custom_handler(handler)
     try:
-        manager.publish(
-            task_generator=task_generator(
-                manager.tree,
-                monitor_file_path,
+        yield handler
+    finally:
+        root_logger.removeHandler(handler)
+        handler.close()
+        if main_handler:
+            root_logger.addHandler(main_handler)
+
+
+class JobProfiler(object):
+    """
+    Profile the stages of a publish job with cProfile.
+
+    Only the code run by the main thread is profiled: the tasks run in parallel by a :class:`ThreadedTaskRunner` don't
+    appear in the profiles.
+    """
+
+    # number of functions listed for each stage in the summary
+    SUMMARY_SIZE = 25
+
+    def __init__(self):
+        """
+        Class constructor
+        """
+        self.__profiles = []
+
+    @contextlib.contextmanager
+    def profile(self, stage):
+        """
+        Profile the code run within the context.
+
+        :param stage: Name of the stage the code belongs to
+        """
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running
+            profile = None
+
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self.__profiles.append((stage, profile))
+
+    def save(self, job_folder, name="bg_publish"):
+        """
+        Save the profiles in the job folder: the "<name>.prof" pstats file gathers all the stages, each stage also
+        having its own "<name>_<stage>.prof" file, while "<name>_profile.txt" summarizes the most expensive functions of
+        each stage.
+
+        :param job_folder: Path to the job folder
+        :param name: Prefix of the profile file names
+        """
+
+        if not self.__profiles:
+            return
+
+        # a stage run several times is reported once
+        stages = {}
+        for stage, profile in self.__profiles:
+            stages.setdefault(stage, []).append(profile)
+
+        try:
+            pstats.Stats(*[p for _, p in self.__profiles]).dump_stats(
+                os.path.join(job_folder, "{}.prof".format(name))
+            )
+
+            summary = io.StringIO()
+            for stage, profiles in stages.items():
+                stats = pstats.Stats(*profiles, stream=summary)
+                stats.dump_stats(
+                    os.path.join(job_folder, "{}_{}.prof".format(name, stage))
+                )
+                summary.write("==== {} ({:.3f}s) ====\n".format(stage, stats.total_tt))
+                stats.sort_stats("cumulative").print_stats(self.SUMMARY_SIZE)
+
+            with open(
+                os.path.join(job_folder, "{}_profile.txt".format(name)), "w"
+            ) as fp:
+                fp.write(summary.getvalue())
+
+        except Exception as e:
+            logger.warning("Couldn't save the job profiles: {}".format(e))
+
+
+def profile_stage(profiler, stage):
+    """
+    Profile the code run within the returned context if profiling is enabled.
+
+    :param profiler: The JobProfiler instance of the job, or None if profiling is disabled
+    :param stage: Name of the stage the code belongs to
+    :return: A context manager
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile(stage)
+
+
+def run_publish_job(
+    current_engine,
+    manager,
+    publish_tree,
+    monitor_file_path,
+    shard=0,
+    shard_count=1,
+    open_session_file=True,
+    startup_stages=None,
+    profiler=None,
+):
+    """
+    Run the publish and finalize steps of a publish tree, updating the monitor data as the tasks are processed.
+
+    In shard mode, the process only publishes the items of its shard. Shard 0 then waits for the other shards, merges
+    their publish trees and runs the finalize step of the whole tree.
+
+    :param current_engine: The engine running the publish process
+    :param manager: The publish manager to use to load and publish the tree
+    :param publish_tree: Path to the file to use to load the publish tree
+    :param monitor_file_path: Path to the file to use to monitor the publish process
+    :param shard: Index of the shard run by the process
+    :param shard_count: Number of processes publishing the tree
+    :param open_session_file: False if the session file of the tree has already been opened by the process. It is
+        opened again if the session has changed since, like when a previous job has saved it under a new version.
+    :param startup_stages: List of the (stage, start time, end time) tuples of the stages run by the process before the
+        job, like the engine bootstrap, to record in the monitor data of the job
+    :param profiler: JobProfiler instance used to profile the job stages, its profiles being saved in the job folder
+        once the job is done. If None, the job isn't profiled.
+    """
+
+    bg_publish_app = current_engine.apps.get("tk-multi-bg-publish")
+    job_folder = os.path.dirname(monitor_file_path)
+
+    # attribute the resources used by the process to the task being processed, sampling them each time the task
+    # changes
+    resource_sampler = None
+    on_in_flight_changed = None
+    sample_interval = bg_publish_app.get_setting("resource_sample_interval")
+    if sample_interval:
+        resource_sampler = bg_publish_app.resource_sampler.ResourceSampler(
+            interval=sample_interval / 1000.0
+        )
+        on_in_flight_changed = resource_sampler.task_changed
+
+    # keep the monitor data in memory to avoid reading the monitor file back each time a status changes
+    # all the shards write to the same event log but only shard 0 maintains the monitor file
+    # the status changes are also streamed to the open monitors
+    monitor_state = bg_publish_app.monitor_io.MonitorState(
+        monitor_file_path,
+        flush_interval=bg_publish_app.get_setting("monitor_flush_interval") / 1000.0,
+        owns_snapshot=shard == 0,
+        shared=shard_count > 1,
+        stream=bg_publish_app.get_setting("stream_progress"),
+        on_in_flight_changed=on_in_flight_changed,
+    )
+    for stage, start_time, end_time in startup_stages or []:
+        monitor_state.record_stage(stage, start_time, end_time)
+
+    if resource_sampler:
+        resource_sampler.start()
+
+    # let shard 0 know when the other shards are done
+    shard_status = None
+    if shard != 0:
+        shard_status = bg_publish_app.shards.ShardStatus(job_folder, shard)
+        shard_status.start()
+
+    published = False
+    try:
+        # load the publish tree
+        manager.load(publish_tree)
+
+        # modify the publish tree to indicate that we're now processing in background mode
+        # in shard mode, the launcher has already flagged the tree file read by all the shards: a shard never writes to
+        # it while the others may be loading it
+        manager.tree.root_item.properties["in_bg_process"] = True
+        if shard_count == 1:
+            manager.save(publish_tree)
+
+        # only go through the items of the current shard
+        items = None
+        if shard_count > 1:
+            item_shards = bg_publish_app.shards.get_item_shards(
+                manager.tree, shard_count
+            )
+            for item in manager.tree.root_item.children:
+                item.properties["bg_publish_shard"] = item_shards[id(item)]
+            items = set(i for i, s in item_shards.items() if s == shard)
+
+        # get the latest item of the tree - we'll need it later to update the statuses
+        # same for the task
+        latest_item, latest_task = get_latest_task(manager.tree, items)
+
+        session_opened = False
+
+        def prepare_session():
+            """
+            Open the file we want to perform operations on before the first step run by the process.
+            """
+
+            nonlocal session_opened
+            if session_opened:
+                return
+            session_opened = True
+
+            # the publish plugins of the previous job of a batch may have modified the session or saved it under
+            # another name
+            session_path = manager.tree.root_item.properties.get("session_path")
+            if open_session_file or not is_session_opened(
+                current_engine, current_engine.name, session_path
+            ):
+                with monitor_state.measure_stage("open_session"), profile_stage(
+                    profiler, "open_session"
+                ):
+                    open_session(current_engine, current_engine.name, session_path)
+
+        # run publish() method for each task
+        # we're using a custom task iterator in order to be able to update the task status once an action is done
+        if latest_item is None:
+            published = True
+        else:
+            prepare_session()
+
+            task_runner = create_task_runner(
+                bg_publish_app,
+                monitor_state,
+                lambda task: task.publish(),
                 bg_publish_app.constants.PUBLISH_IN_PROGRESS,
                 bg_publish_app.constants.PUBLISH_FINISHED,
+                bg_publish_app.constants.PUBLISH_FAILED,
             )
-        )
-        # change the status of the last task/item once everything is completed
-        change_progress_status(
-            monitor_file_path,
-            latest_item.properties.uuid,
-            bg_publish_app.constants.PUBLISH_FINISHED,
-            task_uuid=latest_task.settings["Task UUID"].value,
-        )
+            try:
+                with monitor_state.measure_stage("publish"), profile_stage(
+                    profiler, "publish"
+                ):
+                    manager.publish(
+                        task_generator=task_generator(
+                            manager.tree,
+                            monitor_state,
+                            bg_publish_app.constants.PUBLISH_IN_PROGRESS,
+                            bg_publish_app.constants.PUBLISH_FINISHED,
+                            items=items,
+                            task_runner=task_runner,
+                        )
+                    )
+                # change the status of the last task/item once everything is completed
+                change_progress_status(
+                    monitor_state,
+                    latest_item.properties.uuid,
+                    bg_publish_app.constants.PUBLISH_FINISHED,
+                    task_uuid=latest_task.settings["Task UUID"].value,
+                )
+                monitor_state.flush()
+                published = True
 
-    # if an error occurred during the publish process, try to find which task has failed and update the status
-    # accordingly
-    except Exception as e:
-        current_engine.logger.error(
-            "Error happening during publish process: {} ".format(e)
-        )
-        change_failed_task_status(
-            monitor_file_path,
-            bg_publish_app.constants.PUBLISH_IN_PROGRESS,
-            bg_publish_app.constants.PUBLISH_FAILED,
-        )
+            # if an error occurred during the publish process, try to find which task has failed and update the
+            # status accordingly
+            except Exception as e:
+                current_engine.logger.error(
+                    "Error happening during publish process: {} ".format(e)
+                )
+                if task_runner:
+                    task_runner.shutdown()
+                change_failed_task_status(
+                    monitor_state, bg_publish_app.constants.PUBLISH_FAILED
+                )
 
-    # if all the publish tasks have been done without failing, run finalize() method
-    else:
-        try:
-            manager.finalize(
-                task_generator=task_generator(
-                    manager.tree,
-                    monitor_file_path,
-                    bg_publish_app.constants.FINALIZE_IN_PROGRESS,
+        if shard_count > 1:
+            # the finalize step needs the properties set by the other shards during the publish step: each shard saves
+            # its tree to its own file, which are merged by shard 0 once all the shards are done
+            if published:
+                manager.save(
+                    bg_publish_app.shards.get_shard_tree_path(job_folder, shard)
+                )
+            if shard != 0:
+                return
+
+            def fail_shard_tasks(dead_shard):
+                """
+                Flag the tasks a dead shard hasn't published as failed, as they would be displayed as running forever.
+
+                :param dead_shard: Index of the shard whose process has died
+                """
+                monitor_state.fail_unfinished_tasks(
+                    [
+                        task.settings["Task UUID"].value
+                        for item in manager.tree
+                        if item_shards.get(id(item)) == dead_shard
+                        for task in item.tasks
+                        if task.active
+                    ],
+                    bg_publish_app.constants.PUBLISH_FAILED,
+                )
+
+            with monitor_state.measure_stage("wait_for_shards"):
+                published = (
+                    bg_publish_app.shards.wait_for_shards(
+                        job_folder, shard_count, on_shard_died=fail_shard_tasks
+                    )
+                    and published
+                )
+            if published:
+                bg_publish_app.shards.merge_shard_trees(
+                    publish_tree, job_folder, shard_count
+                )
+                manager.load(publish_tree)
+                latest_item, latest_task = get_latest_task(manager.tree)
+
+        # if all the publish tasks have been done without failing, run finalize() method
+        # in shard mode, shard 0 may not have published any item and still have to open the session to finalize the
+        # items of the other shards
+        if published and latest_item is not None:
+            prepare_session()
+
+            task_runner = create_task_runner(
+                bg_publish_app,
+                monitor_state,
+                lambda task: task.finalize(),
+                bg_publish_app.constants.FINALIZE_IN_PROGRESS,
+                bg_publish_app.constants.FINALIZE_FINISHED,
+                bg_publish_app.constants.FINALIZE_FAILED,
+            )
+            try:
+                with monitor_state.measure_stage("finalize"), profile_stage(
+                    profiler, "finalize"
+                ):
+                    manager.finalize(
+                        task_generator=task_generator(
+                            manager.tree,
+                            monitor_state,
+                            bg_publish_app.constants.FINALIZE_IN_PROGRESS,
+                            bg_publish_app.constants.FINALIZE_FINISHED,
+                            task_runner=task_runner,
+                        )
+                    )
+                change_progress_status(
+                    monitor_state,
+                    latest_item.properties.uuid,
                     bg_publish_app.constants.FINALIZE_FINISHED,
+                    task_uuid=latest_task.settings["Task UUID"].value,
+                )
+                monitor_state.flush()
+
+            # if an error occurred during the publish process, try to find which task has failed and update the status
+            # accordingly
+            except Exception as e:
+                current_engine.logger.error(
+                    "Error happening during finalize process: {} ".format(e)
+                )
+                if task_runner:
+                    task_runner.shutdown()
+                change_failed_task_status(
+                    monitor_state, bg_publish_app.constants.FINALIZE_FAILED
+                )
+
+    finally:
+        # the resources are saved before the monitor data are closed so they are available once the job is over
+        if resource_sampler:
+            try:
+                resource_sampler.stop()
+            except Exception as e:
+                logger.warning("Couldn't stop sampling the job resources: {}".format(e))
+            try:
+                resource_sampler.save(
+                    bg_publish_app.resource_sampler.get_resources_file_path(
+                        job_folder, shard
+                    )
                 )
+            except Exception as e:
+                logger.warning("Couldn't save the job resources: {}".format(e))
+        if shard_status:
+            shard_status.finish(published)
+        monitor_state.close()
+        if profiler:
+            profiler.save(
+                job_folder,
+                name="bg_publish_shard{}".format(shard)
+                if shard_count > 1
+                else "bg_publish",
             )
-            change_progress_status(
-                monitor_file_path,
-                latest_item.properties.uuid,
-                bg_publish_app.constants.FINALIZE_FINISHED,
-                task_uuid=latest_task.settings["Task UUID"].value,
+
+
+def serve_jobs(
+    current_engine,
+    entity_dict,
+    spool_folder,
+    idle_timeout,
+    startup_stages=None,
+    profiler=None,
+):
+    """
+    Run the publish jobs sent to a warm worker one after another, until no job has been received for a while.
+
+    :param current_engine: The engine bootstrapped by the worker
+    :param entity_dict: Flow Production Tracking dictionary of the entity used to bootstrap the engine
+    :param spool_folder: Path to the folder where the job requests are written
+    :param idle_timeout: Delay (in seconds) without any job after which the worker exits
+    :param startup_stages: List of the (stage, start time, end time) tuples of the stages run to start the worker,
+        recorded in the monitor data of the first job
+    :param profiler: JobProfiler instance which has profiled the worker startup, used to profile the first job
+    """
+
+    # the engine and the publish manager are kept from one job to the other, they are only created again when a job
+    # needs another context
+    state = {
+        "engine": current_engine,
+        "entity": entity_dict,
+        "manager": None,
+        "startup_stages": startup_stages or [],
+        "profiler": profiler,
+    }
+
+    def run_request(request):
+        """
+        Switch to the context of a job request and run it.
+
+        :param request: Dictionary describing the job, with the "publish_tree", "monitor_file" and "entity" keys
+        """
+
+        # only the first job pays for the worker startup
+        stages = state["startup_stages"]
+        state["startup_stages"] = []
+        profiler = None
+        if request.get("profile"):
+            profiler = state["profiler"] or JobProfiler()
+        state["profiler"] = None
+
+        if request.get("entity") != state["entity"]:
+            start_time = time.time()
+            with profile_stage(profiler, "change_context"):
+                context = state["engine"].sgtk.context_from_entity_dictionary(
+                    request["entity"]
+                )
+                sgtk.platform.change_context(context)
+            state["engine"] = sgtk.platform.current_engine()
+            state["entity"] = request.get("entity")
+            state["manager"] = None
+            stages.append(("change_context", start_time, time.time()))
+
+        if state["manager"] is None:
+            publish_app = state["engine"].apps.get("tk-multi-publish2")
+            state["manager"] = publish_app.create_publish_manager(
+                publish_logger=state["engine"].logger
             )
 
-        # if an error occurred during the publish process, try to find which task has failed and update the status
-        # accordingly
+        run_publish_job(
+            state["engine"],
+            state["manager"],
+            request["publish_tree"],
+            request["monitor_file"],
+            startup_stages=stages,
+            profiler=profiler,
+        )
+
+    def run_job(request):
+        """
+        Run a single job request.
+
+        :param request: Dictionary describing the job, with the "publish_tree", "monitor_file" and "entity" keys
+        """
+
+        # each job has its own log file stored in the job folder
+        try:
+            with job_log_handler(os.path.dirname(request["monitor_file"])):
+                run_request(request)
+
+        # a job failure must not stop the worker
         except Exception as e:
-            current_engine.logger.error(
-                "Error happening during finalize process: {} ".format(e)
+            state["engine"].logger.exception(
+                "Error happening during background publish job {}: {}".format(
+                    request["publish_tree"], e
+                )
             )
-            change_failed_task_status(
+
+    bg_publish_app = current_engine.apps.get("tk-multi-bg-publish")
+    bg_publish_app.worker_spool.serve(spool_folder, run_job, idle_timeout)
+
+    return state["engine"]
+
+
+def main(
+    engine_name,
+    pipeline_config_id,
+    entity_dict,
+    publish_tree,
+    monitor_file_path,
+    options=None,
+):
+    """
+    Main function of the script which launch the background publishing process.
+    It will be responsible for:
+     - initializing the environment
+     - bootstrapping the engine
+     - open the session work file
+     - use the Publish API to create a manager and run the publish/finalize steps
+    The statuses are kept in memory: as soon as a step for a task is done, the task status will be appended to the
+    monitor event log while the monitor.yml snapshot is written at a bounded rate and at phase boundaries. These files
+    will be used by the monitor UI to display the publish progress.
+
+    When the "worker_spool" option is set, the process runs as a warm worker: once bootstrapped, it runs all the jobs
+    written to the spool folder one after another and exits after "idle_timeout" seconds without any job.
+
+    :param engine_name: Name of the engine to launch
+    :param pipeline_config_id: ID of the pipeline config to use when bootstrapping the engine
+    :param entity_dict: Flow Production Tracking dictionary of the entity to use when bootstrapping the engine
+    :param publish_tree: Path to the file to use to load the publish tree. Ignored by a warm worker which reads its
+        jobs from the spool folder.
+    :param monitor_file_path: Path to the file to use to monitor the publish process. Ignored by a warm worker which
+        reads its jobs from the spool folder.
+    :param options: Dictionary of extra options:
+        - bootstrap_snapshot: path to the context serialized by the launching session, used to start the engine
+          without bootstrapping it
+        - worker_spool: path to the spool folder served by a warm worker
+        - idle_timeout: delay (in seconds) without any job after which a warm worker exits
+        - shard, shard_count: index of the shard run by the process and number of processes publishing the tree
+        - batch: list of the (publish tree, monitor file) pairs of the jobs run one after another by the process, all
+          of them publishing the same session file. The session is only opened once and each job keeps its own log file
+        - profile: if True, the process runs under cProfile and saves the profiles of each job in its job folder
+    """
+
+    options = options or {}
+    spool_folder = options.get("worker_spool")
+
+    # initialize a log handler
+    if spool_folder:
+        log_path = os.path.join(spool_folder, "worker.log")
+    else:
+        log_path = os.path.join(os.path.dirname(monitor_file_path), "bg_publish.log")
+    log_handler = logging.FileHandler(log_path)
+    sgtk.LogManager().initialize_custom_handler(log_handler)
+
+    # the stages run before the monitor data are opened are timed and profiled here, and recorded once the job starts
+    startup_stages = []
+    profiler = JobProfiler() if options.get("profile") else None
+
+    # start the engine from the environment already resolved by the launching session if possible, otherwise
+    # bootstrap it
+    start_time = time.time()
+    with profile_stage(profiler, "bootstrap"):
+        current_engine = None
+        if options.get("bootstrap_snapshot"):
+            current_engine = start_engine_from_snapshot(
+                engine_name, options["bootstrap_snapshot"]
+            )
+        if current_engine is None:
+            mgr = sgtk.bootstrap.ToolkitManager()
+            mgr.plugin_id = "basic.desktop"
+            mgr.pipeline_configuration = pipeline_config_id
+            current_engine = mgr.bootstrap_engine(engine_name, entity_dict)
+    startup_stages.append(("bootstrap", start_time, time.time()))
+
+    # initialize the environment
+    start_time = time.time()
+    with profile_stage(profiler, "initialize"):
+        if engine_name == "tk-maya":
+            import maya.standalone
+
+            maya.standalone.initialize()
+
+            # import pymel to be sure everything has been sourced and imported
+            import pymel.core as pm
+        elif engine_name == "tk-vred":
+            import vrController
+    startup_stages.append(("initialize", start_time, time.time()))
+
+    try:
+        if spool_folder:
+            current_engine = serve_jobs(
+                current_engine,
+                entity_dict,
+                spool_folder,
+                options.get("idle_timeout", 300),
+                startup_stages=startup_stages,
+                profiler=profiler,
+            )
+        elif options.get("batch"):
+            publish_app = current_engine.apps.get("tk-multi-publish2")
+            manager = publish_app.create_publish_manager(publish_logger=log_handler)
+
+            # all the jobs of the batch publish the same session file: it is opened by the first job and only opened
+            # again when a job has changed it
+            for i, (job_tree, job_monitor_file_path) in enumerate(options["batch"]):
+                # the first job logs to the main log file which already lives in its job folder and gets the startup
+                # profiles
+                if i == 0:
+                    job_log = contextlib.nullcontext()
+                    job_profiler = profiler
+                else:
+                    job_log = job_log_handler(
+                        os.path.dirname(job_monitor_file_path), log_handler
+                    )
+                    job_profiler = JobProfiler() if profiler else None
+                try:
+                    with job_log:
+                        run_publish_job(
+                            current_engine,
+                            manager,
+                            job_tree,
+                            job_monitor_file_path,
+                            open_session_file=i == 0,
+                            startup_stages=startup_stages if i == 0 else None,
+                            profiler=job_profiler,
+                        )
+
+                # a job failure must not prevent the next jobs of the batch from running
+                except Exception as e:
+                    current_engine.logger.exception(
+                        "Error happening during background publish job {}: {}".format(
+                            job_tree, e
+                        )
+                    )
+        else:
+            # load the publish tree
+            # manager = publish_app.create_publish_manager(publish_logger=current_engine.logger)
+            publish_app = current_engine.apps.get("tk-multi-publish2")
+            manager = publish_app.create_publish_manager(publish_logger=log_handler)
+            run_publish_job(
+                current_engine,
+                manager,
+                publish_tree,
                 monitor_file_path,
-                bg_publish_app.constants.FINALIZE_IN_PROGRESS,
-                bg_publish_app.constants.FINALIZE_FAILED,
+                shard=options.get("shard", 0),
+                shard_count=options.get("shard_count", 1),
+                startup_stages=startup_stages,
+                profiler=profiler,
             )
 
     finally:
@@ -291,4 +1133,5 @@ if __name__ == "__main__":
         ast.literal_eval(sys.argv[3]),
         sys.argv[4],
         sys.argv[5],
+        ast.literal_eval(sys.argv[6]) if len(sys.argv) > 6 else None,
     )